@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# Runs Metal on a batch of samples listed in a manifest, with a pool of worker processes
+# each worker opens the reference once and keeps it for every sample it runs,
+# and a sample that fails is reported without stopping the rest of the batch
+# Called as
+# 	python metal.py batch --manifest [samples tsv] -r [fasta ref] --jobs N
+# where the manifest is a TSV with a header row naming the columns in MANIFEST_COLUMNS
+
+from concurrent.futures import as_completed, ProcessPoolExecutor
+from contextlib import redirect_stdout
+import csv
+from metal import CALLER_VCF_KEYS, DIST_THRESHOLD, SORT_MEMORY, run_metal
+from pathlib import Path
+from reference import get_worker_reference, open_worker_reference
+import time
+import traceback
+from types import SimpleNamespace
+from typing import Dict, List
+
+# constants
+# columns of the manifest: a sample name, the callers' VCFs, and the sample's output directory
+VCF_COLUMNS: Dict[str, str] = {key: f"{key}_vcf" for key in CALLER_VCF_KEYS.values()}
+MANIFEST_COLUMNS = ["sample"] + list(VCF_COLUMNS.values()) + ["output_dir"]
+# each sample's output from Metal is logged to this file in its output directory
+LOG_NAME = "metal.log"
+
+# Outcome of running Metal on one sample
+class SampleStatus(SimpleNamespace):
+	sample: str
+
+	succeeded: bool
+
+	# wall time taken
+	seconds: float
+
+	# why the sample failed, or None if it succeeded
+	error: str
+
+# read the samples in a manifest, as a dict of column values per sample
+def read_manifest(manifest: Path) -> List[Dict[str, str]]:
+
+	with open(manifest, newline="") as m:
+		reader = csv.DictReader((line for line in m if line.strip()), delimiter="\t")
+		samples: [Dict[str, str]] = list(reader)
+		missing_columns = [column for column in MANIFEST_COLUMNS if column not in (reader.fieldnames or [])]
+
+	assert not missing_columns, f"Manifest {manifest} is missing columns: {', '.join(missing_columns)}"
+	names = [sample["sample"] for sample in samples]
+	duplicates = sorted({name for name in names if names.count(name) > 1})
+	assert not duplicates, f"Manifest {manifest} lists samples more than once: {', '.join(duplicates)}"
+	return samples
+
+# run Metal on one sample of a manifest, logging its output to its output directory
+# (or, if resume, finish a run of it that stopped partway, appending to its log)
+def run_sample(sample: Dict[str, str], ref_fasta: str, dist_threshold: int, backend: str, sort_memory: int,
+	resume: bool = False) -> SampleStatus:
+
+	start = time.time()
+	output_dir = Path(sample["output_dir"])
+	try:
+		output_dir.mkdir(parents=True, exist_ok=True)
+		with open(output_dir / LOG_NAME, "a" if resume else "w") as log, redirect_stdout(log):
+			try:
+				vcfs = {key: sample[column] for key, column in VCF_COLUMNS.items()}
+				run_metal(vcfs, Path(ref_fasta), output_dir, dist_threshold, backend=backend, sort_memory=sort_memory,
+					fasta=get_worker_reference(), resume=resume)
+				print("Done.")
+			except Exception:
+				traceback.print_exc(file=log)
+				raise
+	except Exception as e:
+		return SampleStatus(sample=sample["sample"], succeeded=False, seconds=time.time() - start,
+			error=f"{type(e).__name__}: {e}")
+
+	return SampleStatus(sample=sample["sample"], succeeded=True, seconds=time.time() - start, error=None)
+
+# run Metal on every sample in a manifest, jobs samples at a time, printing each sample's status as it finishes
+# if resume, runs of samples that stopped partway are finished, and samples that finished are skipped
+def run_batch(manifest: Path, ref_fasta: Path, jobs: int = 1, dist_threshold: int = DIST_THRESHOLD,
+	backend: str = "sweep", sort_memory: int = SORT_MEMORY, resume: bool = False) -> List[SampleStatus]:
+
+	samples = read_manifest(manifest)
+	print(f"Running {len(samples)} samples with {jobs} processes...")
+
+	statuses: [SampleStatus] = []
+	with ProcessPoolExecutor(max_workers=jobs, initializer=open_worker_reference, initargs=(str(ref_fasta),)) as executor:
+		futures = {
+			executor.submit(run_sample, sample, str(ref_fasta), dist_threshold, backend, max(sort_memory // jobs, 1),
+				resume): sample
+			for sample in samples
+		}
+		for future in as_completed(futures):
+			sample = futures[future]
+			try:
+				status: SampleStatus = future.result()
+			except Exception as e:
+				# the worker itself failed (e.g., it was killed), rather than Metal
+				status = SampleStatus(sample=sample["sample"], succeeded=False, seconds=0, error=f"{type(e).__name__}: {e}")
+			statuses.append(status)
+
+			outcome = "done" if status.succeeded else f"FAILED ({status.error})"
+			print(f"[{len(statuses)}/{len(samples)}] {status.sample}: {outcome} in {status.seconds:.1f}s")
+
+	failed = [status.sample for status in statuses if not status.succeeded]
+	print(f"{len(statuses) - len(failed)} of {len(statuses)} samples succeeded")
+	if failed:
+		print(f"Failed samples (see {LOG_NAME} in their output directories): {', '.join(failed)}")
+	return statuses
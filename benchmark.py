@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+# Benchmarks each stage of Metal on synthetic inputs
+# generates a reference FASTA and a VCF for each caller (see generate_inputs), with a chosen number of breakpoints,
+# then times extracting breakpoints, comparing them (with each backend), sorting the output,
+# writing VCFs (makeVCFs.py) and encoding a caller's VCF (encode.py), each in a fresh process,
+# reporting records per second and peak memory (RSS) of every stage
+# Called as
+# 	python benchmark.py [work dir] --breakpoints 1000000
+# inputs are kept in ${work dir}/inputs and reused by later runs with the same options
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+import csv
+import heapq
+import importlib.util
+import json
+import multiprocessing
+from pathlib import Path
+import pysam
+import random
+import resource
+import shutil
+import sys
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+# constants
+CHROMS = list(str(c) for c in range(1, 23)) + ["X", "Y"]
+CALLERS = ["scotch", "deepvariant", "gatkhc", "varscan", "pindell"]
+# caller whose VCF is encoded by the encode stage
+ENCODE_CALLER = "gatkhc"
+STAGES = ["extract", "compare", "sort", "make_vcfs", "encode"]
+BACKENDS = ["sweep", "numpy"]
+DIST_THRESHOLD = 3
+SORT_MEMORY = 1024
+
+# defaults of the synthetic inputs
+BREAKPOINTS = 1000000
+# chance that an indel is called by several callers, rather than just one
+OVERLAP = 0.5
+# chance that each caller calls an indel called by several callers
+CALL_RATE = 0.8
+# chance that a record has two alternate alleles
+MULTIALLELIC = 0.05
+# chance that a Pindel deletion is a <DEL> record with an END, rather than having its alleles
+PINDEL_DEL = 0.5
+# chance that a site is a SNV, which has no breakpoints
+SNV_RATE = 0.1
+# mean distance between sites
+SITE_GAP = 20
+SEED = 1
+
+# callers' positions for the same indel differ by up to this many bases
+JITTER = 3
+MAX_INDEL_LENGTH = 50
+# sites are at least this far from each other and from contig ends, so records stay sorted
+MIN_SITE_GAP = 2 * JITTER + 1
+CONTIG_MARGIN = 2 * MAX_INDEL_LENGTH
+# length of contigs without sites, which the reference must still have for ##contig headers
+EMPTY_CONTIG_LENGTH = 1000
+FASTA_LINE_LENGTH = 60
+# sites simulated to estimate the breakpoints per site
+PILOT_SITES = 10000
+
+VCF_HEADER = "##fileformat=VCFv4.1\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tSAMPLE\n"
+
+# Writes a caller's VCF records sorted by position, holding those written ahead of the sites being generated
+# (a Scotch deletion's <DEL_R> record is written with its <DEL_L>)
+class SortedVCFWriter:
+
+	def __init__(self, vcf: Any) -> None:
+		self.vcf = vcf
+		self.heap = []
+		self.count = 0
+
+	def write(self, pos: int, line: str) -> None:
+		heapq.heappush(self.heap, (pos, self.count, line))
+		self.count += 1
+
+	# write held records at positions before pos, or all held records if pos is None
+	def flush(self, pos: int = None) -> None:
+		while self.heap and (pos is None or self.heap[0][0] < pos):
+			self.vcf.write(heapq.heappop(self.heap)[2])
+
+# a VCF record line
+def get_record(chrom: str, pos: int, ref: str, alt: str, info: str = ".") -> str:
+	return f"{chrom}\t{pos}\t.\t{ref}\t{alt}\t50\tPASS\t{info}\tGT\t0/1\n"
+
+# records (position, line) each caller makes for a site at pos on a contig with sequence seq,
+# and the number of breakpoints Metal extracts from them
+def get_site_records(rng: random.Random, chrom: str, seq: str, pos: int, overlap: float, multiallelic: float,
+	pindel_del: float) -> Tuple[Dict[str, List[Tuple[int, str]]], int]:
+
+	if rng.random() < overlap:
+		callers = [caller for caller in CALLERS if rng.random() < CALL_RATE] or [rng.choice(CALLERS)]
+	else:
+		callers = [rng.choice(CALLERS)]
+
+	kind = "snv" if rng.random() < SNV_RATE else rng.choice(["del", "ins"])
+	length = rng.randint(1, MAX_INDEL_LENGTH)
+	inserted = "".join(rng.choices("ACGT", k=length))
+
+	records: Dict[str, List[Tuple[int, str]]] = {}
+	breakpoint_count = 0
+	for caller in callers:
+		p = pos + rng.randint(-JITTER, JITTER)
+		anchor = seq[p - 1]
+		deleted = seq[p - 1:p + length]
+		if kind == "snv":
+			caller_records = [(p, get_record(chrom, p, anchor, "T" if anchor != "T" else "A"))]
+		elif caller == "scotch":
+			# Scotch reports breakpoints, rather than alleles
+			if kind == "del":
+				caller_records = [(p, get_record(chrom, p, anchor, "<DEL_L>")), (p + length, get_record(chrom, p + length, seq[p + length - 1], "<DEL_R>"))]
+			else:
+				caller_records = [(p, get_record(chrom, p, anchor, "<INS>"))]
+			breakpoint_count += len(caller_records)
+		elif caller == "pindell" and kind == "ins":
+			caller_records = [(p, get_record(chrom, p, anchor, "<INS>"))]
+			breakpoint_count += 1
+		elif caller == "pindell" and rng.random() < pindel_del:
+			caller_records = [(p, get_record(chrom, p, anchor, "<DEL>", f"END={p + length};HOMLEN=1"))]
+			breakpoint_count += 2
+		elif rng.random() < multiallelic:
+			# multiallelic records are skipped by extraction, but encoded
+			caller_records = [(p, get_record(chrom, p, deleted, f"{anchor},{deleted}{inserted}"))]
+		elif kind == "del":
+			caller_records = [(p, get_record(chrom, p, deleted, anchor))]
+			breakpoint_count += 2
+		else:
+			caller_records = [(p, get_record(chrom, p, anchor, anchor + inserted))]
+			breakpoint_count += 1
+		records[caller] = caller_records
+
+	return (records, breakpoint_count)
+
+# mean breakpoints extracted per site, from a simulation of PILOT_SITES sites
+def get_breakpoints_per_site(overlap: float, multiallelic: float, pindel_del: float, seed: int) -> float:
+	rng = random.Random(seed)
+	seq = "A" * (2 * CONTIG_MARGIN)
+	breakpoint_count = sum(get_site_records(rng, "1", seq, CONTIG_MARGIN, overlap, multiallelic, pindel_del)[1]
+		for _ in range(PILOT_SITES))
+	return breakpoint_count / PILOT_SITES
+
+# write a random reference FASTA (and its index) and a sorted VCF for each caller to input_dir,
+# with about breakpoints breakpoints, over the first contigs of CHROMS
+# returns the number of breakpoints the VCFs have
+def generate_inputs(input_dir: Path, breakpoints: int = BREAKPOINTS, contigs: int = len(CHROMS), overlap: float = OVERLAP,
+	multiallelic: float = MULTIALLELIC, pindel_del: float = PINDEL_DEL, site_gap: int = SITE_GAP, seed: int = SEED) -> int:
+
+	assert site_gap >= MIN_SITE_GAP, f"Sites must be at least {MIN_SITE_GAP} bases apart"
+	rng = random.Random(seed)
+	sites_per_contig = int(breakpoints / get_breakpoints_per_site(overlap, multiallelic, pindel_del, seed) / contigs) + 1
+	contig_length = sites_per_contig * site_gap + 2 * CONTIG_MARGIN
+	print(f"Generating {contigs} contigs of {contig_length} bases with about {sites_per_contig} sites each...")
+
+	input_dir.mkdir(parents=True, exist_ok=True)
+	vcfs = {caller: open(input_dir / f"{caller}.vcf", "w") for caller in CALLERS}
+	writers = {caller: SortedVCFWriter(vcf) for caller, vcf in vcfs.items()}
+	for vcf in vcfs.values():
+		vcf.write(VCF_HEADER)
+
+	breakpoint_count = 0
+	fasta_path = input_dir / "ref.fa"
+	with open(fasta_path, "w") as fasta:
+		for idx, chrom in enumerate(CHROMS):
+			length = contig_length if idx < contigs else EMPTY_CONTIG_LENGTH
+			seq = "".join(rng.choices("ACGT", k=length))
+			fasta.write(f">{chrom}\n")
+			for start in range(0, length, FASTA_LINE_LENGTH):
+				fasta.write(f"{seq[start:start + FASTA_LINE_LENGTH]}\n")
+			if idx >= contigs:
+				continue
+
+			pos = CONTIG_MARGIN
+			for _ in range(sites_per_contig):
+				pos += MIN_SITE_GAP + rng.randrange(2 * (site_gap - MIN_SITE_GAP) + 1)
+				if pos >= length - CONTIG_MARGIN:
+					break
+				for writer in writers.values():
+					writer.flush(pos - JITTER)
+				(records, site_breakpoints) = get_site_records(rng, chrom, seq, pos, overlap, multiallelic, pindel_del)
+				for caller, caller_records in records.items():
+					for (p, line) in caller_records:
+						writers[caller].write(p, line)
+				breakpoint_count += site_breakpoints
+
+			for writer in writers.values():
+				writer.flush()
+
+	for vcf in vcfs.values():
+		vcf.close()
+	pysam.faidx(str(fasta_path))
+	return breakpoint_count
+
+# peak memory (RSS) of this process, in MB
+def get_peak_rss() -> float:
+	peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	# in bytes on macOS, KB elsewhere
+	return peak_rss / (1024 * 1024) if sys.platform == "darwin" else peak_rss / 1024
+
+# stages, each taking (input dir, output dir) and returning the number of records it processed
+
+# extract each caller's breakpoints into a store: breakpoints extracted
+def extract(input_dir: Path, output_dir: Path) -> int:
+	from breakpointStore import extract_store, BreakpointStore
+	count = 0
+	for caller in CALLERS:
+		store_path = output_dir / f"{caller}.bps"
+		extract_store(str(input_dir / f"{caller}.vcf"), store_path)
+		count += len(BreakpointStore(store_path).columns["position"])
+	return count
+
+# compare the breakpoints in the stores with a backend, writing metal.unsorted.tsv: breakpoints compared
+def compare(input_dir: Path, output_dir: Path, backend: str) -> int:
+	from breakpointStore import BreakpointStore
+	from metal import compare_calls, get_contig_ranks
+	stores = {caller: str(output_dir / f"{caller}.bps") for caller in CALLERS}
+	contig_ranks = get_contig_ranks(input_dir / "ref.fa")
+	with open(output_dir / f"metal.unsorted.{backend}.tsv", "w", newline="") as output:
+		compare_calls(stores, contig_ranks, csv.writer(output, delimiter="\t"), DIST_THRESHOLD, backend)
+	return sum(len(BreakpointStore(store).columns["position"]) for store in stores.values())
+
+# sort the output of the sweep, writing metal.tsv: lines written
+def sort(input_dir: Path, output_dir: Path) -> int:
+	from metal import get_contig_ranks, sort_output, write_sorted_output
+	contig_ranks = get_contig_ranks(input_dir / "ref.fa")
+	sorted_lines = sort_output(output_dir / "metal.unsorted.sweep.tsv", contig_ranks, SORT_MEMORY)
+	return sum(1 for _ in write_sorted_output(sorted_lines, output_dir / "metal.tsv"))
+
+# write metal.tsv as metal.vcf and the encoded VCFs: results written
+def make_vcfs(input_dir: Path, output_dir: Path) -> int:
+	from makeVCFs import write_vcfs
+	from reference import open_reference
+	count = 0
+	def count_rows(rows: Any) -> Any:
+		nonlocal count
+		for row in rows:
+			count += 1
+			yield row
+	with open(output_dir / "metal.tsv") as tsv, open_reference(input_dir / "ref.fa") as fasta:
+		write_vcfs(count_rows(csv.reader(tsv, delimiter="\t")), fasta, str(output_dir / "metal"))
+	return count
+
+# encode a caller's VCF: records encoded
+def encode(input_dir: Path, output_dir: Path) -> int:
+	import encode as encoder
+	from getBreakpoints import open_vcf
+	from reference import open_reference
+	vcf_path = input_dir / f"{ENCODE_CALLER}.vcf"
+	encoded_vcfs = {name: open(output_dir / f"{ENCODE_CALLER}.encode_{name}.vcf", "w") for name in encoder.ENCODED_VCF_NAMES}
+	with open_reference(input_dir / "ref.fa") as fasta, open_vcf(str(vcf_path)) as lines:
+		encoder.encode_variants(lines, encoded_vcfs, fasta)
+	for vcf in encoded_vcfs.values():
+		vcf.close()
+	with open(vcf_path) as vcf:
+		return sum(1 for line in vcf if not line.startswith("#"))
+
+# run a stage, returning (records, wall seconds, CPU seconds, peak RSS in MB)
+# run in a fresh process for each stage, so peak RSS is the stage's own; the stage's messages go to a log
+def run_stage(stage: Callable[..., int], input_dir: Path, output_dir: Path, log_path: Path,
+	*args: Any) -> Tuple[int, float, float, float]:
+
+	with open(log_path, "a") as log, redirect_stdout(log):
+		start = time.perf_counter()
+		cpu_start = time.process_time()
+		records = stage(input_dir, output_dir, *args)
+		seconds = time.perf_counter() - start
+		cpu_seconds = time.process_time() - cpu_start
+	return (records, seconds, cpu_seconds, get_peak_rss())
+
+# run stages, each in a fresh process, returning a result per stage run
+# (the compare stage is run once per backend; numpy is skipped if it isn't installed)
+def run_benchmark(input_dir: Path, output_dir: Path, stages: List[str] = STAGES,
+	backends: List[str] = BACKENDS) -> List[Dict[str, Any]]:
+
+	if "numpy" in backends and importlib.util.find_spec("numpy") is None:
+		print("NumPy isn't installed, so skipping the numpy backend")
+		backends = [backend for backend in backends if backend != "numpy"]
+
+	runs: [Tuple[str, Callable[..., int], Tuple]] = []
+	for stage in stages:
+		if stage == "compare":
+			runs.extend((f"compare ({backend})", compare, (backend,)) for backend in backends)
+		else:
+			runs.append((stage, globals()[stage], ()))
+
+	output_dir.mkdir(parents=True, exist_ok=True)
+	log_path = output_dir / "benchmark.log"
+	results: [Dict[str, Any]] = []
+	spawn = multiprocessing.get_context("spawn")
+	for (name, stage, args) in runs:
+		with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as executor:
+			(records, seconds, cpu_seconds, peak_rss) = executor.submit(run_stage, stage, input_dir, output_dir,
+				log_path, *args).result()
+		result = {
+			"stage": name,
+			"records": records,
+			"seconds": round(seconds, 3),
+			"cpu_seconds": round(cpu_seconds, 3),
+			"records_per_second": round(records / seconds) if seconds else 0,
+			"peak_rss_mb": round(peak_rss, 1)
+		}
+		print(f"{name}: {records} records in {seconds:.2f}s ({result['records_per_second']} records/s), peak RSS {peak_rss:.1f} MB")
+		results.append(result)
+	return results
+
+if __name__ == "__main__":
+
+	# parse args
+	parser = argparse.ArgumentParser(description="Benchmark each stage of Metal on synthetic inputs")
+	parser.add_argument("work_dir", type=str, help="Path to directory for inputs (kept in ${work_dir}/inputs) and outputs")
+	parser.add_argument("-n", "--breakpoints", default=BREAKPOINTS, type=int,
+		help=f"About how many breakpoints the callers' VCFs have in all (default: {BREAKPOINTS})")
+	parser.add_argument("--contigs", default=len(CHROMS), type=int,
+		help=f"Number of contigs with calls, of the {len(CHROMS)} in the reference (default: {len(CHROMS)})")
+	parser.add_argument("--overlap", default=OVERLAP, type=float,
+		help=f"Chance that an indel is called by several callers, rather than just one (default: {OVERLAP})")
+	parser.add_argument("--multiallelic", default=MULTIALLELIC, type=float,
+		help=f"Chance that a record has two alternate alleles (default: {MULTIALLELIC})")
+	parser.add_argument("--pindel_del", default=PINDEL_DEL, type=float,
+		help=f"Chance that a Pindel deletion is a <DEL> record with an END (default: {PINDEL_DEL})")
+	parser.add_argument("--site_gap", default=SITE_GAP, type=int,
+		help=f"Mean distance between sites; the reference grows with it (default: {SITE_GAP})")
+	parser.add_argument("--seed", default=SEED, type=int, help=f"Seed of the random inputs (default: {SEED})")
+	parser.add_argument("-s", "--stages", nargs="+", default=STAGES, choices=STAGES,
+		help="Stages to run, in order; each needs the output of the ones before it (default: all)")
+	parser.add_argument("-b", "--backends", nargs="+", default=BACKENDS, choices=BACKENDS,
+		help="Backends to compare calls with (default: all)")
+	args = parser.parse_args()
+	print(args)
+	assert args.breakpoints > 0, "--breakpoints must be positive"
+	assert 0 < args.contigs <= len(CHROMS), f"--contigs must be between 1 and {len(CHROMS)}"
+
+	work_dir = Path(args.work_dir)
+	input_dir = work_dir / "inputs"
+	output_dir = work_dir / "outputs"
+
+	# inputs are reused while they were generated with the same options
+	input_options = {name: getattr(args, name)
+		for name in ["breakpoints", "contigs", "overlap", "multiallelic", "pindel_del", "site_gap", "seed"]}
+	options_path = input_dir / "options.json"
+	if options_path.is_file() and json.loads(options_path.read_text()) == input_options:
+		print(f"Reusing inputs in {input_dir}")
+	else:
+		shutil.rmtree(input_dir, ignore_errors=True)
+		breakpoint_count = generate_inputs(input_dir, **input_options)
+		options_path.write_text(json.dumps(input_options))
+		print(f"Generated {breakpoint_count} breakpoints in {input_dir}")
+
+	shutil.rmtree(output_dir, ignore_errors=True)
+	results = run_benchmark(input_dir, output_dir, args.stages, args.backends)
+
+	# write results as a TSV
+	report_path = work_dir / "benchmark.tsv"
+	with open(report_path, "w", newline="") as report:
+		writer = csv.DictWriter(report, fieldnames=list(results[0]), delimiter="\t")
+		writer.writeheader()
+		writer.writerows(results)
+	print(f"Results written to {report_path}")
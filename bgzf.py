@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# Writes VCFs compressed with BGZF (as by bgzip), indexing them with tabix as they're written
+# so outputs are ready for region queries (tabix, pysam.TabixFile, bcftools) without reading them again
+# Used by makeVCFs.py and encode.py with --bgzip
+
+import struct
+from typing import Any, Dict, List
+import zlib
+
+# constants
+# most uncompressed bytes in one BGZF block
+BGZF_BLOCK_SIZE = 0xff00
+BGZF_LEVEL = 6
+# gzip header of a BGZF block, with the BC extra field holding the block's size (less 1)
+BGZF_HEADER = struct.Struct("<4BI2BH2BHH")
+BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+# .tbi format (https://samtools.github.io/hts-specs/tabix.pdf)
+TBI_MAGIC = b"TBI\x01"
+# VCF preset: sequence in column 1, start in column 2, end from the length of REF, "#" lines skipped
+TBI_FORMAT_VCF = 2
+TBI_CONF = struct.Struct("<6i")
+TBI_META_CHAR = ord("#")
+# windows of the linear index cover 2^14 bases, like the smallest bins
+TBI_MIN_SHIFT = 14
+# bin holding each contig's offsets and record counts, rather than records
+TBI_META_BIN = 37450
+
+# Writes bytes as BGZF blocks, tracking virtual offsets (block offset << 16 | offset in block)
+class BGZFWriter:
+
+	def __init__(self, path: str) -> None:
+		self.file = open(path, "wb")
+		self.buffer = bytearray()
+		# compressed offset of the block being filled
+		self.block_offset = 0
+
+	def tell(self) -> int:
+		return (self.block_offset << 16) | len(self.buffer)
+
+	def write(self, data: bytes) -> None:
+		self.buffer += data
+		while len(self.buffer) >= BGZF_BLOCK_SIZE:
+			self.write_block(bytes(self.buffer[:BGZF_BLOCK_SIZE]))
+			del self.buffer[:BGZF_BLOCK_SIZE]
+
+	def write_block(self, data: bytes) -> None:
+		compressor = zlib.compressobj(BGZF_LEVEL, zlib.DEFLATED, -15)
+		compressed = compressor.compress(data) + compressor.flush()
+		block_size = BGZF_HEADER.size + len(compressed) + 8
+		self.file.write(BGZF_HEADER.pack(31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, block_size - 1))
+		self.file.write(compressed)
+		self.file.write(struct.pack("<II", zlib.crc32(data), len(data)))
+		self.block_offset += block_size
+
+	def close(self) -> None:
+		if self.buffer:
+			self.write_block(bytes(self.buffer))
+			self.buffer.clear()
+		self.file.write(BGZF_EOF)
+		self.file.close()
+
+# tabix bin of 0-based region start to end (exclusive), from the tabix spec
+def reg2bin(start: int, end: int) -> int:
+	end -= 1
+	if start >> 14 == end >> 14:
+		return ((1 << 15) - 1) // 7 + (start >> 14)
+	if start >> 17 == end >> 17:
+		return ((1 << 12) - 1) // 7 + (start >> 17)
+	if start >> 20 == end >> 20:
+		return ((1 << 9) - 1) // 7 + (start >> 20)
+	if start >> 23 == end >> 23:
+		return ((1 << 6) - 1) // 7 + (start >> 23)
+	if start >> 26 == end >> 26:
+		return ((1 << 3) - 1) // 7 + (start >> 26)
+	return 0
+
+# Index of the records on one contig
+class ContigIndex:
+
+	def __init__(self) -> None:
+		# chunks (start, end virtual offsets) of records in each bin
+		self.bins: Dict[int, List[List[int]]] = {}
+		# smallest virtual offset of records overlapping each window of 2^TBI_MIN_SHIFT bases
+		self.linear: List[int] = []
+		self.start_offset = None
+		self.end_offset = None
+		self.count = 0
+
+	def add(self, start: int, end: int, start_offset: int, end_offset: int) -> None:
+
+		chunks = self.bins.setdefault(reg2bin(start, end), [])
+		if chunks and chunks[-1][1] == start_offset:
+			chunks[-1][1] = end_offset
+		else:
+			chunks.append([start_offset, end_offset])
+
+		last_window = (end - 1) >> TBI_MIN_SHIFT
+		if len(self.linear) <= last_window:
+			self.linear.extend([None] * (last_window + 1 - len(self.linear)))
+		for window in range(start >> TBI_MIN_SHIFT, last_window + 1):
+			if self.linear[window] is None:
+				self.linear[window] = start_offset
+
+		if self.start_offset is None:
+			self.start_offset = start_offset
+		self.end_offset = end_offset
+		self.count += 1
+
+	def pack(self) -> bytes:
+
+		bins = dict(self.bins)
+		bins[TBI_META_BIN] = [[self.start_offset, self.end_offset], [self.count, 0]]
+		packed = [struct.pack("<i", len(bins))]
+		for (bin_number, chunks) in bins.items():
+			packed.append(struct.pack("<Ii", bin_number, len(chunks)))
+			packed.extend(struct.pack("<QQ", chunk_start, chunk_end) for (chunk_start, chunk_end) in chunks)
+
+		# windows without records start where the window before them does
+		linear = []
+		for offset in self.linear:
+			linear.append(offset if offset is not None else (linear[-1] if linear else self.start_offset))
+		packed.append(struct.pack(f"<i{len(linear)}Q", len(linear), *linear))
+		return b"".join(packed)
+
+# Text file for writing a VCF, compressed with BGZF, and indexed with tabix (to path + ".tbi") when closed
+# rows can be written in any number of pieces, like to a file opened with open
+class IndexedVCFWriter:
+
+	def __init__(self, path: str) -> None:
+		self.path = path
+		self.bgzf = BGZFWriter(path)
+		self.partial_line = ""
+		self.contigs: Dict[str, ContigIndex] = {}
+		self.contig = None
+
+	def write(self, text: str) -> None:
+		lines = (self.partial_line + text).split("\n")
+		self.partial_line = lines.pop()
+		for line in lines:
+			self.write_line(line + "\n")
+
+	def write_line(self, line: str) -> None:
+		start_offset = self.bgzf.tell()
+		self.bgzf.write(line.encode())
+		if line.startswith("#"):
+			return
+
+		[chrom, pos, _, ref] = line.split("\t", 4)[:4]
+		if chrom != self.contig:
+			assert chrom not in self.contigs, f"{self.path} is not sorted: records on {chrom} are not all together"
+			self.contigs[chrom] = ContigIndex()
+			self.contig = chrom
+		start = int(pos) - 1
+		self.contigs[chrom].add(start, start + max(len(ref), 1), start_offset, self.bgzf.tell())
+
+	def write_index(self) -> None:
+
+		names = b"".join(contig.encode() + b"\0" for contig in self.contigs)
+		tbi = BGZFWriter(f"{self.path}.tbi")
+		tbi.write(TBI_MAGIC + struct.pack("<i", len(self.contigs)))
+		tbi.write(TBI_CONF.pack(TBI_FORMAT_VCF, 1, 2, 0, TBI_META_CHAR, 0))
+		tbi.write(struct.pack("<i", len(names)) + names)
+		for contig_index in self.contigs.values():
+			tbi.write(contig_index.pack())
+		tbi.close()
+
+	def close(self) -> None:
+		if self.partial_line:
+			self.write_line(self.partial_line)
+			self.partial_line = ""
+		self.bgzf.close()
+		self.write_index()
+
+	def __enter__(self) -> "IndexedVCFWriter":
+		return self
+
+	def __exit__(self, *exc_info) -> None:
+		self.close()
+
+# open a VCF for writing rows, as plain text at vcf_path, or compressed and indexed at vcf_path + ".gz" if bgzip
+def open_output_vcf(vcf_path: str, bgzip: bool = False) -> Any:
+	if bgzip:
+		return IndexedVCFWriter(f"{vcf_path}.gz")
+	return open(vcf_path, "w")
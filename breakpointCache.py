@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# Caches the breakpoints extracted from callers' VCFs between runs of Metal
+# each VCF's breakpoints are kept in a store (see breakpointStore.py), named for a key made from the VCF
+# (its size and modification time, or a hash of its content) and the version of the extractor,
+# so rerunning Metal with some of the same VCFs reuses their breakpoints instead of extracting them again
+# The least recently used stores are evicted to keep the cache under a size limit
+
+from breakpointStore import extract_stores, STORE_VERSION
+from getBreakpoints import EXTRACTOR_VERSION
+import hashlib
+import os
+from pathlib import Path
+from typing import Dict
+
+# constants
+STORE_SUFFIX = ".bps"
+# bytes of a VCF hashed at a time
+HASH_CHUNK_SIZE = 1 << 20
+# default limit on the size of a cache, in MB
+CACHE_SIZE = 4096
+
+# A directory of breakpoint stores, by key
+class BreakpointCache:
+
+	def __init__(self, cache_dir: Path, max_size: int = CACHE_SIZE * 1024 * 1024, hash_content: bool = False) -> None:
+		self.cache_dir = Path(cache_dir)
+		self.cache_dir.mkdir(parents=True, exist_ok=True)
+		self.max_size = max_size
+		self.hash_content = hash_content
+
+		# stores used in this run, which are never evicted by it
+		self.in_use: set = set()
+
+		# VCFs whose breakpoints were reused, and VCFs whose breakpoints had to be extracted
+		self.hits = 0
+		self.misses = 0
+
+	# key of a VCF's breakpoints: changes when the VCF or the way breakpoints are extracted and stored does
+	def get_key(self, vcf: str) -> str:
+		key = hashlib.sha256(f"{EXTRACTOR_VERSION}\t{STORE_VERSION}\t".encode())
+		if self.hash_content:
+			with open(vcf, "rb") as f:
+				for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+					key.update(chunk)
+		else:
+			stat = os.stat(vcf)
+			key.update(f"{Path(vcf).resolve()}\t{stat.st_size}\t{stat.st_mtime_ns}".encode())
+		return key.hexdigest()
+
+	# paths of the stores of VCFs' breakpoints (by key, as in vcfs),
+	# extracting those that aren't in the cache into it, with up to jobs processes at a time
+	def get_stores(self, vcfs: Dict[str, str], jobs: int = 1) -> Dict[str, Path]:
+
+		store_paths = {key: self.cache_dir / f"{self.get_key(vcf)}{STORE_SUFFIX}" for key, vcf in vcfs.items()}
+		missing = {key: vcf for key, vcf in vcfs.items() if not store_paths[key].is_file()}
+		for key in vcfs:
+			if key not in missing:
+				# mark the store as recently used
+				os.utime(store_paths[key])
+
+		self.hits += len(vcfs) - len(missing)
+		self.misses += len(missing)
+		self.in_use.update(store_paths.values())
+		extract_stores(missing, store_paths, jobs)
+
+		self.evict()
+		return store_paths
+
+	# path of the store of a VCF's breakpoints, extracting them into the cache if they aren't in it
+	def get_store(self, vcf: str) -> Path:
+		return self.get_stores({vcf: vcf})[vcf]
+
+	# remove the least recently used stores until the cache fits in max_size (or only stores in use are left)
+	def evict(self) -> None:
+
+		stores = []
+		for store_path in self.cache_dir.glob(f"*{STORE_SUFFIX}"):
+			try:
+				stat = store_path.stat()
+			except FileNotFoundError:
+				# evicted by another run
+				continue
+			stores.append((stat.st_mtime, stat.st_size, store_path))
+
+		cache_size = sum(size for (_, size, _) in stores)
+		for (_, size, store_path) in sorted(stores):
+			if cache_size <= self.max_size:
+				break
+			if store_path in self.in_use:
+				continue
+			store_path.unlink(missing_ok=True)
+			cache_size -= size
+
+	# describe how many VCFs' breakpoints were reused from the cache
+	def get_stats(self) -> str:
+		return f"{self.hits} reused, {self.misses} extracted"
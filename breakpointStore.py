@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# Stores a caller's extracted breakpoints in a compact binary file
+# breakpoints are held column by column (contig id, position, indel type code, length),
+# with contig names stored once, so a store is a fraction of the size of a breakpoints TSV,
+# and its columns are read through a memory map as arrays of integers, without parsing text
+# Used by breakpointCache.py, or called as
+# 	python breakpointStore.py [vcf] [store]
+# to extract a VCF's breakpoints into a store
+
+from array import array
+from concurrent.futures import as_completed, ProcessPoolExecutor
+from getBreakpoints import get_breakpoints, is_indexed, Breakpoint
+import mmap
+import os
+from pathlib import Path
+import pysam
+import struct
+import sys
+import tempfile
+from typing import Any, Dict, Iterator, List, Tuple
+
+# constants
+STORE_MAGIC = b"MTLBRKPT"
+# bump when the layout of a store changes
+STORE_VERSION = 2
+# magic, version, contig count, run count, breakpoint count
+STORE_HEADER = struct.Struct("<8sIIIQ")
+# a run of consecutive breakpoints on one contig: contig id, first breakpoint, breakpoint after the last
+STORE_RUN = struct.Struct("<IQQ")
+# columns, in the order they're stored, with their array typecodes
+STORE_COLUMNS: List[Tuple[str, str]] = [("contig", "I"), ("position", "I"), ("indel_type", "B"), ("length", "i")]
+# columns start at multiples of this many bytes
+STORE_ALIGNMENT = 8
+
+# bytes to pad size bytes up to a multiple of STORE_ALIGNMENT
+def get_padding(size: int) -> bytes:
+	return bytes(-size % STORE_ALIGNMENT)
+
+# columns of breakpoints, in the order given: (contig names, runs of each contig, column by name)
+def get_columns(breakpoints: Iterator[Breakpoint]) -> Tuple[List[str], List[Tuple[int, int, int]], Dict[str, array]]:
+
+	columns = {name: array(typecode) for (name, typecode) in STORE_COLUMNS}
+	contig_ids: Dict[str, int] = {}
+	runs: [Tuple[int, int, int]] = []
+
+	for (chrom, pos, indel_type, length) in breakpoints:
+		contig_id = contig_ids.setdefault(chrom, len(contig_ids))
+		if not runs or runs[-1][0] != contig_id:
+			runs.append((contig_id, len(columns["contig"]), len(columns["contig"])))
+		columns["contig"].append(contig_id)
+		columns["position"].append(pos)
+		columns["indel_type"].append(indel_type)
+		columns["length"].append(length)
+		runs[-1] = (contig_id, runs[-1][1], len(columns["contig"]))
+
+	return (list(contig_ids), runs, columns)
+
+# write breakpoints to a store, in the order given
+def write_store(breakpoints: Iterator[Breakpoint], store_path: Path) -> None:
+
+	(contigs, runs, columns) = get_columns(breakpoints)
+
+	with open(store_path, "wb") as store:
+		header = STORE_HEADER.pack(STORE_MAGIC, STORE_VERSION, len(contigs), len(runs), len(columns["contig"]))
+		for contig in contigs:
+			encoded_contig = contig.encode()
+			header += struct.pack("<H", len(encoded_contig)) + encoded_contig
+		for run in runs:
+			header += STORE_RUN.pack(*run)
+		store.write(header + get_padding(len(header)))
+
+		for column in columns.values():
+			if sys.byteorder == "big":
+				column.byteswap()
+			data = column.tobytes()
+			store.write(data + get_padding(len(data)))
+
+# extract a VCF's breakpoints into a store
+# the store is written to a temporary file, then moved in place, so it's never read partly written
+def extract_store(vcf: str, store_path: Path) -> None:
+
+	store_path = Path(store_path)
+	with tempfile.NamedTemporaryFile(dir=store_path.parent, suffix=".tmp", delete=False) as tmp:
+		tmp_path = Path(tmp.name)
+	try:
+		write_store(get_breakpoints(vcf), tmp_path)
+		os.replace(tmp_path, store_path)
+	finally:
+		if tmp_path.exists():
+			tmp_path.unlink()
+
+# extract the breakpoints of several VCFs into stores (by key, as in vcfs and store_paths) at the same time,
+# with up to jobs processes, returning once every store is written
+# raises an error naming every VCF that couldn't be extracted, once the others are done
+def extract_stores(vcfs: Dict[str, str], store_paths: Dict[str, Path], jobs: int) -> None:
+
+	if not vcfs:
+		return
+	if jobs == 1 or len(vcfs) == 1:
+		for key, vcf in vcfs.items():
+			extract_store(vcf, store_paths[key])
+		return
+
+	errors: [str] = []
+	with ProcessPoolExecutor(max_workers=min(jobs, len(vcfs))) as executor:
+		futures = {executor.submit(extract_store, vcf, store_paths[key]): key for key, vcf in vcfs.items()}
+		for future in as_completed(futures):
+			key = futures[future]
+			try:
+				future.result()
+			except Exception as e:
+				errors.append(f"{key} VCF {vcfs[key]} ({type(e).__name__}: {e})")
+
+	if errors:
+		raise RuntimeError(f"Couldn't extract breakpoints from {', '.join(errors)}")
+
+# Columns of a store, read through a memory map
+class BreakpointStore:
+
+	def __init__(self, store_path: Path) -> None:
+		with open(store_path, "rb") as store:
+			data = memoryview(mmap.mmap(store.fileno(), 0, access=mmap.ACCESS_READ))
+
+		(magic, version, contig_count, run_count, count) = STORE_HEADER.unpack_from(data, 0)
+		assert magic == STORE_MAGIC, f"{store_path} is not a breakpoint store"
+		assert version == STORE_VERSION, f"{store_path} is a version {version} breakpoint store, expected {STORE_VERSION}"
+
+		offset = STORE_HEADER.size
+		self.contigs: [str] = []
+		for _ in range(contig_count):
+			(size,) = struct.unpack_from("<H", data, offset)
+			self.contigs.append(bytes(data[offset + 2:offset + 2 + size]).decode())
+			offset += 2 + size
+
+		self.runs: [Tuple[int, int, int]] = []
+		for _ in range(run_count):
+			self.runs.append(STORE_RUN.unpack_from(data, offset))
+			offset += STORE_RUN.size
+		offset += len(get_padding(offset))
+
+		# columns are views of the memory map, which stays open while they're in use
+		self.columns: Dict[str, Any] = {}
+		for (name, typecode) in STORE_COLUMNS:
+			size = count * array(typecode).itemsize
+			column = data[offset:offset + size].cast(typecode)
+			if sys.byteorder == "big":
+				column = array(typecode, column)
+				column.byteswap()
+			self.columns[name] = column
+			offset += size + len(get_padding(size))
+
+	# ranges (start, end) of breakpoints on contig, or of every breakpoint if contig is None
+	# (other than those on skip_contigs)
+	def get_ranges(self, contig: str = None, skip_contigs: set = None) -> List[Tuple[int, int]]:
+		if skip_contigs:
+			return [(start, end) for (run_contig_id, start, end) in self.runs
+				if self.contigs[run_contig_id] not in skip_contigs and (contig is None or self.contigs[run_contig_id] == contig)]
+		if contig is None:
+			return [(0, len(self.columns["contig"]))]
+		if contig not in self.contigs:
+			return []
+		contig_id = self.contigs.index(contig)
+		return [(start, end) for (run_contig_id, start, end) in self.runs if run_contig_id == contig_id]
+
+	# yield breakpoints, in the order they were stored, or those on just one contig (other than those on skip_contigs)
+	def get_breakpoints(self, contig: str = None, skip_contigs: set = None) -> Iterator[Breakpoint]:
+		contigs = self.contigs
+		columns = [self.columns[name] for (name, _) in STORE_COLUMNS]
+		for (start, end) in self.get_ranges(contig, skip_contigs):
+			for (contig_id, pos, indel_type, length) in zip(*[column[start:end] for column in columns]):
+				yield Breakpoint(contigs[contig_id], pos, indel_type, length)
+
+# whether a file is a breakpoint store, rather than a VCF
+# pipes (and standard input) are read as VCFs, so none of them is taken by checking
+def is_store(path: str) -> bool:
+	if not Path(path).is_file():
+		return False
+	with open(path, "rb") as f:
+		return f.read(len(STORE_MAGIC)) == STORE_MAGIC
+
+# yield breakpoints from a caller's VCF, or from a store of them, or from just one contig of either,
+# or just those in regions (a regions.Regions), leaving out those on skip_contigs (e.g., contigs a resumed run finished)
+# a store's breakpoints on skip_contigs are never read
+def get_caller_breakpoints(path: str, contig: str = None, regions: Any = None, skip_contigs: set = None) -> Iterator[Breakpoint]:
+	if not is_store(path):
+		breakpoints = get_breakpoints(path, contig, regions)
+		if skip_contigs:
+			return (breakpoint for breakpoint in breakpoints if breakpoint.chrom not in skip_contigs)
+		return breakpoints
+
+	breakpoints = BreakpointStore(path).get_breakpoints(contig, skip_contigs)
+	if regions is not None:
+		return (breakpoint for breakpoint in breakpoints if regions.contains(breakpoint.chrom, breakpoint.pos))
+	return breakpoints
+
+# contigs of a caller's store, or of its VCF from the VCF's tabix index,
+# or None for a VCF without an index, whose contigs aren't known without reading it
+def get_caller_contigs(path: str) -> List[str]:
+	if is_store(path):
+		return list(BreakpointStore(path).contigs)
+	if is_indexed(path):
+		with pysam.TabixFile(path) as tbx:
+			return list(tbx.contigs)
+	return None
+
+# columns of a caller's breakpoints from a VCF, or from a store of them, or from just one contig of either:
+# (contig names, column by name) with columns as in STORE_COLUMNS, in the order the breakpoints were extracted
+# a store's columns are views of its memory map where possible, rather than copies
+# (or, if regions is given, of those in the regions, and, if skip_contigs is, without those on them)
+def get_caller_columns(path: str, contig: str = None, regions: Any = None,
+	skip_contigs: set = None) -> Tuple[List[str], Dict[str, Any]]:
+
+	if regions is not None or not is_store(path):
+		(contigs, _, columns) = get_columns(get_caller_breakpoints(path, contig, regions, skip_contigs))
+		return (contigs, columns)
+
+	store = BreakpointStore(path)
+	ranges = store.get_ranges(contig, skip_contigs)
+	if len(ranges) == 1:
+		(start, end) = ranges[0]
+		return (store.contigs, {name: column[start:end] for name, column in store.columns.items()})
+
+	columns = {name: array(typecode) for (name, typecode) in STORE_COLUMNS}
+	for (start, end) in ranges:
+		for name, column in columns.items():
+			column.extend(store.columns[name][start:end])
+	return (store.contigs, columns)
+
+if __name__ == "__main__":
+
+	# parse args
+	vcf = sys.argv[1]
+	store_path = sys.argv[2]
+
+	write_store(get_breakpoints(vcf), store_path)
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# Records a run's progress in checkpoint.json in its output directory, so a run that stopped partway
+# (e.g., a preempted job) can be resumed with --resume, redoing only what it hadn't finished
+# calls are compared a contig at a time: each contig's sorted output is kept in contigs/ once it's finished,
+# and metal.tsv and the VCFs are written from them once every contig is
+# the callers' VCFs are recognized by path, size and modification time (or, optionally, a hash of their content),
+# so a run is only resumed with the same inputs and the options its output depends on (others, like --threads, can change)
+# checkpoint.json is left behind once a run finishes, so resuming a finished run does nothing
+# Used by metal.py
+
+from breakpointCache import HASH_CHUNK_SIZE
+import hashlib
+import json
+import os
+from pathlib import Path
+import shutil
+from typing import Any, Dict, Iterator, List
+
+# constants
+CHECKPOINT_NAME = "checkpoint.json"
+# bump when what's checkpointed, or how, changes
+CHECKPOINT_VERSION = 2
+# directory in the output directory holding each finished contig's sorted output
+CONTIGS_DIR = "contigs"
+# breakpoints on contigs missing from the reference index are compared, and checkpointed, together, after the rest
+UNINDEXED = "*"
+# stages of a run
+EXTRACT_STAGE = "extract"
+COMPARE_STAGE = "compare"
+WRITE_STAGE = "write outputs"
+
+# hash of a file's content
+def hash_file(path: str) -> str:
+	file_hash = hashlib.sha256()
+	with open(path, "rb") as f:
+		for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+			file_hash.update(chunk)
+	return file_hash.hexdigest()
+
+# key of an input file: changes when the file does
+# its path, size and modification time, or, if by_content, a hash of its content, which is slower but follows copies
+def get_input_key(path: str, by_content: bool = False) -> str:
+	if by_content:
+		return hash_file(path)
+	stat = os.stat(path)
+	return f"{Path(path).resolve()}\t{stat.st_size}\t{stat.st_mtime_ns}"
+
+# hash of a value, as JSON
+def hash_value(value: Any) -> str:
+	return hashlib.sha256(json.dumps(value, sort_keys=True).encode()).hexdigest()
+
+# write lines to path, through a temporary file moved in place, so it's never read partly written
+def write_atomic(path: Path, lines: Iterator[str]) -> None:
+	tmp_path = path.with_name(f"{path.name}.tmp")
+	with open(tmp_path, "w", newline="") as tmp:
+		tmp.writelines(lines)
+		tmp.flush()
+		os.fsync(tmp.fileno())
+	os.replace(tmp_path, path)
+
+# The stages and contigs a run has finished, with what it was started with:
+# a key of each of the callers' VCFs (by key, as in vcfs, see get_input_key) and the options the output depends on
+# a resumed run keys its VCFs as the run it resumes did, by content or not
+class Checkpoint:
+
+	def __init__(self, output_dir: Path, vcfs: Dict[str, str], contig_ranks: Dict[str, int], options: Dict[str, Any],
+		resume: bool = False, by_content: bool = False) -> None:
+
+		self.output_dir = Path(output_dir)
+		self.path = self.output_dir / CHECKPOINT_NAME
+		self.contigs_dir = self.output_dir / CONTIGS_DIR
+		self.contig_ranks = contig_ranks
+
+		manifest = None
+		if resume and self.path.is_file():
+			with open(self.path) as f:
+				manifest = json.load(f)
+			assert manifest["version"] == CHECKPOINT_VERSION, \
+				f"{self.path} was written by a version of Metal that checkpoints differently: the run must be started again"
+			by_content = manifest["by_content"]
+
+		self.by_content = by_content
+		if by_content:
+			print("Hashing inputs...")
+		self.inputs: Dict[str, str] = {key: get_input_key(vcf, by_content) for key, vcf in vcfs.items()}
+		# contigs are checkpointed in reference order, so the order is an option too
+		self.options: Dict[str, Any] = dict(options, contigs=hash_value(list(contig_ranks)))
+		# stages, and contigs, finished, in the order they were
+		self.stages: [str] = []
+		self.contigs: [str] = []
+
+		if manifest is not None:
+			changed = [key for key in set(self.inputs) | set(manifest["inputs"])
+				if self.inputs.get(key) != manifest["inputs"].get(key)]
+			assert not changed, f"Can't resume: --{', --'.join(sorted(changed))} changed since the run in {self.output_dir} started"
+			changed = [key for key in set(self.options) | set(manifest["options"])
+				if self.options.get(key) != manifest["options"].get(key)]
+			assert not changed, f"Can't resume: {', '.join(sorted(changed))} changed since the run in {self.output_dir} started"
+			self.stages = manifest["stages"]
+			self.contigs = manifest["contigs"]
+			print(f"Resuming: finished {', '.join(self.stages) or 'no stages'} and {len(self.contigs)} contigs")
+		else:
+			assert not self.path.exists(), \
+				f"A run was already started in {self.output_dir}: rerun with --resume to finish it, or delete or move it"
+			self.save()
+		self.contigs_dir.mkdir(exist_ok=True)
+
+	# write the manifest
+	def save(self) -> None:
+		manifest = {
+			"version": CHECKPOINT_VERSION,
+			"by_content": self.by_content,
+			"inputs": self.inputs,
+			"options": self.options,
+			"stages": self.stages,
+			"contigs": self.contigs
+		}
+		write_atomic(self.path, [json.dumps(manifest, indent="\t") + "\n"])
+
+	def is_finished(self, stage: str) -> bool:
+		return stage in self.stages
+
+	def finish(self, stage: str) -> None:
+		if stage not in self.stages:
+			self.stages.append(stage)
+			self.save()
+
+	# every contig calls are compared on, in the order their outputs are written: the reference's, then UNINDEXED
+	def get_all_contigs(self) -> List[str]:
+		return list(self.contig_ranks) + [UNINDEXED]
+
+	# contig breakpoints on chrom are checkpointed with
+	def get_contig(self, chrom: str) -> str:
+		return chrom if chrom in self.contig_ranks else UNINDEXED
+
+	# path of a contig's sorted output, named for its rank, as contig names needn't make good file names
+	def get_contig_path(self, contig: str) -> Path:
+		rank = self.contig_ranks.get(contig)
+		return self.contigs_dir / (f"{rank}.tsv" if rank is not None else "unindexed.tsv")
+
+	# keep a contig's sorted output, to be recorded as finished with finish_contigs
+	def write_contig(self, contig: str, lines: Iterator[str]) -> None:
+		write_atomic(self.get_contig_path(contig), lines)
+
+	# record contigs as finished, saving the manifest once
+	def finish_contigs(self, contigs: List[str]) -> None:
+		finished = set(self.contigs)
+		self.contigs.extend(contig for contig in contigs if contig not in finished)
+		self.save()
+
+	# yield the lines of a finished contig's sorted output
+	def get_contig_lines(self, contig: str) -> Iterator[str]:
+		contig_path = self.get_contig_path(contig)
+		if contig_path.is_file():
+			with open(contig_path, newline="") as lines:
+				yield from lines
+
+	# yield the lines of every finished contig's sorted output, in contig order
+	def get_lines(self) -> Iterator[str]:
+		finished = set(self.contigs)
+		for contig in self.get_all_contigs():
+			if contig in finished:
+				yield from self.get_contig_lines(contig)
+
+	# remove the contigs' outputs, once the outputs made from them are written
+	def remove_contigs(self) -> None:
+		shutil.rmtree(self.contigs_dir, ignore_errors=True)
@@ -4,15 +4,23 @@
 # one for insertion (ins) breakpoints, and one for all these breakpoints combined,
 # where each "SNP" in the VCF represents an indel breakpoint
 # Called (e.g., by makeVCFs.py) as
-# 	python encode.py [vcf] [vcf results stub] [fasta ref]
+# 	python encode.py [vcf] [vcf results stub] [fasta ref] [--threads N] [--bgzip] [--regions bed]
+# with --threads, contigs are encoded in parallel and their outputs joined in contig order
+# with --regions, only breakpoints in the regions are encoded, reading the VCF with tabix if it's indexed
 
+import argparse
+from bgzf import open_output_vcf
+from concurrent.futures import ProcessPoolExecutor
 import csv
-import os
+from functools import partial
+from getBreakpoints import get_contig_lines, get_contig_offsets, get_lines_between, get_region_lines, is_indexed, open_vcf, GZIP_MAGIC
+import heapq
+import io
 import pysam
-import textwrap
-from typing import Any, Dict, List
+from reference import get_worker_reference, open_reference, open_worker_reference
+from regions import read_regions, Regions, RegionWriter
+from typing import Any, Dict, Iterator, List, Tuple
 import typing
-import subprocess
 import sys
 
 # constants
@@ -26,10 +34,46 @@ FILTER = "PASS"
 INFO = "."
 FORMAT = "GT"
 GT = "0/1"
+POS_INDEX = 1
+ENCODED_VCF_NAMES = ["del_L", "del_R", "ins", "all"]
+
+# Holds rows for a writer until every row before them has been written,
+# for outputs whose rows are written slightly out of position order
+# (multiallelic records are split, and a deletion's del_R is written with its del_L)
+class ReorderBuffer:
+
+	def __init__(self, writer: Any) -> None:
+		self.writer = writer
+		self.heap = []
+		self.count = 0
+
+	# hold a row until flushed, ordered by position, then by when it was written
+	def writerow(self, row: List) -> None:
+		heapq.heappush(self.heap, (row[POS_INDEX], self.count, row))
+		self.count += 1
+
+	# write held rows at positions before pos, or all held rows if pos is None
+	def flush(self, pos: int = None) -> None:
+		while self.heap and (pos is None or self.heap[0][0] < pos):
+			self.writer.writerow(heapq.heappop(self.heap)[2])
+
+# csv writer for a VCF
+def writer_for_vcf(vcf: Any) -> Any:
+	return csv.writer(vcf, delimiter=OUTPUT_DELIMITER, quoting=csv.QUOTE_NONE, quotechar=None)
+
+# writers for each breakpoint type, as used by process_variant, from a writer for each encoded VCF
+def get_encoded_writers(writers: Dict[str, Any]) -> Dict[str, List[Any]]:
+	return {
+		"del_L": [writers["del_L"], writers["all"]],
+		"del_R": [writers["del_R"], writers["all"]],
+		"ins": [writers["ins"], writers["all"]]
+	}
 
 # get chromosome lengths from fasta reference for ##contig headers
-def get_chrom_lengths(fasta: Any) -> Dict[str, int]:
-	return {chrom: fasta.get_reference_length(chrom) for chrom in CHROMS}
+# (only of chromosomes in regions, if given)
+def get_chrom_lengths(fasta: Any, regions: Regions = None) -> Dict[str, int]:
+	return {chrom: fasta.get_reference_length(chrom) for chrom in CHROMS
+		if regions is None or chrom in regions.intervals}
 
 # write_header to provided csv writer
 def write_header(writer: Any, chrom_lengths: Dict[str, int]) -> None:
@@ -43,8 +87,7 @@ def write_header(writer: Any, chrom_lengths: Dict[str, int]) -> None:
 		writer.writerow([header])
 
 	# contig headers
-	for chrom in CHROMS:
-		chrom_length: int = chrom_lengths[chrom]
+	for chrom, chrom_length in chrom_lengths.items():
 		writer.writerow([f"##contig=<ID={chrom},length={chrom_length}>"])
 
 	# column headers
@@ -128,7 +171,7 @@ def process_variant(variant: List[str], writers: Dict[str, Any], fasta: Any) ->
 				# DEL_L
 				del_L_writers = writers["del_L"]
 				del_L_pos = pos + 1	# add 1 to get the first deleted base
-				write_variant(fasta, deL_L_writers, chrom=chrom, pos=del_L_pos)
+				write_variant(fasta, del_L_writers, chrom=chrom, pos=del_L_pos)
 
 				# DEL_R
 				del_R_writers = writers["del_R"] 
@@ -163,78 +206,137 @@ def process_variant(variant: List[str], writers: Dict[str, Any], fasta: Any) ->
 				del_R_pos = pos - length_diff
 				write_variant(fasta, del_R_writers, chrom=chrom, pos=del_R_pos)
 
-# sort numerically by position
-def sort_output(output_tsv, sorted_output_tsv) -> None:
+# encode the variants in lines of a sorted VCF, writing rows to the encoded VCFs (by name) in sorted order
+# a breakpoint can only be out of order with those of variants a little upstream of it
+# (multiallelic records are split, and a deletion's del_R is downstream of its del_L),
+# so rows are held until the variants being encoded have passed them, rather than sorted at the end
+# if regions is given, only rows in them are written
+def encode_variants(lines: Iterator[str], vcfs: Dict[str, Any], fasta: Any, regions: Regions = None) -> None:
+
+	vcf_writers = {name: writer_for_vcf(vcf) for name, vcf in vcfs.items()}
+	if regions is not None:
+		vcf_writers = {name: RegionWriter(writer, regions) for name, writer in vcf_writers.items()}
+	buffers = {name: ReorderBuffer(writer) for name, writer in vcf_writers.items()}
+	writers = get_encoded_writers(buffers)
+
+	current_chrom = None
+	for variant in csv.reader(lines, delimiter="\t"):
+		if variant[0].startswith("#"): # header
+			continue
+		chrom: str = variant[0]
+		pos = int(variant[POS_INDEX])
+		for buffer in buffers.values():
+			buffer.flush(pos if chrom == current_chrom else None)
+		current_chrom = chrom
+		process_variant(variant, writers, fasta)
+
+	for buffer in buffers.values():
+		buffer.flush()
+
+# contigs of a VCF in the order they appear, each with the byte range of its records,
+# or None where the contig is read by tabix region (or, for a bgzipped VCF without an index, by scanning for it)
+# only contigs in regions, if given
+def get_contig_splits(vcf: str, regions: Regions = None) -> List[Tuple[str, Tuple[int, int]]]:
+
+	if is_indexed(vcf):
+		with pysam.TabixFile(vcf) as tbx:
+			return [(contig, None) for contig in tbx.contigs if regions is None or contig in regions.intervals]
+
+	with open(vcf, "rb") as f:
+		is_gzipped: bool = f.read(2) == GZIP_MAGIC
+	if not is_gzipped:
+		return [(contig, offsets) for contig, offsets in get_contig_offsets(vcf).items()
+			if regions is None or contig in regions.intervals]
+
+	print(f"{vcf} has no tabix index, so it will be read once per contig: index it with tabix to avoid this")
+	contigs: Dict[str, None] = {}
+	with open_vcf(vcf) as lines:
+		for line in lines:
+			if not line.startswith("#"):
+				contigs.setdefault(line.split("\t", 1)[0])
+	return [(contig, None) for contig in contigs if regions is None or contig in regions.intervals]
+
+# encode the variants on one contig of a VCF (only breakpoints in regions, if given),
+# returning the rows of each encoded VCF, without headers
+def encode_contig(vcf_input: str, regions: Regions, split: Tuple[str, Tuple[int, int]]) -> Dict[str, str]:
+
+	(contig, offsets) = split
+	if offsets is not None:
+		lines = get_lines_between(vcf_input, *offsets)
+	elif regions is not None:
+		lines = get_region_lines(vcf_input, regions, contig)
+	else:
+		lines = get_contig_lines(vcf_input, contig)
+
+	outputs = {name: io.StringIO(newline="") for name in ENCODED_VCF_NAMES}
+	encode_variants(lines, outputs, get_worker_reference(), regions)
+	return {name: output.getvalue() for name, output in outputs.items()}
 
-	# skip header
-	skip_header_cmd = f"""awk '/^#/' {output_tsv} > {sorted_output_tsv}"""
-	skip_header_output = subprocess.check_output(skip_header_cmd, shell=True)
+# encode each contig of a VCF in a separate process, writing the encoded VCFs in contig order
+def encode_parallel(vcf_input: str, vcf_results_stub: str, fasta_path: str, threads: int, bgzip: bool = False,
+	regions: Regions = None) -> None:
 
-	# sort the rest numerically by position
-	sort_cmd = f"""awk '!/^#/' {output_tsv} | sort -t$'\t' -k2,2n >> {sorted_output_tsv}"""
-	sort_output = subprocess.check_output(sort_cmd, shell=True)
-	print(f"sort output: {sort_output}")
+	splits = get_contig_splits(vcf_input, regions)
+	print(f"Encoding {len(splits)} contigs with {threads} processes...")
 
-	# rm unsorted and check error
-	rm_cmd = f"""[ "$(wc -l < {output_tsv})" -eq "$(wc -l < {sorted_output_tsv})" ] && rm {output_tsv} || echo sort error"""
-	rm_output = subprocess.check_output(rm_cmd, shell=True)
-	print(f"rm output: {rm_output}")
+	encoded_vcfs = {name: open_output_vcf(f"{vcf_results_stub}.encode_{name}.vcf", bgzip) for name in ENCODED_VCF_NAMES}
+	with open_reference(fasta_path) as fasta:
+		chrom_lengths: Dict[str, int] = get_chrom_lengths(fasta, regions)
+	for vcf in encoded_vcfs.values():
+		write_header(writer_for_vcf(vcf), chrom_lengths)
+
+	with ProcessPoolExecutor(max_workers=threads, initializer=open_worker_reference, initargs=(fasta_path,)) as executor:
+		for contig_outputs in executor.map(partial(encode_contig, vcf_input, regions), splits):
+			for name, vcf in encoded_vcfs.items():
+				vcf.write(contig_outputs[name])
+
+	for vcf in encoded_vcfs.values():
+		vcf.close()
 
 if __name__ == "__main__":
 
 	# parse args
-	vcf_input = sys.argv[1]
-	vcf_results_stub = sys.argv[2]
-	fasta_path = sys.argv[3]
+	parser = argparse.ArgumentParser(description="Encode a VCF's indels as breakpoint VCFs")
+	parser.add_argument("vcf_input", type=str, help="Path to VCF (plain, or bgzipped)")
+	parser.add_argument("vcf_results_stub", type=str, help="Encoded VCFs are written to ${stub}.encode_{del_L,del_R,ins,all}.vcf")
+	parser.add_argument("fasta_path", type=str, help="Path to reference FASTA, or .2bit file made by reference.py")
+	parser.add_argument("-n", "--threads", default=1, type=int,
+		help="Number of processes encoding, one contig at a time; the VCF must be sorted (default: 1)")
+	parser.add_argument("-z", "--bgzip", action="store_true",
+		help="Compress encoded VCFs with BGZF and index them with tabix, writing ${stub}.encode_{del_L,del_R,ins,all}.vcf.gz(.tbi)")
+	parser.add_argument("-R", "--regions", default=None, type=str,
+		help="Path to BED of target regions: only breakpoints in them are encoded, read with tabix if the VCF is indexed")
+	args = parser.parse_args()
+	assert args.threads > 0, "--threads must be positive"
+	regions = read_regions(args.regions) if args.regions is not None else None
+	vcf_input = args.vcf_input
+	vcf_results_stub = args.vcf_results_stub
+	fasta_path = args.fasta_path
+
+	if args.threads > 1:
+		encode_parallel(vcf_input, vcf_results_stub, fasta_path, args.threads, args.bgzip, regions)
+		sys.exit(0)
 
 	# read in FASTA reference
-	fasta = pysam.FastaFile(fasta_path)
+	fasta = open_reference(fasta_path)
 
 	# set up output
-	def get_unsorted_and_sorted_paths(stub):
-		return (f"{stub}.unsorted.vcf", f"{stub}.vcf")
-
-	(unsorted_del_L_path, del_L_path) = get_unsorted_and_sorted_paths(f"{vcf_results_stub}.encode_del_L")
-	(unsorted_del_R_path, del_R_path) = get_unsorted_and_sorted_paths(f"{vcf_results_stub}.encode_del_R")
-	(unsorted_ins_path, ins_path) = get_unsorted_and_sorted_paths(f"{vcf_results_stub}.encode_ins")
-	(unsorted_all_path, all_path) = get_unsorted_and_sorted_paths(f"{vcf_results_stub}.encode_all")
+	encoded_vcfs = {name: open_output_vcf(f"{vcf_results_stub}.encode_{name}.vcf", args.bgzip) for name in ENCODED_VCF_NAMES}
 
-	def writer_for_vcf(vcf: Any) -> Any:
-		return csv.writer(vcf, delimiter=OUTPUT_DELIMITER, quoting=csv.QUOTE_NONE, quotechar="")
-	
-	encoded_del_L_results_vcf = open(unsorted_del_L_path, "w")
-	encoded_del_R_results_vcf = open(unsorted_del_R_path, "w")
-	encoded_ins_results_vcf = open(unsorted_ins_path, "w")
-	encoded_all_results_vcf = open(unsorted_all_path, "w")
-
-	all_writer = writer_for_vcf(encoded_all_results_vcf)
-	writers = {
-		"del_L": [writer_for_vcf(encoded_del_L_results_vcf), all_writer],
-		"del_R": [writer_for_vcf(encoded_del_R_results_vcf), all_writer],
-		"ins": [writer_for_vcf(encoded_ins_results_vcf), all_writer]
-	}
-	
 	# write VCF headers to output files
-	chrom_lengths: Dict[str, int] = get_chrom_lengths(fasta)
-	write_header(all_writer, chrom_lengths)
-	for _, writers_list in writers.items():
-		write_header(writers_list[0], chrom_lengths)
+	chrom_lengths: Dict[str, int] = get_chrom_lengths(fasta, regions)
+	for vcf in encoded_vcfs.values():
+		write_header(writer_for_vcf(vcf), chrom_lengths)
 
 	# process variants
-	with open(vcf_input, "r") as t: 
-		for variant in csv.reader(t, delimiter="\t"):
-			if variant[0].startswith("#"): # header
-				continue
-			process_variant(variant, writers, fasta)
+	if regions is not None:
+		encode_variants(get_region_lines(vcf_input, regions), encoded_vcfs, fasta, regions)
+	else:
+		with open_vcf(vcf_input) as lines:
+			encode_variants(lines, encoded_vcfs, fasta)
 
 	# close output files
-	for vcf in [encoded_del_L_results_vcf, encoded_del_R_results_vcf, encoded_ins_results_vcf, encoded_all_results_vcf]:
+	for vcf in encoded_vcfs.values():
 		vcf.close()
-
-	# sort ouput
-	# (can get out of order from multiallelic records being split)
-	sort_output(unsorted_del_L_path, del_L_path)
-	sort_output(unsorted_del_R_path, del_R_path)
-	sort_output(unsorted_ins_path, ins_path)
-	sort_output(unsorted_all_path, all_path)
-	
+	print(f"Reference lookups: {fasta.get_stats()}")
+	fasta.close()
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# Evaluates a caller's (or Metal's) indel breakpoints against a truth set, in one sorted pass over both
+# breakpoints of the same indel type match if they're on the same contig at most a tolerance apart, each matching
+# at most one other, and only breakpoints within the tolerance of those being read are held in memory
+# Called as
+# 	python metal.py evaluate --truth [vcf] --query [vcf] -r [fasta ref]
+# with VCFs (or breakpoint stores, see breakpointStore.py) whose breakpoints are extracted as Metal does,
+# or, with --encoded, stubs of VCFs encoded by encode.py (${stub}.encode_{del_L,del_R,ins}.vcf)
+
+from collections import deque
+from getBreakpoints import open_vcf, Breakpoint, BREAKPOINT_TAGS, DEL_L_CODE, DEL_R_CODE, INS_CODE, NO_LENGTH
+from breakpointStore import get_caller_breakpoints
+import heapq
+from metal import get_contig_ranks, sort_breakpoints
+from pathlib import Path
+from regions import Regions
+from types import SimpleNamespace
+from typing import Dict, Iterator, List, Tuple
+
+# constants
+# breakpoints of the same indel type match if they're at most this many bases apart
+TOLERANCE = 3
+# indel type code of the breakpoints in each encoded VCF (see encode.ENCODED_VCF_NAMES)
+ENCODED_TYPE_CODES = {"del_L": DEL_L_CODE, "del_R": DEL_R_CODE, "ins": INS_CODE}
+TRUTH = 0
+QUERY = 1
+# rows of the report: every contig or indel type
+ALL = "*"
+REPORT_COLUMNS = ["contig", "indel_type", "TP", "FP", "FN", "precision", "recall", "F1"]
+
+# Counts of matched and unmatched breakpoints
+class Counts(SimpleNamespace):
+	# truth breakpoints matched by a query breakpoint
+	tp: int
+
+	# query breakpoints not matching any truth breakpoint
+	fp: int
+
+	# truth breakpoints not matched by any query breakpoint
+	fn: int
+
+	def get_row(self) -> List[str]:
+		precision = self.tp / (self.tp + self.fp) if self.tp + self.fp else 0
+		recall = self.tp / (self.tp + self.fn) if self.tp + self.fn else 0
+		f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0
+		return [str(self.tp), str(self.fp), str(self.fn), f"{precision:.4f}", f"{recall:.4f}", f"{f1:.4f}"]
+
+# yield the breakpoints of an encoded VCF (in which each breakpoint is an SNV), as breakpoints of indel_type
+def get_encoded_breakpoints(vcf: str, indel_type: int) -> Iterator[Breakpoint]:
+	with open_vcf(vcf) as lines:
+		for line in lines:
+			if not line.startswith("#"):
+				[chrom, pos] = line.split("\t", 2)[:2]
+				yield Breakpoint(chrom, int(pos), indel_type, NO_LENGTH)
+
+# yield (key, breakpoint) for the breakpoints of VCFs encoded by encode.py with stub, in key order
+def get_encoded_stream(stub: str, contig_ranks: Dict[str, int]) -> Iterator[Tuple[Tuple[Tuple[int, str], int], Breakpoint]]:
+
+	streams = []
+	for name, indel_type in ENCODED_TYPE_CODES.items():
+		vcf = Path(f"{stub}.encode_{name}.vcf")
+		if not vcf.is_file():
+			vcf = Path(f"{vcf}.gz")
+		assert vcf.is_file(), f"No encoded VCF {stub}.encode_{name}.vcf(.gz)"
+		streams.append(sort_breakpoints(get_encoded_breakpoints(str(vcf), indel_type), contig_ranks))
+	return heapq.merge(*streams, key=lambda keyed: keyed[0])
+
+# yield (key, breakpoint) for the breakpoints of a VCF or store (or of encoded VCFs, if encoded), in key order,
+# only those in regions, if given
+def get_stream(path: str, contig_ranks: Dict[str, int], encoded: bool = False,
+	regions: Regions = None) -> Iterator[Tuple[Tuple[Tuple[int, str], int], Breakpoint]]:
+	if not encoded:
+		return sort_breakpoints(get_caller_breakpoints(path, regions=regions), contig_ranks)
+	stream = get_encoded_stream(path, contig_ranks)
+	if regions is not None:
+		return ((key, breakpoint) for (key, breakpoint) in stream if regions.contains(breakpoint.chrom, breakpoint.pos))
+	return stream
+
+# match truth and query breakpoints (each as (key, breakpoint) in key order), counting them by contig and indel type
+# in a sweep over both, with a window of unmatched breakpoints of each input and indel type:
+# each breakpoint matches the earliest unmatched breakpoint of the other input within tolerance of it,
+# which matches as many breakpoints as possible
+# breakpoints repeated in an input (same contig, position and indel type) are counted once
+def match_breakpoints(truth: Iterator[Tuple[Tuple[Tuple[int, str], int], Breakpoint]],
+	query: Iterator[Tuple[Tuple[Tuple[int, str], int], Breakpoint]], tolerance: int = TOLERANCE) -> Dict[Tuple[str, int], Counts]:
+
+	counts: Dict[Tuple[str, int], Counts] = {}
+	# windows by indel type code, then input
+	windows: [[deque]] = [[deque(), deque()] for _ in BREAKPOINT_TAGS]
+	# position of the last breakpoint of each indel type and input
+	last_pos: [List[int]] = [[None, None] for _ in BREAKPOINT_TAGS]
+	current_contig = None
+
+	def get_counts(chrom: str, indel_type: int) -> Counts:
+		contig_counts = counts.get((chrom, indel_type))
+		if contig_counts is None:
+			contig_counts = counts[(chrom, indel_type)] = Counts(tp=0, fp=0, fn=0)
+		return contig_counts
+
+	# unmatched breakpoints that leave their window are false negatives (truth) or false positives (query)
+	def count_unmatched(source: int, breakpoint: Breakpoint) -> None:
+		breakpoint_counts = get_counts(breakpoint.chrom, breakpoint.indel_type)
+		if source == TRUTH:
+			breakpoint_counts.fn += 1
+		else:
+			breakpoint_counts.fp += 1
+
+	def flush_windows() -> None:
+		for (type_windows, type_last_pos) in zip(windows, last_pos):
+			for source, window in enumerate(type_windows):
+				while window:
+					count_unmatched(source, window.popleft())
+				type_last_pos[source] = None
+
+	merged = heapq.merge(((key, TRUTH, breakpoint) for (key, breakpoint) in truth),
+		((key, QUERY, breakpoint) for (key, breakpoint) in query), key=lambda keyed: keyed[:2])
+	for ((contig, pos), source, breakpoint) in merged:
+
+		if contig != current_contig:
+			flush_windows()
+			current_contig = contig
+
+		indel_type = breakpoint.indel_type
+		if last_pos[indel_type][source] == pos:
+			continue
+		last_pos[indel_type][source] = pos
+
+		# breakpoints of the other input too far behind this one can't be matched by any later breakpoint
+		other = windows[indel_type][1 - source]
+		while other and other[0].pos < pos - tolerance:
+			count_unmatched(1 - source, other.popleft())
+
+		if other:
+			other.popleft()
+			get_counts(breakpoint.chrom, indel_type).tp += 1
+		else:
+			# as are this input's own, which a long run of breakpoints in just one input would otherwise pile up
+			own = windows[indel_type][source]
+			while own and own[0].pos < pos - tolerance:
+				count_unmatched(source, own.popleft())
+			own.append(breakpoint)
+
+	flush_windows()
+	return counts
+
+# rows of the report: each indel type, each contig, then all breakpoints,
+# with contigs in the order they were evaluated
+def get_report(counts: Dict[Tuple[str, int], Counts]) -> List[List[str]]:
+
+	totals: Dict[Tuple[str, str], Counts] = {(ALL, tag): Counts(tp=0, fp=0, fn=0) for tag in BREAKPOINT_TAGS}
+	def add(key: Tuple[str, str], contig_counts: Counts) -> None:
+		total = totals.setdefault(key, Counts(tp=0, fp=0, fn=0))
+		total.tp += contig_counts.tp
+		total.fp += contig_counts.fp
+		total.fn += contig_counts.fn
+
+	for (chrom, indel_type), contig_counts in counts.items():
+		add((ALL, BREAKPOINT_TAGS[indel_type]), contig_counts)
+		add((chrom, ALL), contig_counts)
+	totals[(ALL, ALL)] = Counts(tp=0, fp=0, fn=0)
+	for contig_counts in counts.values():
+		add((ALL, ALL), contig_counts)
+
+	return [REPORT_COLUMNS] + [[chrom, indel_type] + total.get_row() for (chrom, indel_type), total in totals.items()]
+
+# evaluate the breakpoints of a query VCF against those of a truth VCF (or stubs of encoded VCFs, if encoded),
+# returning the rows of the report
+def evaluate(truth: str, query: str, ref_fasta: Path, tolerance: int = TOLERANCE, encoded: bool = False,
+	regions: Regions = None) -> List[List[str]]:
+
+	contig_ranks: Dict[str, int] = get_contig_ranks(Path(ref_fasta))
+	counts = match_breakpoints(get_stream(truth, contig_ranks, encoded, regions),
+		get_stream(query, contig_ranks, encoded, regions), tolerance)
+	return get_report(counts)
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# Sorts lines in bounded memory, like sort(1)
+# lines are read into runs that fit in a memory budget, each run is sorted and spilled to a temporary file,
+# then the runs are merged
+# Used by metal.py to sort and remove duplicates from its output
+
+import heapq
+import tempfile
+from typing import Any, Callable, Iterator, List
+
+# constants
+# approximate memory taken by a line held in a run, beyond its characters
+LINE_OVERHEAD = 120
+# most runs merged at once; more are merged in passes, so few files are open at a time
+MAX_MERGE_RUNS = 64
+
+# drop lines with the same key as the line before them, so the first of each run of equal lines is kept
+def unique_lines(lines: Iterator[str], key: Callable[[str], Any]) -> Iterator[str]:
+	last_key = object()
+	for line in lines:
+		line_key = key(line)
+		if line_key != last_key:
+			yield line
+			last_key = line_key
+
+# write sorted lines to a new temporary file, returning its path
+def spill_run(lines: List[str], tmp_dir: str) -> str:
+	with tempfile.NamedTemporaryFile("w", dir=tmp_dir, suffix=".run", delete=False, newline="") as run:
+		run.writelines(lines)
+		return run.name
+
+# yield lines of a run written by spill_run
+def read_run(run_path: str) -> Iterator[str]:
+	with open(run_path, newline="") as run:
+		yield from run
+
+# merge sorted runs into one sorted stream
+# runs are merged in the order given, and heapq.merge is stable, so lines with equal keys keep their input order
+def merge_runs(run_paths: [str], key: Callable[[str], Any], tmp_dir: str) -> Iterator[str]:
+
+	while len(run_paths) > MAX_MERGE_RUNS:
+		merged_paths = []
+		for start in range(0, len(run_paths), MAX_MERGE_RUNS):
+			group = run_paths[start:start + MAX_MERGE_RUNS]
+			merged_paths.append(spill_run(heapq.merge(*[read_run(p) for p in group], key=key), tmp_dir))
+		run_paths = merged_paths
+
+	yield from heapq.merge(*[read_run(p) for p in run_paths], key=key)
+
+# sort lines by key, holding about memory_budget bytes of lines at a time
+# the sort is stable; if unique, only the first of lines with equal keys is kept
+# lines must end with a line terminator
+def external_sort(lines: Iterator[str], key: Callable[[str], Any], memory_budget: int,
+	tmp_dir: str = None, unique: bool = False) -> Iterator[str]:
+
+	lines = iter(lines)
+	with tempfile.TemporaryDirectory(dir=tmp_dir, prefix="metal.sort.") as runs_dir:
+
+		run_paths: [str] = []
+		while True:
+
+			# read lines until the run fills the budget
+			run: [str] = []
+			run_size = 0
+			for line in lines:
+				run.append(line)
+				run_size += len(line) + LINE_OVERHEAD
+				if run_size >= memory_budget:
+					break
+			if not run:
+				break
+
+			run.sort(key=key)
+			if unique:
+				run = list(unique_lines(run, key))
+
+			if not run_paths and run_size < memory_budget:
+				# everything fit in one run, no need to spill it
+				yield from run
+				return
+
+			run_paths.append(spill_run(run, runs_dir))
+
+		sorted_lines = merge_runs(run_paths, key, runs_dir)
+		if unique:
+			sorted_lines = unique_lines(sorted_lines, key)
+		yield from sorted_lines
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# Extracts indel breakpoints from a caller's VCF (plain or bgzipped)
+# each deletion becomes a deletion start (<DEL_L>) and a deletion end (<DEL_R>) breakpoint,
+# and each insertion an insertion (<INS>) breakpoint
+# Used by metal.py, or called as
+# 	python getBreakpoints.py [vcf] [breakpoints tsv]
+# to write the breakpoints as [chrom, pos, indel type, length] rows
+
+import csv
+import gzip
+import io
+from pathlib import Path
+import pysam
+from typing import Any, Dict, Iterator, List, NamedTuple, Tuple
+import sys
+
+# constants
+OUTPUT_DELIMITER = "\t"
+# bump when the breakpoints extracted from a VCF change, so breakpoints cached by breakpointCache.py are extracted again
+EXTRACTOR_VERSION = 1
+BREAKPOINT_TAGS = ["<DEL_L>", "<DEL_R>", "<INS>"]
+# indel type codes: index of each breakpoint's tag in BREAKPOINT_TAGS
+(DEL_L_CODE, DEL_R_CODE, INS_CODE) = range(len(BREAKPOINT_TAGS))
+# length of breakpoints whose caller didn't report one
+NO_LENGTH = -1
+PINDEL_DEL_TAG = "<DEL>"
+# path read as standard input
+STDIN_PATH = "-"
+# gzip (and so BGZF) files start with these bytes
+GZIP_MAGIC = b"\x1f\x8b"
+
+# A breakpoint extracted from a VCF
+class Breakpoint(NamedTuple):
+	chrom: str
+
+	pos: int
+
+	# index of the breakpoint's tag in BREAKPOINT_TAGS
+	indel_type: int
+
+	# indel length, NO_LENGTH if the caller didn't report it
+	length: int
+
+	# the breakpoint as a [chrom, pos, indel type, length] row of strings
+	def get_row(self) -> List[str]:
+		return [self.chrom, str(self.pos), BREAKPOINT_TAGS[self.indel_type],
+			"NA" if self.length == NO_LENGTH else str(self.length)]
+
+# open a VCF for reading lines, decompressing it if it's gzipped or bgzipped
+# the VCF can be a pipe (FIFO), or STDIN_PATH for standard input
+def open_vcf(vcf: str) -> Any:
+	vcf_file = sys.stdin.buffer if vcf == STDIN_PATH else open(vcf, "rb")
+
+	# peek, rather than read, so nothing is taken from a pipe
+	is_gzipped: bool = vcf_file.peek(len(GZIP_MAGIC))[:len(GZIP_MAGIC)] == GZIP_MAGIC
+	if not is_gzipped:
+		return io.TextIOWrapper(vcf_file)
+	if vcf_file.seekable():
+		vcf_file.close()
+		return gzip.open(vcf, "rt")
+	return io.TextIOWrapper(gzip.GzipFile(fileobj=vcf_file))
+
+# whether a VCF has a tabix (.tbi) or CSI (.csi) index for fetching regions
+def is_indexed(vcf: str) -> bool:
+	return Path(f"{vcf}.tbi").is_file() or Path(f"{vcf}.csi").is_file()
+
+# yield the lines of a VCF on one contig
+# fetches just that contig if the VCF is indexed, otherwise scans the whole VCF for it
+def get_contig_lines(vcf: str, contig: str) -> Iterator[str]:
+
+	if is_indexed(vcf):
+		with pysam.TabixFile(vcf) as tbx:
+			if contig in tbx.contigs:
+				yield from tbx.fetch(contig)
+		return
+
+	contig_prefix: str = f"{contig}\t"
+	with open_vcf(vcf) as lines:
+		for line in lines:
+			if line.startswith(contig_prefix):
+				yield line
+
+# yield the lines of a VCF that can have breakpoints in regions (a regions.Regions), or in the regions on one contig
+# fetches each interval of the regions if the VCF is indexed (in the order of the index),
+# otherwise scans the whole VCF for contigs in the regions
+def get_region_lines(vcf: str, regions: Any, contig: str = None) -> Iterator[str]:
+
+	contigs = regions.contigs if contig is None else [contig]
+	if not is_indexed(vcf):
+		contig_prefixes = tuple(f"{c}\t" for c in contigs if c in regions.intervals)
+		with open_vcf(vcf) as lines:
+			for line in lines:
+				if line.startswith(contig_prefixes):
+					yield line
+		return
+
+	with pysam.TabixFile(vcf) as tbx:
+		for region_contig in tbx.contigs:
+			if region_contig not in contigs or region_contig not in regions.intervals:
+				continue
+			previous_end = None
+			for (start, end) in regions.intervals[region_contig]:
+				for line in tbx.fetch(region_contig, start, end):
+					# a record overlapping an earlier interval was fetched with it
+					if previous_end is not None and int(line.split("\t", 2)[1]) - 1 < previous_end:
+						continue
+					yield line
+				previous_end = end
+
+# byte range of each contig's records in a plain text VCF, in the order they appear, from one pass over it
+# a sorted VCF holds each contig's records together, so its contigs can be read separately with get_lines_between
+def get_contig_offsets(vcf: str) -> Dict[str, Tuple[int, int]]:
+
+	offsets: Dict[str, Tuple[int, int]] = {}
+	contig = None
+	start = offset = 0
+	with open(vcf, "rb") as lines:
+		for line in lines:
+			if not line.startswith(b"#"):
+				line_contig: str = line.split(b"\t", 1)[0].decode()
+				if line_contig != contig:
+					if contig is not None:
+						offsets[contig] = (start, offset)
+					assert line_contig not in offsets, f"{vcf} is not sorted: records on {line_contig} are not all together"
+					contig = line_contig
+					start = offset
+			offset += len(line)
+
+	if contig is not None:
+		offsets[contig] = (start, offset)
+	return offsets
+
+# yield the lines of a plain text VCF from byte offset start to end, as found by get_contig_offsets
+def get_lines_between(vcf: str, start: int, end: int) -> Iterator[str]:
+	with open(vcf, "rb") as lines:
+		lines.seek(start)
+		offset = start
+		for line in lines:
+			if offset >= end:
+				break
+			offset += len(line)
+			yield line.decode()
+
+# get endpoint of a Pindel deletion from END tag in INFO
+def get_end(chrom: str, pos: str, info: str) -> int:
+	for info_item in info.split(";"):
+		if info_item.startswith("END="):
+			return int(info_item[len("END="):])
+	raise AssertionError(f"Variant at {chrom}:{pos} is <DEL> but has no END in INFO")
+
+# yield breakpoints from lines of a VCF
+def get_breakpoints_from_lines(lines: Iterator[str]) -> Iterator[Breakpoint]:
+
+	for line in lines:
+		if line.startswith("#"):
+			continue
+
+		fields: [str] = line.rstrip("\n").split("\t", 8)
+		if len(fields) < 5:
+			continue
+		[chrom, pos, _, ref, alt] = fields[:5]
+
+		if "," in ref or "," in alt:
+			# skip multiallelic records
+			continue
+
+		if alt in BREAKPOINT_TAGS:
+
+			# already a breakpoint
+			# matches Scotch (except for 1-bp dels), Pindel insertions
+			yield Breakpoint(chrom, int(pos), BREAKPOINT_TAGS.index(alt), NO_LENGTH)
+
+		elif alt == PINDEL_DEL_TAG:
+
+			# Pindel deletion without allele
+			del_length: int = get_end(chrom, pos, fields[7]) - int(pos)
+			yield Breakpoint(chrom, int(pos), DEL_L_CODE, del_length)
+			yield Breakpoint(chrom, int(pos) + del_length, DEL_R_CODE, del_length)
+
+		elif len(ref) > len(alt):
+
+			# deletion
+			del_length: int = len(ref) - len(alt)
+			yield Breakpoint(chrom, int(pos), DEL_L_CODE, del_length)
+			yield Breakpoint(chrom, int(pos) + del_length, DEL_R_CODE, del_length)
+
+		elif len(ref) < len(alt):
+
+			# insertion
+			ins_length: int = len(alt) - len(ref)
+			yield Breakpoint(chrom, int(pos), INS_CODE, ins_length)
+
+# yield breakpoints from a VCF, or from just one contig of it, or just those in regions (a regions.Regions)
+def get_breakpoints(vcf: str, contig: str = None, regions: Any = None) -> Iterator[Breakpoint]:
+	if regions is not None:
+		for breakpoint in get_breakpoints_from_lines(get_region_lines(vcf, regions, contig)):
+			if regions.contains(breakpoint.chrom, breakpoint.pos):
+				yield breakpoint
+		return
+
+	if contig is not None:
+		yield from get_breakpoints_from_lines(get_contig_lines(vcf, contig))
+		return
+
+	with open_vcf(vcf) as lines:
+		yield from get_breakpoints_from_lines(lines)
+
+if __name__ == "__main__":
+
+	# parse args
+	vcf = sys.argv[1]
+	output = sys.argv[2]
+
+	with open(output, "w") as o:
+		writer = csv.writer(o, delimiter=OUTPUT_DELIMITER, lineterminator="\n")
+		for breakpoint in get_breakpoints(vcf):
+			writer.writerow(breakpoint.get_row())
@@ -1,18 +1,21 @@
 #!/usr/bin/env python3
 # Convert Scotch output to VCF format
-# Called by doPredict.sh as
-# 	python makeVCF.py [tsv results] [fasta ref] [vcf results stub]
+# Called by metal.py in process, or as
+# 	python makeVCF.py [tsv results] [fasta ref] [vcf results stub] [--bgzip] [--regions bed]
 # Writes the full results in VCF format to ${stub}.vcf,
+# and encoded (see encode.py) to ${stub}.encode_{del_L,del_R,ins,all}.vcf, in one pass
+# The results must be sorted by contig, then position
 
+import argparse
+from bgzf import open_output_vcf
+from contextlib import nullcontext
 import csv
-import os
-from pathlib import Path
-import pysam
-import textwrap
-from typing import Any, Dict, List
+import encode
+from metrics import Metrics
+from reference import open_reference
+from regions import read_regions, Regions
+from typing import Any, Callable, Dict, Iterator, List, Tuple
 import typing
-import subprocess
-import sys
 
 # constants
 CHROMS = list(str(c) for c in range(1, 23)) + ["X", "Y"]
@@ -31,21 +34,11 @@ FORMAT = "GT"
 GT = "./."
 ENCODE_GT = "0/1"
 
-# run a script
-def run_script(script_name, *args):
-	scotch_dir: Path = Path(__file__).absolute().parent
-	script: Path = scotch_dir / script_name
-	str_args = [str(a) for a in args]
-	print(f"Running {script} with {str_args}")
-
-	if script.suffix != ".py":
-		subprocess.call([script] + str_args)
-	else:
-		subprocess.call(["python", script] + str_args)
-
 # get chromosome lengths from fasta reference for ##contig headers
-def get_chrom_lengths(fasta: Any) -> Dict[str, int]:
-	return {chrom: fasta.get_reference_length(chrom) for chrom in CHROMS}
+# (only of chromosomes in regions, if given)
+def get_chrom_lengths(fasta: Any, regions: Regions = None) -> Dict[str, int]:
+	return {chrom: fasta.get_reference_length(chrom) for chrom in CHROMS
+		if regions is None or chrom in regions.intervals}
 
 # write_header to provided csv writer
 # returns number of header lines
@@ -64,8 +57,7 @@ def write_header(writer: Any, chrom_lengths: Dict[str, int]) -> None:
 		writer.writerow([header])
 
 	# contig headers
-	for chrom in CHROMS:
-		chrom_length: int = chrom_lengths[chrom]
+	for chrom, chrom_length in chrom_lengths.items():
 		writer.writerow([f"##contig=<ID={chrom},length={chrom_length}>"])
 
 	# column headers
@@ -86,8 +78,8 @@ def write_variant(writer: Any, chrom: str, pos: int, ref: str, alt: str, info: s
 	variant_row = [chrom, pos, ID, ref, alt, QUAL, FILTER, info, FORMAT, gt]
 	writer.writerow(variant_row)
 
-# process variant, writing to VCFs
-def process_variant(variant: List[str], writer: Any, fasta: Any) -> None:
+# process variant, writing to VCF and returning the VCF row
+def process_variant(variant: List[str], writer: Any, fasta: Any) -> List:
 
 	# unpack fields
 	[chrom, raw_pos, pred_type, length, called_by] = variant
@@ -100,56 +92,98 @@ def process_variant(variant: List[str], writer: Any, fasta: Any) -> None:
 
 	# write results to standard vcf
 	write_variant(writer, chrom, pos, ref, pred_type, info, GT)
+	return [chrom, pos, ID, ref, pred_type, QUAL, FILTER, info, FORMAT, GT]
 
-# sort numerically by position
-def sort_output(output_tsv, sorted_output_tsv) -> None:
+# Writes results to a VCF one at a time, as they're given, without the encoded VCFs
+# (used to stream metal.vcf to standard output)
+class VCFWriter:
 
-	# skip header
-	skip_header_cmd = f"""awk '/^#/' {output_tsv} > {sorted_output_tsv}"""
-	skip_header_output = subprocess.check_output(skip_header_cmd, shell=True)
+	def __init__(self, vcf: Any, fasta: Any, regions: Regions = None) -> None:
+		self.writer = csv.writer(vcf, delimiter=OUTPUT_DELIMITER, quoting=csv.QUOTE_NONE, quotechar=None)
+		self.fasta = fasta
+		write_header(self.writer, get_chrom_lengths(fasta, regions))
 
-	# sort the rest numerically by position
-	sort_cmd = f"""awk '!/^#/' {output_tsv} | sort -t$'\t' -k2,2n >> {sorted_output_tsv}"""
-	sort_output = subprocess.check_output(sort_cmd, shell=True)
-	print(f"sort output: {sort_output}")
+	def writerow(self, variant: List[str]) -> None:
+		process_variant(variant, self.writer, self.fasta)
 
-	# rm unsorted and check error
-	rm_cmd = f"""[ "$(wc -l < {output_tsv})" -eq "$(wc -l < {sorted_output_tsv})" ] && rm {output_tsv} || echo sort error"""
-	rm_output = subprocess.check_output(rm_cmd, shell=True)
-	print(f"rm output: {rm_output}")
-	
-if __name__ == "__main__":
+# write results, sorted by contig, then position, to ${stub}.vcf and the encoded VCFs
+# looking up the reference once for all of them
+# if bgzip, VCFs are compressed and indexed with tabix as they're written, to ${stub}.vcf.gz and so on
+# if regions is given, only results in them are written, and only their contigs have ##contig headers
+# metrics, if given, times writing the VCFs, and encoding within that, as stages
+def write_vcfs(variants: Iterator[List[str]], fasta: Any, vcf_results_stub: str, bgzip: bool = False,
+	regions: Regions = None, metrics: Metrics = None) -> None:
 
-	# parse args
-	tsv_results_path = sys.argv[1]
-	fasta_path = sys.argv[2]
-	vcf_results_stub = sys.argv[3]
+	with metrics.stage("write VCFs") if metrics is not None else nullcontext({}) as stage:
+		(count_in, count_out) = write_vcfs_rows(variants, fasta, vcf_results_stub, bgzip, regions,
+			encode.process_variant if metrics is None else metrics.timed_call("encode", encode.process_variant))
+		stage["records_in"] = stage.get("records_in", 0) + count_in
+		stage["records_out"] = stage.get("records_out", 0) + count_out
 
-	# read in FASTA reference
-	fasta = pysam.FastaFile(fasta_path)
+	print(f"Reference lookups: {fasta.get_stats()}")
+
+# write results to ${stub}.vcf and the encoded VCFs as for write_vcfs, encoding each with encode_variant,
+# returning the number of results given and the number written
+def write_vcfs_rows(variants: Iterator[List[str]], fasta: Any, vcf_results_stub: str, bgzip: bool, regions: Regions,
+	encode_variant: Callable) -> Tuple[int, int]:
 
 	# set up output
-	def get_unsorted_and_sorted_paths(stub):
-		return (f"{stub}.unsorted.vcf", f"{stub}.vcf")
+	results_vcf = open_output_vcf(f"{vcf_results_stub}.vcf", bgzip)
+	writer = csv.writer(results_vcf, delimiter=OUTPUT_DELIMITER, quoting=csv.QUOTE_NONE, quotechar=None)
 
-	(unsorted_results_path, results_path) = get_unsorted_and_sorted_paths(vcf_results_stub)
-	results_vcf = open(unsorted_results_path, "w")
-	writer = csv.writer(results_vcf, delimiter=OUTPUT_DELIMITER, quoting=csv.QUOTE_NONE, quotechar="")
+	# encoded breakpoints can be a base downstream of their variant,
+	# so hold them until the variants being written have passed them
+	encoded_vcfs = {name: open_output_vcf(f"{vcf_results_stub}.encode_{name}.vcf", bgzip)
+		for name in encode.ENCODED_VCF_NAMES}
+	encoded_buffers = {name: encode.ReorderBuffer(encode.writer_for_vcf(vcf)) for name, vcf in encoded_vcfs.items()}
+	encoded_writers = encode.get_encoded_writers(encoded_buffers)
 
 	# write VCF headers to output files
-	chrom_lengths: Dict[str, int] = get_chrom_lengths(fasta)
+	chrom_lengths: Dict[str, int] = get_chrom_lengths(fasta, regions)
 	write_header(writer, chrom_lengths)
+	for encoded_buffer in encoded_buffers.values():
+		encode.write_header(encoded_buffer.writer, chrom_lengths)
 
 	# process variants
-	with open(tsv_results_path, "r") as t: 
-		for variant in csv.reader(t, delimiter="\t"):
-			process_variant(variant, writer, fasta)
+	current_chrom = None
+	(count_in, count_out) = (0, 0)
+	for variant in variants:
+		count_in += 1
+		chrom: str = variant[0]
+		pos: int = int(variant[1])
+		if regions is not None and not regions.contains(chrom, pos):
+			continue
+		for encoded_buffer in encoded_buffers.values():
+			encoded_buffer.flush(pos if chrom == current_chrom else None)
+		current_chrom = chrom
+
+		vcf_variant: List = process_variant(variant, writer, fasta)
+		encode_variant(vcf_variant, encoded_writers, fasta)
+		count_out += 1
 
 	# close output files
-	results_vcf.close()
+	for encoded_buffer in encoded_buffers.values():
+		encoded_buffer.flush()
+	for vcf in [results_vcf] + list(encoded_vcfs.values()):
+		vcf.close()
+	return (count_in, count_out)
 
-	# sort output
-	sort_output(unsorted_results_path, results_path)
+if __name__ == "__main__":
+
+	# parse args
+	parser = argparse.ArgumentParser(description="Write Metal's results as VCFs")
+	parser.add_argument("tsv_results_path", type=str, help="Path to results TSV (metal.tsv), sorted by contig, then position")
+	parser.add_argument("fasta_path", type=str, help="Path to reference FASTA, or .2bit file made by reference.py")
+	parser.add_argument("vcf_results_stub", type=str, help="VCFs are written to ${stub}.vcf and ${stub}.encode_{del_L,del_R,ins,all}.vcf")
+	parser.add_argument("-z", "--bgzip", action="store_true",
+		help="Compress VCFs with BGZF and index them with tabix, writing ${stub}.vcf.gz(.tbi) and so on")
+	parser.add_argument("-R", "--regions", default=None, type=str, help="Path to BED of target regions: only results in them are written")
+	args = parser.parse_args()
+	regions = read_regions(args.regions) if args.regions is not None else None
 
-	# produce encoded VCFs
-	run_script("encode.py", results_path, vcf_results_stub, fasta_path)
+	# read in FASTA reference
+	fasta = open_reference(args.fasta_path)
+
+	# process variants
+	with open(args.tsv_results_path, "r") as t: 
+		write_vcfs(csv.reader(t, delimiter="\t"), fasta, args.vcf_results_stub, args.bgzip, regions)
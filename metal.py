@@ -1,20 +1,39 @@
 #!/usr/bin/env python3
 
 import argparse
+from bisect import bisect_right
+from breakpointCache import BreakpointCache, CACHE_SIZE
+from breakpointStore import extract_stores, get_caller_breakpoints, get_caller_contigs, is_store
+from checkpoint import hash_value, Checkpoint, COMPARE_STAGE, EXTRACT_STAGE, UNINDEXED, WRITE_STAGE
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing, nullcontext, redirect_stdout
 import csv
 from enum import Enum
+from externalSort import external_sort
+from functools import partial
+from getBreakpoints import is_indexed, Breakpoint, STDIN_PATH, BREAKPOINT_TAGS, DEL_R_CODE, INS_CODE, NO_LENGTH
+import heapq
+import io
+from makeVCFs import write_vcfs, VCFWriter
+from metrics import CountingWriter, Metrics, METRICS_NAME, profile
+from reference import is_two_bit, open_reference, TwoBitReference
+from regions import read_regions, Regions
 from pathlib import Path
-import subprocess
+import sys
 from types import SimpleNamespace
 import typing
-from typing import Any, List
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Tuple
 
 # Constants
 CHROM_INDEX = 0
 POS_INDEX = 1
 INDEL_TYPE_INDEX = 2
+LENGTH_INDEX = 3
 DIST_THRESHOLD = 3
 DELIMITER = "\t"
+# memory, in MB, for holding output rows while sorting them
+SORT_MEMORY = 1024
 
 class Caller(Enum):
 	SCOTCH = "Scotch"
@@ -28,55 +47,151 @@ class IndelType(Enum):
 	DEL_R = "<DEL_R>"
 	INS = "<INS>"
 
+# key of each caller's VCF in the dict of input VCFs, in the order readers are merged
+CALLER_VCF_KEYS = {
+	Caller.SCOTCH: "scotch",
+	Caller.DEEPVARIANT: "deepvariant",
+	Caller.GATKHC: "gatkhc",
+	Caller.VARSCAN: "varscan",
+	Caller.PINDELL: "pindell"
+}
+
 # A class that wraps around a generator (reader) that yields
-# indel breakpoints from a breakpoints file
+# indel breakpoints from a caller's VCF
 class VariantReader(SimpleNamespace):
 	# name of caller that called variants
 	caller_name: Caller
 	
 	# variant the generator is currently on
-	current: List
+	current: Breakpoint
 
 	# generator yielding indel breakpoints
 	reader: Any
 
-	# the indel type the reader is currently considering
-	# important: because we advance a group of readers by just incrementing the one with the lowest position
-	# we can skip over correlates because they need to be not just near in position
-	# but also have the same indel type
-	# so we iterate over the variants multiple times, each time pulling out one kind of indel type
-	filter_for: IndelType
-
 	# whether we've hit the end of the generator
 	has_next: bool
 
-	# list of callers who have calls that correlate with current
+	# (contig key, position) of current (see get_contig_key), parsed once when the reader advances
+	# so the merge never re-parses the row to order readers
+	key: Tuple[Tuple[int, str], int]
+
+# A breakpoint in the sweep window, waiting for correlating calls from other callers
+class PendingVariant(SimpleNamespace):
+	# name of caller that called variant
+	caller_name: Caller
+
+	# the breakpoint record
+	variant: Breakpoint
+
+	# (contig key, position) of variant
+	key: Tuple[Tuple[int, str], int]
+
+	# list of callers who have calls that correlate with variant, in the order they were found
+	# (or, when comparing at several thresholds, such a list for each threshold)
 	correlates: [Caller]
 
-	# whether we've printed current (don't want to print twice)
-	have_printed_current: bool
+# A correlated call, as in a row of metal.tsv, yielded by correlate_calls
+class CorrelatedCall(NamedTuple):
+	chrom: str
+
+	pos: int
+
+	# breakpoint tag, as in IndelType
+	indel_type: str
+
+	# indel length, NO_LENGTH if the caller didn't report it
+	length: int
 
-	# for when this reader is in a list of readers, whether this one was the most recently advanced
-	is_newest: bool
+	# caller whose call it is, then the callers whose calls correlate with it, in the order they were found
+	called_in: Tuple[Caller, ...]
+
+	# the call as a row of metal.tsv
+	def get_row(self) -> List[str]:
+		return [self.chrom, str(self.pos), self.indel_type, "NA" if self.length == NO_LENGTH else str(self.length),
+			",".join(caller.value for caller in self.called_in)]
+
+# order chromosomes numerically, then X, then everything else, with or without a "chr" prefix
+def get_chrom_idx(c: str) -> int:
+	if c.startswith("chr"):
+		c = c[len("chr"):]
+	if c.isdigit(): 
+		return int(c)
+	elif c == "X": 
+		return 23
+	return 24
+
+# rank of each contig in the reference FASTA, from its index (.fai), or in a .2bit reference
+# breakpoints are sorted in reference order, so this is the order the merge must follow
+def get_contig_ranks(ref_fasta: Path) -> Dict[str, int]:
+	if is_two_bit(ref_fasta):
+		with TwoBitReference(str(ref_fasta)) as ref:
+			return {contig: rank for rank, contig in enumerate(ref.references)}
+
+	fai: Path = Path(f"{ref_fasta}.fai")
+	if not fai.is_file():
+		print(f"No index at {fai}, ordering contigs numerically, then X, then everything else (by name)")
+		return {}
+
+	with open(fai) as f:
+		return {line.split("\t")[0]: rank for rank, line in enumerate(f)}
+
+# rank of a contig, used to order readers
+# contigs missing from the reference index go after those in it, in chromosome index order
+def get_contig_rank(chrom: str, contig_ranks: Dict[str, int]) -> int:
+	rank: int = contig_ranks.get(chrom)
+	if rank is None:
+		rank = len(contig_ranks) + get_chrom_idx(chrom)
+	return rank
+
+# (rank, name) of a contig, used to order readers: contigs missing from the reference index can share a rank,
+# so the name tells them apart, and orders them as metal.tsv is sorted
+def get_contig_key(chrom: str, contig_ranks: Dict[str, int]) -> Tuple[int, str]:
+	return (get_contig_rank(chrom, contig_ranks), chrom)
 
 # from a variant record, return enum item representing indel type
-def get_indel_type(variant: [str]) -> IndelType:
-	indel_type_map = {
-		"<DEL_L>": IndelType.DEL_L,
-		"<DEL_R>": IndelType.DEL_R,
-		"<INS>": IndelType.INS
-	}
-	assert variant[INDEL_TYPE_INDEX] in indel_type_map.keys(), \
-		f"Variant at {variant[CHROM_INDEX]}:{variant[POS_INDEX]} has unexpected type {variant[INDEL_TYPE_INDEX]}"
-	return indel_type_map[variant[INDEL_TYPE_INDEX]]
+def get_indel_type(variant: Breakpoint) -> IndelType:
+	return IndelType(BREAKPOINT_TAGS[variant.indel_type])
+
+# yield (key, variant) for each breakpoint from a VCF, in key order
+# a deletion's <DEL_R> is extracted alongside its <DEL_L>, so <DEL_R> records can be out of order
+# by up to the deletion length: hold them in a heap until the deletions being read have passed them
+def sort_breakpoints(variants: Iterator[Breakpoint], contig_ranks: Dict[str, int]) -> Iterator[Tuple[Tuple[Tuple[int, str], int], Breakpoint]]:
+
+	heap = []
+	# key of the contig being read, made once per contig
+	contig_key = None
+	for idx, variant in enumerate(variants):
+		if contig_key is None or variant.chrom != contig_key[1]:
+			contig_key = get_contig_key(variant.chrom, contig_ranks)
+		key = (contig_key, variant.pos)
 
-# return a VariantReader object that wraps around a list of breakpoints
-def get_reader(tsv: Any, filter_for: IndelType, caller_name: Caller) -> VariantReader:
+		# position of the deletion start, which is the order the VCF follows
+		if variant.indel_type == DEL_R_CODE and variant.length != NO_LENGTH:
+			anchor = (key[0], key[1] - variant.length)
+		else:
+			anchor = key
 
-	reader = (variant for variant in csv.reader(tsv, delimiter=DELIMITER)
-		if variant[INDEL_TYPE_INDEX] == filter_for.value)
+		while heap and heap[0][0] <= anchor:
+			(buffered_key, _, buffered_variant) = heapq.heappop(heap)
+			yield (buffered_key, buffered_variant)
+		heapq.heappush(heap, (key, idx, variant))
+
+	while heap:
+		(buffered_key, _, buffered_variant) = heapq.heappop(heap)
+		yield (buffered_key, buffered_variant)
+
+# return a VariantReader object that wraps around the breakpoints of every indel type in a VCF
+# or store of its breakpoints (or in one contig of it, or in regions, or not on skip_contigs)
+# metrics, if given, times extracting the breakpoints
+def get_reader(vcf: str, caller_name: Caller, contig_ranks: Dict[str, int], contig: str = None,
+	regions: Regions = None, metrics: Metrics = None, skip_contigs: set = None) -> VariantReader:
+
+	breakpoints: Iterator[Breakpoint] = get_caller_breakpoints(vcf, contig, regions, skip_contigs)
+	if metrics is not None:
+		breakpoints = metrics.timed(f"extract {caller_name.value}", breakpoints)
+	reader = sort_breakpoints(breakpoints, contig_ranks)
 	try:
-		first_variant = next(reader)
+		(first_key, first_variant) = next(reader)
 	except StopIteration:
 		return None
 
@@ -84,153 +199,765 @@ def get_reader(tsv: Any, filter_for: IndelType, caller_name: Caller) -> VariantR
 		caller_name=caller_name,
 		current=first_variant,
 		reader=reader,
-		filter_for=filter_for,
 		has_next=True,
-		correlates=[],
-		have_printed_current=False,
-		is_newest=False
+		key=first_key
 	)
 
+# return VariantReaders for the VCF of each caller that has variants
+# (vcfs can leave callers out, when comparing just some of them)
+def get_readers(vcfs: Dict[str, str], contig_ranks: Dict[str, int], contig: str = None,
+	regions: Regions = None, metrics: Metrics = None, skip_contigs: set = None) -> [VariantReader]:
+	all_readers = [get_reader(vcfs[vcf_key], caller_name, contig_ranks, contig, regions, metrics, skip_contigs)
+		for caller_name, vcf_key in CALLER_VCF_KEYS.items() if vcf_key in vcfs]
+
+	# remove None elements, readers with no variants
+	return [r for r in all_readers if r]
+
+# key to sort output rows by contig rank, then position
+# rows with the same key are duplicates (same chrom, pos, indel type)
+def get_output_key(contig_ranks: Dict[str, int], line: str) -> Tuple[int, str, int, str]:
+	[chrom, pos, indel_type, _] = line.split(DELIMITER, 3)
+	return (get_contig_rank(chrom, contig_ranks), chrom, int(pos), indel_type)
+
+# sort output lines by contig rank, then position, removing duplicates (keeping the first written)
+# holds about sort_memory MB of lines at a time, spilling sorted runs to tmp_dir
+def sort_lines(lines: Iterator[str], contig_ranks: Dict[str, int], sort_memory: int = SORT_MEMORY,
+	tmp_dir: Path = None) -> Iterator[str]:
+	return external_sort(lines, partial(get_output_key, contig_ranks), sort_memory * 1024 * 1024, tmp_dir, unique=True)
+
 # removing duplicates (same chrom, pos, indel type) from output
-# and sort numerically by position
-def sort_output(output_tsv: Path, sorted_output_tsv: Path) -> None:
-
-	# first sort considers everything up to ">" in allele, and sorts on that uniquely
-	# second sort sorts all calls by position in (asc.) numeerical order
-	sort_cmd = f"""sort -t">" -k1,1 -u {output_tsv} | sort -t$'\t' -k2,2n > {sorted_output_tsv}"""
-	print(f"Sorting: {sort_cmd}")
-	output = subprocess.check_output(sort_cmd, shell=True)
-	print(f"Output: {output}")
-
-# write current variant if has correlates
-def check_current(reader: VariantReader) -> None:
-
-	if reader.correlates and not reader.have_printed_current:
-		called_in = ",".join([reader.caller_name.value] + [c.value for c in reader.correlates])
-		output_writer.writerow(reader.current + [called_in])
-		reader.have_printed_current = True
-
-# run a script with given args
-def run_script(script_name, *args) -> None:
-	metal_dir: Path = Path(__file__).absolute().parent
-	script: Path = metal_dir / script_name
-	str_args = [str(a) for a in args]
-	print(f"Running {script} with {str_args}")
-	
-	if script.suffix != ".py": 
-		subprocess.call([script] + str_args)
-	else:
-		subprocess.call(["python", script] + str_args)
+# and sort by contig rank, then position
+def sort_output(output_tsv: Path, contig_ranks: Dict[str, int], sort_memory: int = SORT_MEMORY) -> Iterator[str]:
 
-# given a list of VariantReaders, advance the one that's at the lowest position
-# and still has more variants to yield
-def advance_readers(readers: [VariantReader]):
+	print(f"Sorting {output_tsv}...")
+	with open(output_tsv, newline="") as unsorted_lines:
+		yield from sort_lines(unsorted_lines, contig_ranks, sort_memory, output_tsv.parent)
 
-	readers_with_next = [reader for reader in readers if reader.has_next]
-	
-	# if no readers have next, we're done
-	if not readers_with_next: 
-		for reader in readers:
-			check_current(reader)
-		return False
-	
-	def get_chrom_idx(c):
-		if c.isdigit(): 
-			return int(c)
-		elif c == "X": 
-			return 23
-		return 24
-	
-	sorted_readers = sorted(readers_with_next,
-		key = lambda r: (get_chrom_idx(r.current[CHROM_INDEX]), int(r.current[POS_INDEX])))
-	lowest = sorted_readers[0]
+# write sorted output lines to sorted_output_tsv, yielding each one as a row once it's written
+def write_sorted_output(sorted_lines: Iterator[str], sorted_output_tsv: Path) -> Iterator[List[str]]:
+	with open(sorted_output_tsv, "w", newline="") as sorted_output:
+		for line in sorted_lines:
+			sorted_output.write(line)
+			yield line.rstrip("\r\n").split(DELIMITER)
 
-	lowest_next = next(lowest.reader, None)
+# Holds output rows as the sweep writes them, and passes them on to writer sorted and without duplicates,
+# as sort_output would, once no row before them can still be written
+# the sweep reports how far it has got with advance, so only rows near the breakpoints it's comparing are held
+class SortedOutput:
 
-	if lowest_next:
+	def __init__(self, writer: Any) -> None:
+		self.writer = writer
+		self.heap = []
+		self.count = 0
+		self.contig = None
+		# (chrom, pos, indel type) of the last row passed on
+		self.last_key = None
 
-		# we successfully incremented this reader, print the current variant if it had a correlate
-		check_current(lowest)
-		lowest.current = lowest_next
-		lowest.correlates = []
-		lowest.have_printed_current = False
+	# hold a row until flushed, ordered by chrom, position, then indel type, then by when it was written
+	def writerow(self, row: List[str]) -> None:
+		[chrom, pos, indel_type] = row[:3]
+		heapq.heappush(self.heap, ((chrom, int(pos), indel_type), self.count, row))
+		self.count += 1
 
-		# set only this reader to have is_newest = True
-		for reader in readers:
-			reader.is_newest = False
-		lowest.is_newest = True
+	# every row still to be written is on the contig of contig key (see get_contig_key), at or after pos
+	def advance(self, contig: Tuple[int, str], pos: int) -> None:
+		if contig != self.contig:
+			self.flush()
+			self.contig = contig
+		else:
+			self.flush(pos)
 
-	else:
-		# this reader has no more variants to yield,
-		# advance the one with the next lowest position
-		lowest.has_next = False
-		advance_readers(readers)
-
-	return True
-
-# compare current variants in each reader, 
-# looking for calls that have correlates from other callers
-def compare_readers(readers: [VariantReader]): 
-
-	# compare the most recently advanced reader to the rest
-	for reader in readers:
-		if reader.is_newest:
-			query_reader = reader
-			break
-
-	query_chrom = query_reader.current[CHROM_INDEX]
-	query_pos = int(query_reader.current[POS_INDEX])
-	query_filter_for = query_reader.filter_for
-	query_caller_name = query_reader.caller_name
-
-	# compare to results from other callers
-	for other_reader in readers:
-		if other_reader is query_reader:
-			continue
+	# pass on held rows at positions before pos, or all held rows if pos is None,
+	# keeping only the first written of rows with the same chrom, pos and indel type
+	def flush(self, pos: int = None) -> None:
+		while self.heap and (pos is None or self.heap[0][0][1] < pos):
+			(key, _, row) = heapq.heappop(self.heap)
+			if key != self.last_key:
+				self.writer.writerow(row)
+				self.last_key = key
+
+# Writes output rows to an unsorted TSV of the contig they're checkpointed with (see checkpoint.py),
+# and, once rows of a later contig are written, sorts the contig's rows and checkpoints it as finished,
+# along with the contigs before it without any rows
+# the comparison writes rows contig by contig, in reference order, so each contig is finished once it's passed
+class ContigWriter:
+
+	def __init__(self, checkpoint: Checkpoint, contig_ranks: Dict[str, int], sort_memory: int, metrics: Metrics) -> None:
+		self.checkpoint = checkpoint
+		self.contig_ranks = contig_ranks
+		self.sort_memory = sort_memory
+		self.metrics = metrics
+		self.all_contigs: [str] = checkpoint.get_all_contigs()
+		# index in all_contigs of the first contig not yet finished or passed
+		self.next_idx = 0
+		self.contig = None
+		self.output = None
+		self.writer = None
+
+	def writerow(self, row: List[str]) -> None:
+		contig = self.checkpoint.get_contig(row[CHROM_INDEX])
+		if contig != self.contig:
+			self.finish(contig)
+			self.contig = contig
+			self.output = open(self.get_unsorted_path(contig), "w", newline="")
+			self.writer = csv.writer(self.output, delimiter=DELIMITER)
+		self.writer.writerow(row)
+
+	def get_unsorted_path(self, contig: str) -> Path:
+		return self.checkpoint.get_contig_path(contig).with_suffix(".unsorted.tsv")
+
+	# sort and keep the contig being written, and finish every contig up to next_contig, or every contig if it's None
+	def finish(self, next_contig: str = None) -> None:
+
+		if self.contig is not None:
+			self.output.close()
+			unsorted_path = self.get_unsorted_path(self.contig)
+			with open(unsorted_path, newline="") as unsorted_lines:
+				sorted_lines = sort_lines(unsorted_lines, self.contig_ranks, self.sort_memory, unsorted_path.parent)
+				self.checkpoint.write_contig(self.contig, self.metrics.timed("sort", sorted_lines))
+			unsorted_path.unlink()
+			self.contig = None
 
-		other_chrom = other_reader.current[CHROM_INDEX]
-		if query_chrom != other_chrom: 
+		end_idx = self.all_contigs.index(next_contig, self.next_idx) if next_contig is not None else len(self.all_contigs)
+		self.checkpoint.finish_contigs(self.all_contigs[self.next_idx:end_idx])
+		self.next_idx = end_idx
+
+# Collects the calls written to it, as a writer would write them
+class CallList(list):
+
+	def writerow(self, call: CorrelatedCall) -> None:
+		self.append(call)
+
+# write variant if has correlates
+def check_current(pending: PendingVariant, output_writer: Any) -> None:
+
+	if pending.correlates:
+		called_in = ",".join([pending.caller_name.value] + [c.value for c in pending.correlates])
+		output_writer.writerow(pending.variant.get_row() + [called_in])
+
+# merge a list of VariantReaders into one stream of breakpoints in (contig key, position) order,
+# keeping a heap of (key, index) entries for the readers that still have more variants
+# ties are broken by position in readers, so the order matches a stable sort by key
+def advance_readers(readers: [VariantReader]) -> Iterator[PendingVariant]:
+
+	heap = [(reader.key, idx) for idx, reader in enumerate(readers)]
+	heapq.heapify(heap)
+
+	while heap:
+
+		_, lowest_idx = heap[0]
+		lowest = readers[lowest_idx]
+		yield PendingVariant(
+			caller_name=lowest.caller_name,
+			variant=lowest.current,
+			key=lowest.key,
+			correlates=[]
+		)
+
+		lowest_next = next(lowest.reader, None)
+		if lowest_next:
+			(lowest.key, lowest.current) = lowest_next
+			heapq.heapreplace(heap, (lowest.key, lowest_idx))
+		else:
+			# this reader has no more variants to yield
+			lowest.has_next = False
+			heapq.heappop(heap)
+
+# compare a breakpoint to every breakpoint in the window from another caller,
+# recording each correlating pair on both breakpoints
+# the window only holds breakpoints on the same contig within the distance threshold of query
+def compare_readers(window: [PendingVariant], query: PendingVariant) -> None:
+
+	query_caller_name = query.caller_name
+	query_is_ins = query.variant.indel_type == INS_CODE
+
+	for other in window:
+
+		other_caller_name = other.caller_name
+		if other_caller_name is query_caller_name:
 			continue
 
-		other_pos = int(other_reader.current[POS_INDEX])
-		other_caller_name = other_reader.caller_name
+		# Scotch and Pindel insertions must have correlates in DeepVariant, GATK HC, or VarScan
+		if (query_is_ins and
+			(query_caller_name is Caller.SCOTCH or query_caller_name is Caller.PINDELL) and
+			(other_caller_name is Caller.SCOTCH or other_caller_name is Caller.PINDELL)):
+				continue
+
+		if other_caller_name not in query.correlates:
+			query.correlates.append(other_caller_name)
+		if query_caller_name not in other.correlates:
+			other.correlates.append(query_caller_name)
+
+# look for correlating variants from different callers, yielding each breakpoint once its correlates are known
+# sweeps once over the merged breakpoints of every indel type, keeping a window per indel type
+# of the breakpoints of that type within dist_threshold of the newest breakpoint
+# a breakpoint is yielded once it leaves its window, and every window is emptied at the end of a contig
+# advance, if given, is called with the contig key and position every breakpoint still to be yielded is at or after
+# compare is called with each breakpoint's window and the breakpoint, before it's added to the window
+def sweep_readers(readers: [VariantReader], dist_threshold: int = DIST_THRESHOLD,
+	advance: Callable[[Tuple[int, str], int], None] = None,
+	compare: Callable[[List[PendingVariant], PendingVariant], None] = compare_readers) -> Iterator[PendingVariant]:
+
+	# windows by indel type code
+	windows: [deque] = [deque() for _ in BREAKPOINT_TAGS]
+	current_contig = None
+
+	def flush_windows() -> Iterator[PendingVariant]:
+		for window in windows:
+			while window:
+				yield window.popleft()
+
+	for pending in advance_readers(readers):
+
+		(contig, pos) = pending.key
+		if contig != current_contig:
+			yield from flush_windows()
+			current_contig = contig
+
+		# calls correlate if they are less than dist_threshold apart
+		# every window is trimmed, not just this breakpoint's: one of a type no longer being called
+		# would otherwise keep its breakpoints, and hold back advance, until the end of the contig
+		for window in windows:
+			while window and window[0].key[1] <= pos - dist_threshold:
+				yield window.popleft()
+
+		# correlates need to be not just near in position but also have the same indel type
+		window = windows[pending.variant.indel_type]
+
+		if advance is not None:
+			advance(contig, min([w[0].key[1] for w in windows if w] + [pos]))
+
+		compare(window, pending)
+		window.append(pending)
+
+	yield from flush_windows()
+
+# start the comparison process, writing each breakpoint with correlates once they're known (see sweep_readers)
+def start_compare(readers: [VariantReader], output_writer: Any, dist_threshold: int = DIST_THRESHOLD,
+	advance: Callable[[Tuple[int, str], int], None] = None) -> None:
+	for pending in sweep_readers(readers, dist_threshold, advance):
+		check_current(pending, output_writer)
+
+# compare a breakpoint to every breakpoint in the window from another caller, as compare_readers does,
+# at each of thresholds (ascending), recording each pair less than a threshold apart in the correlates for that threshold
+# the window holds breakpoints within the largest threshold of query
+def compare_readers_thresholds(thresholds: List[int], window: [PendingVariant], query: PendingVariant) -> None:
+
+	query.correlates = [[] for _ in thresholds]
+	query_pos = query.key[1]
+	query_caller_name = query.caller_name
+	query_is_ins = query.variant.indel_type == INS_CODE
+
+	for other in window:
+
+		other_caller_name = other.caller_name
+		if other_caller_name is query_caller_name:
+			continue
 
 		# Scotch and Pindel insertions must have correlates in DeepVariant, GATK HC, or VarScan
-		if (query_filter_for is IndelType.INS and
+		if (query_is_ins and
 			(query_caller_name is Caller.SCOTCH or query_caller_name is Caller.PINDELL) and
 			(other_caller_name is Caller.SCOTCH or other_caller_name is Caller.PINDELL)):
 				continue
-		
 
-		# check if calls are within distance threshold
-		# (don't need to check types match because all iterators only do one type at a time)
-		if abs(query_pos - other_pos) < DIST_THRESHOLD:
-			query_reader.correlates.append(other_caller_name)
-			other_reader.correlates.append(query_caller_name)
+		# the pair correlates at every threshold above the distance between them
+		for idx in range(bisect_right(thresholds, query_pos - other.key[1]), len(thresholds)):
+			if other_caller_name not in query.correlates[idx]:
+				query.correlates[idx].append(other_caller_name)
+			if query_caller_name not in other.correlates[idx]:
+				other.correlates[idx].append(query_caller_name)
 
-# start the comparison process, looking for correlating variants from different callesr
-def start_compare(readers: [VariantReader]) -> None:
+# compare breakpoints at several thresholds (ascending) in one sweep (see sweep_readers) at the largest threshold,
+# writing the calls correlated at each threshold to the output writer for that threshold:
+# the same rows (in a different order) as start_compare would write for each
+def start_compare_thresholds(readers: [VariantReader], output_writers: List[Any], thresholds: List[int]) -> None:
+	for pending in sweep_readers(readers, thresholds[-1], compare=partial(compare_readers_thresholds, thresholds)):
+		for (correlates, output_writer) in zip(pending.correlates, output_writers):
+			if correlates:
+				called_in = ",".join([pending.caller_name.value] + [c.value for c in correlates])
+				output_writer.writerow(pending.variant.get_row() + [called_in])
 
-	# at start, need to compare each list of variants to each other
-	for reader in readers:
-		for r in readers:
-			r.is_newest = False
-			r.correlates = []
+# compare the breakpoints in the callers' VCFs (or in one contig of them, or in regions, or not on skip_contigs),
+# writing correlated calls with the sweep over VariantReaders, or with arrays if backend is "numpy"
+# metrics, if given, times extracting each caller's breakpoints for the sweep
+def compare_calls(vcfs: Dict[str, str], contig_ranks: Dict[str, int], output_writer: Any,
+	dist_threshold: int = DIST_THRESHOLD, backend: str = "sweep", contig: str = None, regions: Regions = None,
+	metrics: Metrics = None, skip_contigs: set = None) -> None:
 
-		reader.is_newest = True
-		compare_readers(readers)
+	if backend == "numpy":
+		# numpy is only needed for this backend
+		from vectorized import start_compare_arrays
+		start_compare_arrays(vcfs, contig_ranks, output_writer, dist_threshold, contig, regions, skip_contigs)
+	else:
+		start_compare(get_readers(vcfs, contig_ranks, contig, regions, metrics, skip_contigs), output_writer,
+			dist_threshold)
 
-		for r in readers:
-			check_current(r)
+# compare the breakpoints in the callers' VCFs (or in one contig of them, or in regions, or not on skip_contigs)
+# at several thresholds (ascending) in one sweep, writing the calls correlated at each threshold
+# to the output writer for that threshold
+def compare_calls_thresholds(vcfs: Dict[str, str], contig_ranks: Dict[str, int], output_writers: List[Any],
+	thresholds: List[int], contig: str = None, regions: Regions = None, metrics: Metrics = None,
+	skip_contigs: set = None) -> None:
+	start_compare_thresholds(get_readers(vcfs, contig_ranks, contig, regions, metrics, skip_contigs), output_writers,
+		thresholds)
 
-	# advance through variant lists
-	while advance_readers(readers):
-		compare_readers(readers)
+# whether any of the callers' VCFs (or stores) can have breakpoints (in regions, if given)
+# on contigs missing from the reference index, which aren't compared by comparing each contig in it
+# a VCF without a tabix index can, unless it's empty, as its contigs aren't known without reading it
+def has_unindexed_contigs(vcfs: Dict[str, str], contig_ranks: Dict[str, int], regions: Regions = None) -> bool:
+	for vcf in vcfs.values():
+		caller_contigs: [str] = get_caller_contigs(vcf)
+		if caller_contigs is None:
+			if Path(vcf).stat().st_size:
+				return True
+		elif any(c not in contig_ranks and (regions is None or c in regions.intervals) for c in caller_contigs):
+			return True
+	return False
 
-	for r in readers:
-		check_current(r)
+# contigs to compare in parallel, one at a time: those in the reference (and in regions, if given),
+# then, if any VCF can have breakpoints on contigs missing from it, UNINDEXED, comparing those together
+def get_parallel_contigs(vcfs: Dict[str, str], contig_ranks: Dict[str, int], regions: Regions = None) -> List[str]:
+	contigs: [str] = [contig for contig in contig_ranks if regions is None or contig in regions.intervals]
+	if has_unindexed_contigs(vcfs, contig_ranks, regions):
+		contigs.append(UNINDEXED)
+	return contigs
 
-if __name__ ==  "__main__":
+# (contig, skip_contigs) to read a contig's breakpoints with (see get_parallel_contigs):
+# the breakpoints on every contig missing from the reference index, for UNINDEXED
+def get_contig_args(contig_ranks: Dict[str, int], contig: str) -> Tuple[str, set]:
+	if contig == UNINDEXED:
+		return (None, set(contig_ranks))
+	return (contig, None)
+
+# compare the breakpoints on one contig (see get_parallel_contigs), returning the sorted output rows as TSV text
+# run in worker processes, one contig at a time
+def compare_contig(vcfs: Dict[str, str], contig_ranks: Dict[str, int], dist_threshold: int, backend: str,
+	sort_memory: int, tmp_dir: Path, regions: Regions, contig: str) -> str:
+	output = io.StringIO(newline="")
+	output_writer = csv.writer(output, delimiter=DELIMITER)
+	(contig, skip_contigs) = get_contig_args(contig_ranks, contig)
+	compare_calls(vcfs, contig_ranks, output_writer, dist_threshold, backend, contig, regions, skip_contigs=skip_contigs)
+	output_lines = output.getvalue().splitlines(keepends=True)
+	return "".join(sort_lines(output_lines, contig_ranks, sort_memory, tmp_dir))
+
+# compare the breakpoints on one contig (see get_parallel_contigs) at several thresholds, returning the sorted output rows for each as TSV text
+def compare_contig_thresholds(vcfs: Dict[str, str], contig_ranks: Dict[str, int], thresholds: List[int],
+	sort_memory: int, tmp_dir: Path, regions: Regions, contig: str) -> List[str]:
+	outputs = [io.StringIO(newline="") for _ in thresholds]
+	output_writers = [csv.writer(output, delimiter=DELIMITER) for output in outputs]
+	(contig, skip_contigs) = get_contig_args(contig_ranks, contig)
+	compare_calls_thresholds(vcfs, contig_ranks, output_writers, thresholds, contig, regions, skip_contigs=skip_contigs)
+	return ["".join(sort_lines(output.getvalue().splitlines(keepends=True), contig_ranks, sort_memory, tmp_dir))
+		for output in outputs]
+
+# run Metal on one sample: compare the callers' VCFs (by key in CALLER_VCF_KEYS),
+# writing metal.tsv, metal.vcf, the encoded VCFs and the run's metrics (metrics.json, see metrics.py) to output_dir
+# fasta is an already open reference (see reference.open_reference) to write VCFs with, or None to open ref_fasta
+# cache, if given, holds breakpoints extracted from VCFs in earlier runs, and keeps those extracted in this one
+# with extract_jobs > 1, every VCF's breakpoints are extracted at the same time, before they're compared
+# if bgzip, VCFs are compressed and indexed with tabix as they're written
+# regions, if given, limits the comparison, and the VCFs' contigs, to target regions (see regions.py)
+# if profile_compare, the comparison is profiled with cProfile, to compare.prof in output_dir
+# with thresholds (ascending), calls are compared at each of them, instead of dist_threshold, in one sweep,
+# and each threshold's outputs are written to threshold_${threshold} in output_dir (see run_thresholds)
+# otherwise, the run is checkpointed a contig at a time (see checkpoint.py), and, if resume, a run already started
+# in output_dir with the same inputs is finished, rather than started again
+# (inputs are recognized by path, size and modification time, or, if checkpoint_by_content, a hash of their content)
+def run_metal(vcfs: Dict[str, str], ref_fasta: Path, output_dir: Path, dist_threshold: int = DIST_THRESHOLD,
+	threads: int = 1, backend: str = "sweep", sort_memory: int = SORT_MEMORY, fasta: Any = None,
+	cache: BreakpointCache = None, extract_jobs: int = 1, bgzip: bool = False, regions: Regions = None,
+	profile_compare: bool = False, thresholds: List[int] = None, resume: bool = False,
+	checkpoint_by_content: bool = False) -> None:
+
+	ref_fasta = Path(ref_fasta)
+	output_dir = Path(output_dir)
+	output_dir.mkdir(exist_ok=True) 
+	metrics = Metrics()
+
+	# every check comes before the checkpoint is made, so a run that fails one can be started again as it is
+	for caller_name, vcf in vcfs.items():
+		assert Path(vcf).is_file(), f"--{caller_name} must be a VCF file that exists"
+	assert ref_fasta.is_file(), "--ref_fasta must be a FASTA or .2bit file that exists"
+
+	contig_ranks: Dict[str, int] = get_contig_ranks(ref_fasta)
+	assert threads == 1 or contig_ranks, \
+		f"--threads needs a reference index at {ref_fasta}.fai (or a .2bit reference) to split work by contig"
+	if thresholds is None:
+		sorted_output_tsv: Path = output_dir / "metal.tsv"
+		assert resume or not sorted_output_tsv.exists(), \
+			f"Metal writes to {sorted_output_tsv} but that already exists: please delete or move"
+	else:
+		assert not resume, "Runs comparing calls at several thresholds aren't checkpointed, so can't be resumed"
+		assert backend == "sweep", "Calls are compared at several thresholds with the sweep backend"
+
+	checkpoint = None
+	if thresholds is None:
+		options = {"dist_threshold": dist_threshold, "regions": hash_value(regions.intervals) if regions is not None else None}
+		checkpoint = Checkpoint(output_dir, vcfs, contig_ranks, options, resume, checkpoint_by_content)
+		if checkpoint.is_finished(WRITE_STAGE):
+			print(f"The run in {output_dir} already finished")
+			return
+
+	if cache is not None:
+		# compare breakpoints from stores in the cache instead of extracting them from the VCFs
+		print(f"Getting breakpoints from cache {cache.cache_dir}...")
+		with metrics.stage("extract stores"):
+			store_paths = cache.get_stores(vcfs, extract_jobs)
+		vcfs = {caller_name: str(store_path) for caller_name, store_path in store_paths.items()}
+		print(f"Breakpoints: {cache.get_stats()}")
+	elif extract_jobs > 1:
+		# extract breakpoints into stores in output_dir, comparing once every caller's are ready
+		store_dir: Path = output_dir / "breakpoints"
+		store_dir.mkdir(exist_ok=True)
+		store_paths = {caller_name: store_dir / f"{caller_name}.bps" for caller_name in vcfs}
+		if checkpoint is None or not checkpoint.is_finished(EXTRACT_STAGE):
+			print(f"Extracting breakpoints with {min(extract_jobs, len(vcfs))} processes...")
+			with metrics.stage("extract stores"):
+				extract_stores(vcfs, store_paths, extract_jobs)
+			if checkpoint is not None:
+				checkpoint.finish(EXTRACT_STAGE)
+		vcfs = {caller_name: str(store_path) for caller_name, store_path in store_paths.items()}
+	
+	if thresholds is not None:
+		run_thresholds(vcfs, contig_ranks, ref_fasta, output_dir, thresholds, threads, sort_memory, fasta, bgzip, regions,
+			metrics, profile_compare)
+		metrics.write(output_dir / METRICS_NAME)
+		return
+
+	executor = None
+	if checkpoint.is_finished(COMPARE_STAGE):
+
+		sorted_lines: Iterator[str] = checkpoint.get_lines()
+
+	elif threads == 1:
+
+		# compare breakpoints, extracting them from each VCF as the comparison reaches them,
+		# and sort and checkpoint each contig's output once the comparison has passed it
+		print("Comparing calls...")
+		contig_writer = ContigWriter(checkpoint, contig_ranks, sort_memory, metrics)
+		with metrics.stage("compare") as compare_stage, \
+			(profile(output_dir / "compare.prof") if profile_compare else nullcontext()):
+			compare_calls(vcfs, contig_ranks, CountingWriter(contig_writer, compare_stage), dist_threshold, backend,
+				regions=regions, metrics=metrics, skip_contigs=set(checkpoint.contigs))
+			contig_writer.finish()
+		compare_stage["records_in"] = sum(stage["records_out"]
+			for name, stage in metrics.stages.items() if name.startswith("extract "))
+		metrics.get_stage("sort")["records_in"] = compare_stage["records_out"]
+		checkpoint.finish(COMPARE_STAGE)
+		sorted_lines: Iterator[str] = checkpoint.get_lines()
+
+	else:
+
+		# compare breakpoints on each contig in the reference in parallel, each process sorting its contig,
+		# and write the results in contig order: the same output as a serial run, without a final sort
+		for caller_name, vcf in vcfs.items():
+			if Path(vcf).stat().st_size and not is_store(vcf) and not is_indexed(vcf):
+				print(f"--{caller_name} has no tabix index, so it will be read once per contig: index it with tabix to avoid this")
+
+		contigs: [str] = get_parallel_contigs(vcfs, contig_ranks, regions)
+		finished = set(checkpoint.contigs)
+		print(f"Comparing calls on {len([contig for contig in contigs if contig not in finished])} contigs with {threads} processes...")
+		executor = ProcessPoolExecutor(max_workers=threads)
+		compare = partial(compare_contig, vcfs, contig_ranks, dist_threshold, backend,
+			max(sort_memory // threads, 1), output_dir, regions)
+		# the time spent waiting for the processes' sorted results
+		sorted_lines: Iterator[str] = metrics.timed("compare and sort",
+			get_contig_lines(checkpoint, contigs, executor.map(compare, [contig for contig in contigs if contig not in finished])))
+
+	write_outputs(sorted_lines, output_dir, ref_fasta, fasta, bgzip, regions, metrics)
+	if executor is not None:
+		executor.shutdown()
+
+	metrics.write(output_dir / METRICS_NAME)
+	checkpoint.finish(WRITE_STAGE)
+	checkpoint.remove_contigs()
+
+# yield the sorted output lines of each of contigs, in order, from the checkpoint if it's finished,
+# or otherwise from the next of contig_outputs (the sorted output of each unfinished contig, in order),
+# which is checkpointed before it's yielded, finishing the comparison once every contig is
+def get_contig_lines(checkpoint: Checkpoint, contigs: List[str], contig_outputs: Iterator[str]) -> Iterator[str]:
+
+	finished = set(checkpoint.contigs)
+	for contig in contigs:
+		if contig in finished:
+			yield from checkpoint.get_contig_lines(contig)
+		else:
+			contig_output = next(contig_outputs)
+			checkpoint.write_contig(contig, [contig_output])
+			checkpoint.finish_contigs([contig])
+			yield from contig_output.splitlines(keepends=True)
+
+	# UNINDEXED is left out of contigs when no VCF has breakpoints on contigs missing from the reference index
+	checkpoint.finish_contigs(checkpoint.get_all_contigs())
+	checkpoint.finish(COMPARE_STAGE)
+
+# write sorted output lines to metal.tsv in output_dir, making metal.vcf and the encoded VCFs from them as they're written
+def write_outputs(sorted_lines: Iterator[str], output_dir: Path, ref_fasta: Path, fasta: Any, bgzip: bool,
+	regions: Regions, metrics: Metrics) -> None:
+
+	print("Writing VCFs...")
+	metal_output_stub: str = str((output_dir / "metal").resolve())
+	variants: Iterator[List[str]] = metrics.count_correlates(write_sorted_output(sorted_lines, output_dir / "metal.tsv"))
+	if fasta is None:
+		with open_reference(ref_fasta) as fasta:
+			write_vcfs(variants, fasta, metal_output_stub, bgzip, regions, metrics)
+	else:
+		write_vcfs(variants, fasta, metal_output_stub, bgzip, regions, metrics)
+
+# compare the callers' VCFs (or stores) at several thresholds in one sweep, writing each threshold's metal.tsv,
+# metal.vcf, encoded VCFs and metrics of sorting and writing them to threshold_${threshold} in output_dir
+# (comparison is timed in metrics)
+# each threshold's rows are kept in a TSV in its directory until its outputs are written
+def run_thresholds(vcfs: Dict[str, str], contig_ranks: Dict[str, int], ref_fasta: Path, output_dir: Path,
+	thresholds: List[int], threads: int, sort_memory: int, fasta: Any, bgzip: bool, regions: Regions, metrics: Metrics,
+	profile_compare: bool) -> None:
+
+	threshold_dirs: [Path] = [output_dir / f"threshold_{threshold}" for threshold in thresholds]
+	for threshold_dir in threshold_dirs:
+		threshold_dir.mkdir(exist_ok=True)
+		assert not (threshold_dir / "metal.tsv").exists(), \
+			f"Metal writes to {threshold_dir / 'metal.tsv'} but that already exists: please delete or move"
+
+	if threads == 1:
+
+		# compare breakpoints, writing each threshold's unsorted output, then sort each
+		output_tsvs: [Path] = [threshold_dir / "metal.unsorted.tsv" for threshold_dir in threshold_dirs]
+		outputs = [open(output_tsv, "w", newline="") for output_tsv in output_tsvs]
+		print(f"Comparing calls at thresholds {', '.join(str(threshold) for threshold in thresholds)}...")
+		with metrics.stage("compare") as compare_stage, \
+			(profile(output_dir / "compare.prof") if profile_compare else nullcontext()):
+			compare_calls_thresholds(vcfs, contig_ranks, [csv.writer(output, delimiter=DELIMITER) for output in outputs],
+				thresholds, regions=regions, metrics=metrics)
+		compare_stage["records_in"] = sum(stage["records_out"]
+			for name, stage in metrics.stages.items() if name.startswith("extract "))
+		for output in outputs:
+			output.close()
+		threshold_lines = [partial(sort_output, output_tsv, contig_ranks, sort_memory) for output_tsv in output_tsvs]
+
+	else:
+
+		# compare breakpoints on each contig in parallel, each process sorting its contig's output for each threshold,
+		# and append each contig's sorted output to each threshold's output: as contigs are in order, it's sorted
+		contigs: [str] = get_parallel_contigs(vcfs, contig_ranks, regions)
+		print(f"Comparing calls at thresholds {', '.join(str(threshold) for threshold in thresholds)} " +
+			f"on {len(contigs)} contigs with {threads} processes...")
+		output_tsvs: [Path] = [threshold_dir / "metal.sorted.tsv" for threshold_dir in threshold_dirs]
+		outputs = [open(output_tsv, "w", newline="") for output_tsv in output_tsvs]
+		compare = partial(compare_contig_thresholds, vcfs, contig_ranks, thresholds, max(sort_memory // threads, 1),
+			output_dir, regions)
+		with metrics.stage("compare and sort"), ProcessPoolExecutor(max_workers=threads) as executor:
+			for contig_outputs in executor.map(compare, contigs):
+				for (output, contig_output) in zip(outputs, contig_outputs):
+					output.write(contig_output)
+		for output in outputs:
+			output.close()
+		threshold_lines = [partial(open, output_tsv, newline="") for output_tsv in output_tsvs]
+
+	for (threshold, threshold_dir, output_tsv, lines) in zip(thresholds, threshold_dirs, output_tsvs, threshold_lines):
+		print(f"Threshold {threshold}:")
+		threshold_metrics = Metrics()
+		with closing(lines()) as sorted_lines:
+			write_outputs(threshold_metrics.timed("sort", sorted_lines), threshold_dir, ref_fasta, fasta, bgzip, regions,
+				threshold_metrics)
+		threshold_metrics.write(threshold_dir / METRICS_NAME)
+		output_tsv.unlink()
+
+# yield the correlated calls in the callers' VCFs (or stores), by key in CALLER_VCF_KEYS, without writing any files:
+# the rows of metal.tsv, in the same order (by contig rank, then position, without duplicates), as CorrelatedCalls
+# contigs are ranked as in ref_fasta's index (or .2bit reference), or numerically, then X, then the rest, without one
+# only breakpoints near those being compared are held in memory, so calls are yielded as the comparison reaches them
+# (or just those on contig, or in regions)
+def correlate_calls(vcfs: Dict[str, str], ref_fasta: Path = None, dist_threshold: int = DIST_THRESHOLD,
+	contig: str = None, regions: Regions = None) -> Iterator[CorrelatedCall]:
+
+	unknown_keys = [key for key in vcfs if key not in CALLER_VCF_KEYS.values()]
+	assert not unknown_keys, f"Unknown callers {', '.join(unknown_keys)}: expected {', '.join(CALLER_VCF_KEYS.values())}"
+	assert dist_threshold > 0, "dist_threshold must be positive"
+
+	contig_ranks: Dict[str, int] = get_contig_ranks(Path(ref_fasta)) if ref_fasta is not None else {}
+	# sorted calls passed on by sorted_output, yielded between steps of the sweep
+	calls = CallList()
+	sorted_output = SortedOutput(calls)
+	readers: [VariantReader] = get_readers(vcfs, contig_ranks, contig, regions)
+	for pending in sweep_readers(readers, dist_threshold, sorted_output.advance):
+		if pending.correlates:
+			sorted_output.writerow(CorrelatedCall(*pending.variant[:2], BREAKPOINT_TAGS[pending.variant.indel_type],
+				pending.variant.length, (pending.caller_name, *pending.correlates)))
+		if calls:
+			yield from calls
+			calls.clear()
+	sorted_output.flush()
+	yield from calls
+
+# run Metal on one sample without writing any files, streaming metal.vcf to output (e.g., standard output)
+# the callers' VCFs can be pipes (FIFOs), or one of them STDIN_PATH, as they're each read once, in step with each other,
+# and only breakpoints near those being compared are held in memory
+def stream_metal(vcfs: Dict[str, str], ref_fasta: Path, output: Any, dist_threshold: int = DIST_THRESHOLD,
+	regions: Regions = None) -> None:
+
+	for caller_name, vcf in vcfs.items():
+		assert vcf == STDIN_PATH or Path(vcf).exists(), f"--{caller_name} must be a VCF file or pipe that exists, or {STDIN_PATH}"
+	assert list(vcfs.values()).count(STDIN_PATH) <= 1, f"Only one VCF can be read from standard input ({STDIN_PATH})"
+
+	contig_ranks: Dict[str, int] = get_contig_ranks(ref_fasta)
+	with open_reference(ref_fasta) as fasta:
+		sorted_output = SortedOutput(VCFWriter(output, fasta, regions))
+		start_compare(get_readers(vcfs, contig_ranks, regions=regions), sorted_output, dist_threshold, sorted_output.advance)
+		sorted_output.flush()
+		output.flush()
+		print(f"Reference lookups: {fasta.get_stats()}")
+
+# run Metal on each sample in a manifest, as
+# 	python metal.py batch --manifest [samples tsv] -r [fasta ref] --jobs N
+# (see batch.py), exiting with an error if any sample failed
+def main_batch(argv: List[str]) -> None:
+
+	parser = argparse.ArgumentParser(prog="metal.py batch", description="Run Metal on a batch of samples")
+	parser.add_argument("-f", "--manifest", required=True, type=str,
+		help="Path to TSV with a header row of sample, scotch_vcf, deepvariant_vcf, gatkhc_vcf, varscan_vcf, pindell_vcf, output_dir")
+	parser.add_argument("-r", "--ref_fasta", required=True, type=str, help="Path to reference FASTA, or .2bit file made by reference.py")
+	parser.add_argument("-j", "--jobs", default=1, type=int, help="Number of samples run at a time (default: 1)")
+	parser.add_argument("-t", "--dist_threshold", default=DIST_THRESHOLD, type=int,
+		help=f"Calls from different callers correlate if they are less than this many bases apart (default: {DIST_THRESHOLD})")
+	parser.add_argument("-b", "--backend", default="sweep", choices=["sweep", "numpy"],
+		help="Compare calls by sweeping over the breakpoints, or with NumPy arrays after loading them (default: sweep)")
+	parser.add_argument("-m", "--sort_memory", default=SORT_MEMORY, type=int,
+		help=f"Memory, in MB, for sorting output, shared by the samples running at a time (default: {SORT_MEMORY})")
+	parser.add_argument("--resume", action="store_true",
+		help="Finish the runs of samples that stopped partway, and skip samples that already finished")
+	args = parser.parse_args(argv)
+	print(args)
+	assert args.jobs > 0, "--jobs must be positive"
+	assert args.dist_threshold > 0, "--dist_threshold must be positive"
+	assert args.sort_memory > 0, "--sort_memory must be positive"
+	assert Path(args.manifest).is_file(), "--manifest must be a file that exists"
+
+	from batch import run_batch
+	statuses = run_batch(Path(args.manifest), Path(args.ref_fasta), args.jobs, args.dist_threshold, args.backend,
+		args.sort_memory, args.resume)
+	if not all(status.succeeded for status in statuses):
+		sys.exit(1)
+
+# evaluate a query VCF's breakpoints against a truth VCF's, as
+# 	python metal.py evaluate --truth [vcf] --query [vcf] -r [fasta ref]
+# (see evaluate.py), writing the report as a TSV
+def main_evaluate(argv: List[str]) -> None:
+
+	from evaluate import evaluate, TOLERANCE
+	parser = argparse.ArgumentParser(prog="metal.py evaluate",
+		description="Evaluate a VCF's indel breakpoints against a truth set: TP, FP, FN, precision and recall")
+	parser.add_argument("--truth", required=True, type=str,
+		help="Path to truth VCF (or breakpoint store), or, with --encoded, stub of the truth's encoded VCFs")
+	parser.add_argument("--query", required=True, type=str,
+		help="Path to VCF (or breakpoint store) to evaluate, e.g., metal.vcf, or, with --encoded, stub of its encoded VCFs")
+	parser.add_argument("-r", "--ref_fasta", required=True, type=str,
+		help="Path to reference FASTA (with a .fai index), or .2bit file, giving the order of contigs")
+	parser.add_argument("-e", "--encoded", action="store_true",
+		help="Compare VCFs encoded by encode.py, ${stub}.encode_{del_L,del_R,ins}.vcf(.gz), rather than extracting breakpoints")
+	parser.add_argument("-t", "--tolerance", default=TOLERANCE, type=int,
+		help=f"Breakpoints of the same indel type match if they're at most this many bases apart (default: {TOLERANCE})")
+	parser.add_argument("-R", "--regions", default=None, type=str, help="Path to BED of regions: only breakpoints in them are evaluated")
+	parser.add_argument("-o", "--output", default=None, type=str, help="Path to write the report to as a TSV (default: standard output)")
+	args = parser.parse_args(argv)
+	assert args.tolerance >= 0, "--tolerance must not be negative"
+	regions = read_regions(args.regions) if args.regions is not None else None
+
+	# the report goes to standard output, unless written to a file, so messages go to standard error
+	with redirect_stdout(sys.stderr):
+		report = evaluate(args.truth, args.query, Path(args.ref_fasta), args.tolerance, args.encoded, regions)
+	if args.output is None:
+		csv.writer(sys.stdout, delimiter=DELIMITER, lineterminator="\n").writerows(report)
+	else:
+		with open(args.output, "w", newline="") as output:
+			csv.writer(output, delimiter=DELIMITER, lineterminator="\n").writerows(report)
+
+# run a worker service that runs Metal on samples submitted to it over a unix socket, as
+# 	python metal.py serve --socket [path] -r [fasta ref] --jobs N
+# (see service.py), until it's sent a shutdown request
+def main_serve(argv: List[str]) -> None:
+
+	parser = argparse.ArgumentParser(prog="metal.py serve",
+		description="Run Metal on samples submitted over a unix socket, with worker processes that keep the reference open")
+	parser.add_argument("-S", "--socket", required=True, type=str, help="Path to the unix socket to listen on")
+	parser.add_argument("-r", "--ref_fasta", required=True, type=str, help="Path to reference FASTA, or .2bit file made by reference.py")
+	parser.add_argument("-j", "--jobs", default=1, type=int, help="Number of samples run at a time (default: 1)")
+	parser.add_argument("-t", "--dist_threshold", default=DIST_THRESHOLD, type=int,
+		help=f"Calls from different callers correlate if they are less than this many bases apart, for samples submitted without one (default: {DIST_THRESHOLD})")
+	parser.add_argument("-b", "--backend", default="sweep", choices=["sweep", "numpy"],
+		help="Compare calls by sweeping over the breakpoints, or with NumPy arrays after loading them, for samples submitted without one (default: sweep)")
+	parser.add_argument("-m", "--sort_memory", default=SORT_MEMORY, type=int,
+		help=f"Memory, in MB, for sorting output, shared by the samples running at a time (default: {SORT_MEMORY})")
+	args = parser.parse_args(argv)
+	print(args)
+	assert args.jobs > 0, "--jobs must be positive"
+	assert args.dist_threshold > 0, "--dist_threshold must be positive"
+	assert args.sort_memory > 0, "--sort_memory must be positive"
+	assert Path(args.ref_fasta).is_file(), "--ref_fasta must be a file that exists"
+
+	from service import serve
+	serve(Path(args.socket), Path(args.ref_fasta), args.jobs, args.dist_threshold, args.backend, args.sort_memory)
+
+# submit the samples in a manifest to a worker service, or query or stop it, as
+# 	python metal.py submit --socket [path] --manifest [samples tsv] --wait
+# (see service.py), exiting with an error if any sample waited for failed
+def main_submit(argv: List[str]) -> None:
+
+	parser = argparse.ArgumentParser(prog="metal.py submit", description="Submit samples to a Metal worker service")
+	parser.add_argument("-S", "--socket", required=True, type=str, help="Path to the unix socket the service listens on")
+	action = parser.add_mutually_exclusive_group(required=True)
+	action.add_argument("-f", "--manifest", type=str,
+		help="Path to TSV of samples to submit, with a header row of sample, scotch_vcf, deepvariant_vcf, gatkhc_vcf, varscan_vcf, pindell_vcf, output_dir")
+	action.add_argument("--status", action="store_true", help="Print the state of every job submitted to the service")
+	action.add_argument("--shutdown", action="store_true", help="Stop the service once the samples already submitted are finished")
+	parser.add_argument("-w", "--wait", action="store_true", help="Wait for the submitted samples to finish, printing each one's status")
+	parser.add_argument("-t", "--dist_threshold", default=None, type=int,
+		help="Calls from different callers correlate if they are less than this many bases apart (default: the service's)")
+	parser.add_argument("-b", "--backend", default=None, choices=["sweep", "numpy"],
+		help="Compare calls by sweeping over the breakpoints, or with NumPy arrays after loading them (default: the service's)")
+	args = parser.parse_args(argv)
+	assert args.dist_threshold is None or args.dist_threshold > 0, "--dist_threshold must be positive"
+
+	from service import get_jobs, shutdown_service, submit_manifest, wait_for_job, DONE
+	socket_path = Path(args.socket)
+	assert socket_path.is_socket(), f"No service is listening on {socket_path}"
+	if args.status:
+		for job in get_jobs(socket_path):
+			print(f"{job['job']}\t{job['sample']}\t{job['state']}" + (f"\t{job['error']}" if job["error"] else ""))
+		return
+	if args.shutdown:
+		shutdown_service(socket_path)
+		return
+
+	assert Path(args.manifest).is_file(), "--manifest must be a file that exists"
+	job_ids = submit_manifest(socket_path, Path(args.manifest), args.dist_threshold, args.backend)
+	print(f"Submitted {len(job_ids)} samples as jobs {', '.join(str(job_id) for job_id in job_ids)}")
+	if not args.wait:
+		return
+
+	failed: [str] = []
+	for job_id in job_ids:
+		job = wait_for_job(socket_path, job_id)
+		outcome = "done" if job["state"] == DONE else f"FAILED ({job['error']})"
+		print(f"Job {job_id}: {job['sample']} {outcome} in {job['seconds']:.1f}s")
+		if job["state"] != DONE:
+			failed.append(job["sample"])
+	if failed:
+		print(f"Failed samples (see metal.log in their output directories): {', '.join(failed)}")
+		sys.exit(1)
+
+# run Metal on one sample from command line arguments, or run a subcommand:
+# batch, evaluate, or serve and submit (see service.py)
+def main(argv: List[str]) -> None:
+
+	subcommands: Dict[str, Callable[[List[str]], None]] = {
+		"batch": main_batch,
+		"evaluate": main_evaluate,
+		"serve": main_serve,
+		"submit": main_submit
+	}
+	if argv and argv[0] in subcommands:
+		subcommands[argv[0]](argv[1:])
+		return
 
 	parser = argparse.ArgumentParser(description="Process args")
 	parser.add_argument("-s", "--scotch_vcf", required=True, type=str, help="Path to Scotch VCF")
@@ -238,19 +965,58 @@ if __name__ ==  "__main__":
 	parser.add_argument("-g", "--gatkhc_vcf", required=True, type=str, help="Path to GATK HC VCF")
 	parser.add_argument("-v", "--varscan_vcf", required=True, type=str, help="Path to Varscan VCF")
 	parser.add_argument("-p", "--pindell_vcf", required=True, type=str, help="Path to Pindel-L VCF")
-	parser.add_argument("-r", "--ref_fasta", required=True, type=str, help="Path to reference FASTA")
-	parser.add_argument("-o", "--output_dir", required=True, type=str, help="Path to output directory")
-	args = parser.parse_args()
-	print(args)
+	parser.add_argument("-r", "--ref_fasta", required=True, type=str, help="Path to reference FASTA, or .2bit file made by reference.py")
+	parser.add_argument("-o", "--output_dir", required=True, type=str,
+		help=f"Path to output directory, or {STDIN_PATH} to stream metal.vcf to standard output, without writing any files")
+	parser.add_argument("-t", "--dist_threshold", default=DIST_THRESHOLD, type=int,
+		help=f"Calls from different callers correlate if they are less than this many bases apart (default: {DIST_THRESHOLD})")
+	parser.add_argument("-T", "--thresholds", nargs="+", default=None, type=int,
+		help="Compare calls at each of these thresholds (instead of --dist_threshold) in one pass, " +
+		"writing each threshold's outputs to threshold_${threshold} in --output_dir")
+	parser.add_argument("-n", "--threads", default=1, type=int,
+		help="Number of processes comparing calls, one contig at a time (default: 1)")
+	parser.add_argument("-b", "--backend", default="sweep", choices=["sweep", "numpy"],
+		help="Compare calls by sweeping over the breakpoints, or with NumPy arrays after loading them (default: sweep)")
+	parser.add_argument("-m", "--sort_memory", default=SORT_MEMORY, type=int,
+		help=f"Memory, in MB, for sorting output; beyond this, sorted runs are spilled to --output_dir (default: {SORT_MEMORY})")
+	parser.add_argument("-z", "--bgzip", action="store_true",
+		help="Compress output VCFs with BGZF and index them with tabix as they're written, as metal.vcf.gz(.tbi) and so on")
+	parser.add_argument("-x", "--extract_jobs", default=1, type=int,
+		help="Number of VCFs whose breakpoints are extracted at a time, before comparing them; with 1, breakpoints are extracted as they're compared (default: 1)")
+	parser.add_argument("-c", "--cache_dir", default=None, type=str,
+		help="Path to directory caching breakpoints extracted from VCFs, to reuse them when Metal is rerun on the same VCFs")
+	parser.add_argument("--cache_size", default=CACHE_SIZE, type=int,
+		help=f"Size, in MB, the cache is kept under by removing the least recently used breakpoints (default: {CACHE_SIZE})")
+	parser.add_argument("--cache_by_content", action="store_true",
+		help="Recognize VCFs in the cache by a hash of their content, rather than by path, size and modification time")
+	parser.add_argument("--profile", action="store_true",
+		help="Profile the comparison of calls with cProfile, writing compare.prof to --output_dir (needs --threads 1)")
+	parser.add_argument("-R", "--regions", default=None, type=str,
+		help="Path to BED of target regions: only calls in them are compared, read with tabix where the VCFs are indexed")
+	parser.add_argument("--resume", action="store_true",
+		help="Finish a run already started in --output_dir that stopped partway, skipping the contigs it finished (the VCFs must be unchanged)")
+	parser.add_argument("--checkpoint_by_content", action="store_true",
+		help="Recognize the VCFs of a run to resume by a hash of their content, rather than by path, size and modification time")
+	args = parser.parse_args(argv)
+	streaming: bool = args.output_dir == STDIN_PATH
+	print(args, file=sys.stderr if streaming else sys.stdout)
+	assert args.dist_threshold > 0, "--dist_threshold must be positive"
+	assert args.thresholds is None or min(args.thresholds) > 0, "--thresholds must be positive"
+	assert args.thresholds is None or args.backend == "sweep", "--thresholds compares calls with the sweep backend"
+	assert args.threads > 0, "--threads must be positive"
+	assert args.sort_memory > 0, "--sort_memory must be positive"
+	assert args.cache_size >= 0, "--cache_size must not be negative"
+	assert args.extract_jobs > 0, "--extract_jobs must be positive"
+	assert not args.profile or args.threads == 1, "--profile profiles the comparison in this process, so needs --threads 1"
 
-	# get breakpoints
-	ref_fasta: Path = Path(args.ref_fasta)
-	output_dir: Path = Path(args.output_dir)
-	output_dir.mkdir(exist_ok=True) 
+	regions = None
+	if args.regions is not None:
+		assert Path(args.regions).is_file(), "--regions must be a BED file that exists"
+		regions = read_regions(args.regions)
 
-	get_breakpoints = "getBreakpoints.sh"
-	breakpoints_dir: Path = output_dir / "breakpoints/"
-	breakpoints_dir.mkdir(exist_ok=True)
+	cache = None
+	if args.cache_dir is not None:
+		cache = BreakpointCache(Path(args.cache_dir), args.cache_size * 1024 * 1024, args.cache_by_content)
 
 	vcfs = {
 		"scotch": args.scotch_vcf,
@@ -259,60 +1025,24 @@ if __name__ ==  "__main__":
 		"varscan": args.varscan_vcf,
 		"pindell": args.pindell_vcf,
 	}
-	breakpoints_tsvs = {}
+	if streaming:
+		assert args.threads == 1 and args.backend == "sweep" and args.extract_jobs == 1 and cache is None and not args.bgzip \
+			and not args.profile and args.thresholds is None and not args.resume, \
+			f"-o {STDIN_PATH} streams with one process and the sweep backend, without --extract_jobs, --cache_dir, --bgzip, --profile, --thresholds or --resume"
 
-	for caller_name, vcf in vcfs.items():
-		assert Path(vcf).is_file(), f"--{caller_name} must be a VCF file that exists"
-		breakpoints_tsv: Path = breakpoints_dir / f"{caller_name}.breakpoints.tsv"
-		
-		assert not breakpoints_tsv.exists(), f"Metal writes to {breakpoints_tsv} but that already exists: please delete or move"
-		run_script(get_breakpoints, vcf, breakpoints_tsv)
+		# metal.vcf goes to standard output, so messages go to standard error
+		output = sys.stdout
+		with redirect_stdout(sys.stderr):
+			stream_metal(vcfs, Path(args.ref_fasta), output, args.dist_threshold, regions)
+			print("Done.")
+		return
 
-		breakpoints_tsvs[caller_name] = breakpoints_tsv
-	
-	output_tsv: Path = output_dir / "metal.unsorted.tsv"
-	assert not output_tsv.exists(), f"Metal writes to {output_tsv} but that alredy exists: please delete or move"	
-	output = open(output_tsv, "w")
-	output_writer = csv.writer(output, delimiter=DELIMITER)
-
-	# compare breakpoints
-	with open(breakpoints_tsvs["scotch"]) as scotch_variants, \
-		open(breakpoints_tsvs["deepvariant"]) as deepvariant_variants, \
-		open(breakpoints_tsvs["gatkhc"]) as gatkhc_variants, \
-		open(breakpoints_tsvs["varscan"]) as varscan_variants, \
-		open(breakpoints_tsvs["pindell"]) as pindell_variants:
-
-		for indel_type in IndelType:
-
-			print(f"Comparing calls of type {indel_type}...")
-			all_readers = [
-				get_reader(scotch_variants, indel_type, Caller.SCOTCH),
-				get_reader(deepvariant_variants, indel_type, Caller.DEEPVARIANT),
-				get_reader(gatkhc_variants, indel_type, Caller.GATKHC),
-				get_reader(varscan_variants, indel_type, Caller.VARSCAN), 
-				get_reader(pindell_variants, indel_type, Caller.PINDELL)
-			]
-	
-			# remove None elements, readers with no variants
-			readers = [r for r in all_readers if r]
-
-			start_compare(readers)
-			# go back to start of file so can read again from start later
-			for variants_list in [scotch_variants, deepvariant_variants, gatkhc_variants,
-				varscan_variants, pindell_variants]:
-				variants_list.seek(0)
-	
-	output.close()
-
-	sorted_output_tsv: Path = output_dir / "metal.tsv"
-	assert not sorted_output_tsv.exists(), f"Metal writes to {sorted_output_tsv} but that already exists: please delete or move"
-	sort_output(output_tsv, sorted_output_tsv)
-
-	# make VCFs
-	print("Running makeVCFs.py...")
-	make_vcfs = "makeVCFs.py"
-
-	metal_output_stub: str = str((output_dir / "metal").resolve())
-	run_script(make_vcfs, sorted_output_tsv, ref_fasta, metal_output_stub)
+	run_metal(vcfs, Path(args.ref_fasta), Path(args.output_dir), args.dist_threshold, args.threads, args.backend,
+		args.sort_memory, cache=cache, extract_jobs=args.extract_jobs, bgzip=args.bgzip, regions=regions,
+		profile_compare=args.profile, thresholds=sorted(set(args.thresholds)) if args.thresholds is not None else None,
+		resume=args.resume, checkpoint_by_content=args.checkpoint_by_content)
 
 	print("Done.")
+
+if __name__ ==  "__main__":
+	main(sys.argv[1:])
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# Records how long each stage of a Metal run takes, how many records pass through it and how much memory it needs,
+# and counts the correlated calls by indel type and pair of callers, written to metrics.json in the output directory
+# Stages can be nested (e.g., breakpoints are extracted as the comparison reaches them): each stage's wall time
+# excludes the stages nested in it, so wall times add up to the run's
+# Used by metal.py and makeVCFs.py
+
+import cProfile
+from contextlib import contextmanager
+from itertools import islice
+import json
+from pathlib import Path
+import resource
+import sys
+import time
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+# constants
+METRICS_NAME = "metrics.json"
+# records made at a time by Metrics.timed
+TIMED_CHUNK_SIZE = 1024
+# output column of the callers that made a correlating call, the first being the one whose call it is
+CALLED_IN_INDEX = 4
+INDEL_TYPE_INDEX = 2
+
+# peak memory (RSS) of this process, or of its largest finished worker process if that's larger, in MB
+def get_peak_rss() -> float:
+	peak_rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+	# in bytes on macOS, KB elsewhere
+	return peak_rss / (1024 * 1024) if sys.platform == "darwin" else peak_rss / 1024
+
+# CPU time of this process and its finished worker processes
+def get_cpu_time() -> float:
+	return sum(usage.ru_utime + usage.ru_stime
+		for usage in [resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)])
+
+# Metrics of the stages of one run
+class Metrics:
+
+	def __init__(self) -> None:
+		# metrics by stage, in the order stages started
+		self.stages: Dict[str, Dict[str, Any]] = {}
+		# wall time of stages nested in each stage being timed, innermost last
+		self.nested_seconds: [float] = []
+		# correlated calls by indel type and callers that made them (as in the output)
+		self.called_in: Dict[Tuple[str, str], int] = {}
+		self.start = time.perf_counter()
+		self.cpu_start = get_cpu_time()
+
+	# metrics of a stage, started if it hasn't been
+	def get_stage(self, name: str) -> Dict[str, Any]:
+		return self.stages.setdefault(name, {"wall_seconds": 0.0, "records_in": 0, "records_out": 0})
+
+	# add wall time spent in a stage, which doesn't count towards the stage it's nested in
+	def add_seconds(self, stage: Dict[str, Any], seconds: float) -> None:
+		stage["wall_seconds"] += seconds
+		if self.nested_seconds:
+			self.nested_seconds[-1] += seconds
+
+	# time a block as a stage, yielding the stage's metrics to add records to
+	# also records CPU time (of this process and its workers, including stages nested in the block) and peak memory
+	@contextmanager
+	def stage(self, name: str) -> Iterator[Dict[str, Any]]:
+
+		stage = self.get_stage(name)
+		start = time.perf_counter()
+		cpu_start = get_cpu_time()
+		self.nested_seconds.append(0.0)
+		try:
+			yield stage
+		finally:
+			nested_seconds = self.nested_seconds.pop()
+			self.add_seconds(stage, time.perf_counter() - start - nested_seconds)
+			stage["cpu_seconds"] = stage.get("cpu_seconds", 0.0) + get_cpu_time() - cpu_start
+			stage["peak_rss_mb"] = get_peak_rss()
+
+	# yield the records of an iterator, timing the making of them as a stage (e.g., extraction)
+	# records are made TIMED_CHUNK_SIZE at a time, so the timer isn't read for every record,
+	# and only wall time is recorded, as reading CPU time as often would slow the run
+	def timed(self, name: str, records: Iterator[Any]) -> Iterator[Any]:
+
+		stage = self.get_stage(name)
+		records = iter(records)
+		while True:
+			start = time.perf_counter()
+			chunk = list(islice(records, TIMED_CHUNK_SIZE))
+			self.add_seconds(stage, time.perf_counter() - start)
+			if not chunk:
+				break
+			stage["records_out"] += len(chunk)
+			yield from chunk
+
+	# wrap a function to time each call as a stage, counting calls as records in (as for timed, only wall time)
+	def timed_call(self, name: str, function: Callable) -> Callable:
+
+		stage = self.get_stage(name)
+		def timed_function(*args: Any, **kwargs: Any) -> Any:
+			start = time.perf_counter()
+			try:
+				return function(*args, **kwargs)
+			finally:
+				self.add_seconds(stage, time.perf_counter() - start)
+				stage["records_in"] += 1
+		return timed_function
+
+	# yield output rows, counting correlated calls by indel type and callers
+	def count_correlates(self, rows: Iterator[List[str]]) -> Iterator[List[str]]:
+		called_in = self.called_in
+		for row in rows:
+			key = (row[INDEL_TYPE_INDEX], row[CALLED_IN_INDEX])
+			called_in[key] = called_in.get(key, 0) + 1
+			yield row
+
+	# correlated calls by indel type, and by indel type and pair of callers (the caller of a call, and a correlate)
+	def get_correlates(self) -> Tuple[Dict[str, int], Dict[str, Dict[str, int]]]:
+
+		correlated: Dict[str, int] = {}
+		correlates: Dict[str, Dict[str, int]] = {}
+		for (indel_type, called_in), count in self.called_in.items():
+			correlated[indel_type] = correlated.get(indel_type, 0) + count
+			pairs = correlates.setdefault(indel_type, {})
+			[caller, *correlate_callers] = called_in.split(",")
+			for correlate in correlate_callers:
+				pair = ",".join(sorted([caller, correlate]))
+				pairs[pair] = pairs.get(pair, 0) + count
+		return (correlated, {indel_type: dict(sorted(pairs.items())) for indel_type, pairs in correlates.items()})
+
+	# write the metrics as JSON
+	def write(self, path: Path) -> None:
+
+		(correlated, correlates) = self.get_correlates()
+		metrics = {
+			"wall_seconds": time.perf_counter() - self.start,
+			"cpu_seconds": get_cpu_time() - self.cpu_start,
+			"peak_rss_mb": get_peak_rss(),
+			"stages": self.stages,
+			"correlated": correlated,
+			"correlates": correlates
+		}
+		with open(path, "w") as f:
+			json.dump(metrics, f, indent="\t")
+			f.write("\n")
+
+# Passes rows on to writer, counting them as records out of a stage
+class CountingWriter:
+
+	def __init__(self, writer: Any, stage: Dict[str, Any]) -> None:
+		self.writer = writer
+		self.stage = stage
+
+	def writerow(self, row: List) -> None:
+		self.writer.writerow(row)
+		self.stage["records_out"] += 1
+
+# profile a block with cProfile, writing the profile to profile_path (read it with pstats or snakeviz)
+@contextmanager
+def profile(profile_path: Path) -> Iterator[None]:
+	profiler = cProfile.Profile()
+	profiler.enable()
+	try:
+		yield
+	finally:
+		profiler.disable()
+		profiler.dump_stats(str(profile_path))
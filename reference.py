@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+# Reference sequence access for writing VCFs
+# breakpoints are written in position order, so instead of fetching one base at a time from the FASTA,
+# CachedReference fetches a large chunk of a contig at once and serves lookups from it until the stream moves on
+# References can also be packed into a 2-bit (UCSC .2bit) file, read through a memory map,
+# so many worker processes share one copy at a quarter of the size of the FASTA. Convert a FASTA with
+# 	python reference.py [fasta ref] [2bit ref]
+
+from bisect import bisect_right
+from collections import OrderedDict
+import mmap
+from pathlib import Path
+import pysam
+import re
+import struct
+import sys
+from typing import Any, Dict, List, Tuple
+
+# constants
+# bases fetched from the FASTA at a time
+CHUNK_SIZE = 1 << 20
+# chunks of the current contig kept, so lookups a little behind or ahead of the stream
+# (like a deletion's end) don't evict the chunk the stream is in
+MAX_CHUNKS = 4
+
+# .2bit format (https://genome.ucsc.edu/FAQ/FAQformat.html#format7)
+TWO_BIT_SUFFIX = ".2bit"
+TWO_BIT_SIGNATURE = 0x1A412743
+# version 0 stores file offsets in 32 bits, version 1 in 64
+TWO_BIT_MAX_V0_SIZE = 1 << 32
+# bases are packed 4 to a byte, first base in the high bits
+TWO_BIT_BASES = "TCAG"
+# code of each byte of a sequence; N and other non-bases are packed as T, and covered by N blocks
+TWO_BIT_CODES = bytes(TWO_BIT_BASES.find(chr(byte).upper()) % 4 if chr(byte) in "TCAGtcag" else 0 for byte in range(256))
+# each packed byte unpacked into its 4 bases
+TWO_BIT_UNPACKED = [
+	"".join(TWO_BIT_BASES[(byte >> shift) & 3] for shift in (6, 4, 2, 0))
+	for byte in range(256)
+]
+# runs stored as N blocks: anything that isn't a base
+N_RUN = re.compile(r"[^ACGTacgt]+")
+# runs stored as mask blocks: soft-masked (lowercase) bases
+MASK_RUN = re.compile(r"[a-z]+")
+
+# Position and blocks of one sequence in a .2bit file
+class TwoBitSequence:
+
+	def __init__(self, data: Any, offset: int) -> None:
+		(self.length, n_block_count) = struct.unpack_from("<II", data, offset)
+		offset += 8
+		self.n_starts = list(struct.unpack_from(f"<{n_block_count}I", data, offset))
+		self.n_sizes = list(struct.unpack_from(f"<{n_block_count}I", data, offset + 4 * n_block_count))
+		offset += 8 * n_block_count
+
+		(mask_block_count,) = struct.unpack_from("<I", data, offset)
+		offset += 4
+		self.mask_starts = list(struct.unpack_from(f"<{mask_block_count}I", data, offset))
+		self.mask_sizes = list(struct.unpack_from(f"<{mask_block_count}I", data, offset + 4 * mask_block_count))
+		offset += 8 * mask_block_count
+
+		# skip reserved word
+		self.packed_offset = offset + 4
+
+	# blocks (from starts, sizes) overlapping start to end, as (start, end) pairs
+	@staticmethod
+	def get_overlapping(starts: List[int], sizes: List[int], start: int, end: int) -> List[Tuple[int, int]]:
+		overlapping = []
+		idx = max(bisect_right(starts, start) - 1, 0)
+		while idx < len(starts) and starts[idx] < end:
+			block_end = starts[idx] + sizes[idx]
+			if block_end > start:
+				overlapping.append((max(starts[idx], start), min(block_end, end)))
+			idx += 1
+		return overlapping
+
+# Reads a .2bit reference through a memory map,
+# with the subset of pysam.FastaFile methods used to write VCFs
+class TwoBitReference:
+
+	def __init__(self, path: str) -> None:
+		self.file = open(path, "rb")
+		self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+		(signature, version, sequence_count, _) = struct.unpack_from("<IIII", self.data, 0)
+		assert signature == TWO_BIT_SIGNATURE, f"{path} is not a .2bit file"
+		assert version in (0, 1), f"{path} has unknown .2bit version {version}"
+		offset_format = "<I" if version == 0 else "<Q"
+
+		# sequence offsets, by name, in file order; sequences are read when first fetched
+		self.offsets: Dict[str, int] = {}
+		self.sequences: Dict[str, TwoBitSequence] = {}
+		index_offset = 16
+		for _ in range(sequence_count):
+			name_size = self.data[index_offset]
+			name = self.data[index_offset + 1:index_offset + 1 + name_size].decode()
+			index_offset += 1 + name_size
+			(self.offsets[name],) = struct.unpack_from(offset_format, self.data, index_offset)
+			index_offset += struct.calcsize(offset_format)
+
+	def get_sequence(self, contig: str) -> TwoBitSequence:
+		sequence = self.sequences.get(contig)
+		if sequence is None:
+			if contig not in self.offsets:
+				raise KeyError(f"sequence '{contig}' not present")
+			sequence = TwoBitSequence(self.data, self.offsets[contig])
+			self.sequences[contig] = sequence
+		return sequence
+
+	@property
+	def references(self) -> Tuple[str]:
+		return tuple(self.offsets)
+
+	def get_reference_length(self, contig: str) -> int:
+		return self.get_sequence(contig).length
+
+	# return the sequence of contig from start to end (0-based, end exclusive), like pysam.FastaFile.fetch
+	def fetch(self, contig: str, start: int, end: int) -> str:
+		sequence = self.get_sequence(contig)
+		start = max(start, 0)
+		end = min(end, sequence.length)
+		if start >= end:
+			return ""
+
+		# unpack the bytes holding start to end
+		first_byte = start // 4
+		packed = self.data[sequence.packed_offset + first_byte:sequence.packed_offset + (end + 3) // 4]
+		bases = "".join([TWO_BIT_UNPACKED[byte] for byte in packed])
+		bases = bases[start - 4 * first_byte:end - 4 * first_byte]
+
+		for (block_start, block_end) in TwoBitSequence.get_overlapping(sequence.n_starts, sequence.n_sizes, start, end):
+			bases = bases[:block_start - start] + "N" * (block_end - block_start) + bases[block_end - start:]
+		for (block_start, block_end) in TwoBitSequence.get_overlapping(sequence.mask_starts, sequence.mask_sizes, start, end):
+			bases = bases[:block_start - start] + bases[block_start - start:block_end - start].lower() + bases[block_end - start:]
+		return bases
+
+	def close(self) -> None:
+		self.data.close()
+		self.file.close()
+
+	def __enter__(self) -> "TwoBitReference":
+		return self
+
+	def __exit__(self, *exc_info) -> None:
+		self.close()
+
+# pack one sequence into a .2bit sequence record
+def pack_sequence(seq: str) -> bytes:
+
+	n_blocks = [(m.start(), m.end() - m.start()) for m in N_RUN.finditer(seq)]
+	mask_blocks = [(m.start(), m.end() - m.start()) for m in MASK_RUN.finditer(seq)]
+
+	# codes 0-3 per base, padded to a multiple of 4 bases
+	codes = seq.encode().translate(TWO_BIT_CODES)
+	codes += bytes(-len(codes) % 4)
+
+	# pack 4 codes to a byte: each code is below 4, so shifting whole byte strings as big integers
+	# never carries between bytes
+	packed_int = 0
+	for shift, idx in zip((6, 4, 2, 0), range(4)):
+		packed_int |= int.from_bytes(codes[idx::4], "big") << shift
+	packed = packed_int.to_bytes(len(codes) // 4, "big")
+
+	def block_list(blocks: List[Tuple[int, int]]) -> bytes:
+		starts = [start for (start, _) in blocks]
+		sizes = [size for (_, size) in blocks]
+		return struct.pack(f"<I{len(blocks)}I{len(blocks)}I", len(blocks), *starts, *sizes)
+
+	return struct.pack("<I", len(seq)) + block_list(n_blocks) + block_list(mask_blocks) + struct.pack("<I", 0) + packed
+
+# convert a FASTA to a .2bit file, with sequences in the order of the FASTA
+def write_two_bit(fasta_path: str, two_bit_path: str) -> None:
+
+	with pysam.FastaFile(str(fasta_path)) as fasta:
+		names = list(fasta.references)
+		records_path = f"{two_bit_path}.records"
+
+		# write sequence records first, to learn their sizes
+		record_sizes = []
+		with open(records_path, "wb") as records:
+			for name in names:
+				print(f"Packing {name}...")
+				record = pack_sequence(fasta.fetch(name))
+				records.write(record)
+				record_sizes.append(len(record))
+
+	index_size = sum(1 + len(name.encode()) for name in names)
+	version = 0 if 16 + index_size + 4 * len(names) + sum(record_sizes) < TWO_BIT_MAX_V0_SIZE else 1
+	offset_format = "<I" if version == 0 else "<Q"
+	offset = 16 + index_size + struct.calcsize(offset_format) * len(names)
+
+	with open(two_bit_path, "wb") as two_bit, open(records_path, "rb") as records:
+		two_bit.write(struct.pack("<IIII", TWO_BIT_SIGNATURE, version, len(names), 0))
+		for name, record_size in zip(names, record_sizes):
+			encoded_name = name.encode()
+			two_bit.write(struct.pack("<B", len(encoded_name)) + encoded_name + struct.pack(offset_format, offset))
+			offset += record_size
+		while True:
+			block = records.read(CHUNK_SIZE)
+			if not block:
+				break
+			two_bit.write(block)
+
+	Path(records_path).unlink()
+
+# whether a reference is a .2bit file, rather than a FASTA
+def is_two_bit(path: str) -> bool:
+	return str(path).endswith(TWO_BIT_SUFFIX)
+
+# Wraps a FASTA (pysam.FastaFile) with the subset of its methods used to write VCFs,
+# caching chunks of the current contig
+class CachedReference:
+
+	def __init__(self, fasta: Any, chunk_size: int = CHUNK_SIZE, max_chunks: int = MAX_CHUNKS) -> None:
+		self.fasta = fasta
+		self.chunk_size = chunk_size
+		self.max_chunks = max_chunks
+
+		# chunks of the current contig, by index, least recently used first
+		self.contig = None
+		self.chunks: OrderedDict = OrderedDict()
+
+		# lookups served from a cached chunk, and lookups that had to fetch from the FASTA
+		self.hits = 0
+		self.misses = 0
+
+	@property
+	def references(self) -> Tuple[str]:
+		return self.fasta.references
+
+	def get_reference_length(self, contig: str) -> int:
+		return self.fasta.get_reference_length(contig)
+
+	# return the sequence of contig from start to end (0-based, end exclusive), like pysam.FastaFile.fetch
+	def fetch(self, contig: str, start: int, end: int) -> str:
+
+		chunk_idx = start // self.chunk_size
+		chunk_start = chunk_idx * self.chunk_size
+		if end - chunk_start > self.chunk_size or start < 0:
+			# spans chunks, so not worth caching
+			self.misses += 1
+			return self.fasta.fetch(contig, start, end)
+
+		if contig != self.contig:
+			# the stream has moved past the last contig
+			self.contig = contig
+			self.chunks.clear()
+
+		chunk = self.chunks.get(chunk_idx)
+		if chunk is None:
+			self.misses += 1
+			chunk = self.fasta.fetch(contig, chunk_start, chunk_start + self.chunk_size)
+			self.chunks[chunk_idx] = chunk
+			if len(self.chunks) > self.max_chunks:
+				self.chunks.popitem(last=False)
+		else:
+			self.hits += 1
+			self.chunks.move_to_end(chunk_idx)
+
+		return chunk[start - chunk_start:end - chunk_start]
+
+	# describe how many lookups were served from the cache
+	def get_stats(self) -> str:
+		lookups = self.hits + self.misses
+		hit_rate = self.hits / lookups if lookups else 0
+		return f"{self.hits} hits, {self.misses} misses ({hit_rate:.1%} hit rate)"
+
+	def close(self) -> None:
+		self.fasta.close()
+
+	def __enter__(self) -> "CachedReference":
+		return self
+
+	def __exit__(self, *exc_info) -> None:
+		self.close()
+
+# open a reference FASTA, or .2bit file, for writing VCFs
+def open_reference(fasta_path: str) -> CachedReference:
+	if is_two_bit(fasta_path):
+		return CachedReference(TwoBitReference(str(fasta_path)))
+	return CachedReference(pysam.FastaFile(str(fasta_path)))
+
+# reference opened once by each worker process of a pool, with open_worker_reference as its initializer
+worker_fasta: CachedReference = None
+
+def open_worker_reference(fasta_path: str) -> None:
+	global worker_fasta
+	worker_fasta = open_reference(fasta_path)
+
+# the reference the worker process this runs in opened
+def get_worker_reference() -> CachedReference:
+	return worker_fasta
+
+if __name__ == "__main__":
+
+	# parse args
+	fasta_path = sys.argv[1]
+	two_bit_path = sys.argv[2]
+
+	write_two_bit(fasta_path, two_bit_path)
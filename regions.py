@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# Target regions (e.g., exome or panel capture targets) read from a BED file
+# overlapping and adjacent intervals are merged, so each base is in at most one interval,
+# and VCFs can be read one interval at a time with tabix (see getBreakpoints.get_region_lines)
+# Used by metal.py, makeVCFs.py and encode.py with --regions
+
+from bisect import bisect_right
+from typing import Any, Dict, List, Tuple
+
+# constants
+# BED lines that aren't intervals
+BED_HEADER_PREFIXES = ("#", "track", "browser")
+
+# Merged intervals (0-based, end exclusive, as in BED) on each contig, with contigs in the order they're listed
+class Regions:
+
+	def __init__(self, intervals: Dict[str, List[Tuple[int, int]]]) -> None:
+		self.intervals = intervals
+		self.starts: Dict[str, List[int]] = {contig: [start for (start, _) in contig_intervals]
+			for contig, contig_intervals in intervals.items()}
+
+	@property
+	def contigs(self) -> List[str]:
+		return list(self.intervals)
+
+	# bases in the regions
+	def get_size(self) -> int:
+		return sum(end - start for contig_intervals in self.intervals.values() for (start, end) in contig_intervals)
+
+	# whether the base at (1-based) pos on chrom is in the regions
+	def contains(self, chrom: str, pos: int) -> bool:
+		starts = self.starts.get(chrom)
+		if starts is None:
+			return False
+		idx = bisect_right(starts, pos - 1) - 1
+		return idx >= 0 and pos - 1 < self.intervals[chrom][idx][1]
+
+# merge sorted (start, end) intervals that overlap or touch
+def merge_intervals(intervals: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+	merged: [Tuple[int, int]] = []
+	for (start, end) in intervals:
+		if merged and start <= merged[-1][1]:
+			merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+		else:
+			merged.append((start, end))
+	return merged
+
+# read the regions in a BED file, merging intervals that overlap or touch
+def read_regions(bed: str) -> Regions:
+
+	intervals: Dict[str, List[Tuple[int, int]]] = {}
+	with open(bed) as b:
+		for line in b:
+			if not line.strip() or line.startswith(BED_HEADER_PREFIXES):
+				continue
+			[chrom, start, end] = line.rstrip("\r\n").split("\t")[:3]
+			assert int(start) < int(end), f"BED {bed} has an empty interval {chrom}:{start}-{end}"
+			intervals.setdefault(chrom, []).append((int(start), int(end)))
+
+	return Regions({contig: merge_intervals(sorted(contig_intervals)) for contig, contig_intervals in intervals.items()})
+
+# Passes rows (starting with chrom and pos) in regions on to writer, dropping the rest
+class RegionWriter:
+
+	def __init__(self, writer: Any, regions: Regions) -> None:
+		self.writer = writer
+		self.regions = regions
+
+	def writerow(self, row: List) -> None:
+		if self.regions.contains(row[0], int(row[1])):
+			self.writer.writerow(row)
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+# A long-lived worker service that runs Metal on samples submitted to it over a unix socket
+# as in a batch (see batch.py), a pool of worker processes each opens the reference once, and keeps it (and pysam)
+# loaded for every sample it runs, so a sample pays for neither starting an interpreter nor opening the reference
+# submitted samples wait in a queue, in the order they were submitted, until a worker is free
+# Called as
+# 	python metal.py serve --socket [path] -r [fasta ref] --jobs N
+# with samples submitted by submit_sample, or as
+# 	python metal.py submit --socket [path] --manifest [samples tsv] --wait
+# Requests and responses are JSON objects, one per line, with a "command" (see MetalService.handle),
+# and responses to requests that failed have an "error"
+
+from batch import read_manifest, run_sample, SampleStatus, MANIFEST_COLUMNS, VCF_COLUMNS
+from concurrent.futures import ProcessPoolExecutor
+import json
+from metal import SORT_MEMORY
+import os
+from pathlib import Path
+import queue
+from reference import open_worker_reference
+import socket
+import socketserver
+import threading
+from types import SimpleNamespace
+from typing import Any, Dict, List
+
+# constants
+# states of a job
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+# options a sample can be submitted with, each defaulting to the service's
+JOB_OPTIONS = ["dist_threshold", "backend"]
+BACKENDS = ["sweep", "numpy"]
+
+# A sample submitted to the service
+class Job(SimpleNamespace):
+	job_id: int
+
+	# column values of the sample, as in a manifest (see batch.MANIFEST_COLUMNS)
+	sample: Dict[str, str]
+
+	dist_threshold: int
+
+	backend: str
+
+	# QUEUED, RUNNING, DONE or FAILED
+	state: str
+
+	# outcome of running Metal on the sample, None until it's finished
+	status: SampleStatus
+
+	# set once the sample is finished
+	finished: threading.Event
+
+	# the job as a JSON object
+	def get_summary(self) -> Dict[str, Any]:
+		return {
+			"job": self.job_id,
+			"sample": self.sample["sample"],
+			"output_dir": self.sample["output_dir"],
+			"state": self.state,
+			"seconds": self.status.seconds if self.status is not None else None,
+			"error": self.status.error if self.status is not None else None
+		}
+
+# Runs the samples submitted to it with a pool of worker processes that keep the reference open,
+# jobs samples at a time
+class MetalService:
+
+	def __init__(self, ref_fasta: Path, jobs: int, dist_threshold: int, backend: str, sort_memory: int) -> None:
+		self.ref_fasta = str(ref_fasta)
+		self.dist_threshold = dist_threshold
+		self.backend = backend
+		self.sort_memory = max(sort_memory // jobs, 1)
+		self.jobs: Dict[int, Job] = {}
+		self.lock = threading.Lock()
+		self.queue: queue.Queue = queue.Queue()
+		self.executor = ProcessPoolExecutor(max_workers=jobs, initializer=open_worker_reference, initargs=(self.ref_fasta,))
+		# each runner takes a job from the queue when its last one is finished, so at most jobs samples run at a time
+		self.runners = [threading.Thread(target=self.run_jobs, daemon=True) for _ in range(jobs)]
+		for runner in self.runners:
+			runner.start()
+
+	# queue a sample, returning its job
+	def submit(self, sample: Dict[str, str], options: Dict[str, Any]) -> Job:
+
+		missing_columns = [column for column in MANIFEST_COLUMNS if not sample.get(column)]
+		assert not missing_columns, f"Sample is missing {', '.join(missing_columns)}"
+		dist_threshold = options.get("dist_threshold") or self.dist_threshold
+		backend = options.get("backend") or self.backend
+		assert isinstance(dist_threshold, int) and dist_threshold > 0, "dist_threshold must be a positive integer"
+		assert backend in BACKENDS, f"backend must be one of {', '.join(BACKENDS)}"
+
+		with self.lock:
+			job = Job(job_id=len(self.jobs) + 1, sample=sample, dist_threshold=dist_threshold, backend=backend,
+				state=QUEUED, status=None, finished=threading.Event())
+			self.jobs[job.job_id] = job
+		self.queue.put(job)
+		print(f"Job {job.job_id}: {sample['sample']} queued", flush=True)
+		return job
+
+	# run queued jobs in the worker processes, one at a time, until the service closes
+	def run_jobs(self) -> None:
+
+		while True:
+			job: Job = self.queue.get()
+			if job is None:
+				break
+
+			job.state = RUNNING
+			future = self.executor.submit(run_sample, job.sample, self.ref_fasta, job.dist_threshold, job.backend,
+				self.sort_memory)
+			try:
+				job.status = future.result()
+			except Exception as e:
+				# the worker itself failed (e.g., it was killed), rather than Metal
+				job.status = SampleStatus(sample=job.sample["sample"], succeeded=False, seconds=0,
+					error=f"{type(e).__name__}: {e}")
+			job.state = DONE if job.status.succeeded else FAILED
+			job.finished.set()
+
+			outcome = "done" if job.status.succeeded else f"FAILED ({job.status.error})"
+			print(f"Job {job.job_id}: {job.status.sample} {outcome} in {job.status.seconds:.1f}s", flush=True)
+
+	def get_job(self, job_id: Any) -> Job:
+		job = self.jobs.get(job_id)
+		assert job is not None, f"No job {job_id}"
+		return job
+
+	# respond to a request:
+	# 	{"command": "submit", "sample": {...}} (with dist_threshold and backend optional) -> {"job": job id}
+	# 	{"command": "status"} (with job optional) -> {"jobs": [job summaries]}
+	# 	{"command": "wait", "job": job id} -> {"jobs": [the job's summary]}, once it's finished
+	# 	{"command": "shutdown"} -> {}, and the service stops once the samples already submitted are finished
+	def handle(self, request: Dict[str, Any], server: socketserver.BaseServer) -> Dict[str, Any]:
+
+		command = request.get("command")
+		if command == "submit":
+			job = self.submit(request.get("sample") or {}, {option: request.get(option) for option in JOB_OPTIONS})
+			return {"job": job.job_id}
+		elif command == "status":
+			jobs = [self.get_job(request["job"])] if request.get("job") is not None else list(self.jobs.values())
+			return {"jobs": [job.get_summary() for job in jobs]}
+		elif command == "wait":
+			job = self.get_job(request.get("job"))
+			job.finished.wait()
+			return {"jobs": [job.get_summary()]}
+		elif command == "shutdown":
+			# shutdown waits for the server to stop, which it can't while this request is being handled
+			threading.Thread(target=server.shutdown).start()
+			return {}
+		raise ValueError(f"Unknown command {command}")
+
+	# run the samples already submitted, then stop the worker processes
+	def close(self) -> None:
+		for _ in self.runners:
+			self.queue.put(None)
+		for runner in self.runners:
+			runner.join()
+		self.executor.shutdown()
+
+# Reads requests from a connection, one per line, writing a response to each
+class RequestHandler(socketserver.StreamRequestHandler):
+
+	def handle(self) -> None:
+		for line in self.rfile:
+			if not line.strip():
+				continue
+			try:
+				response = self.server.service.handle(json.loads(line), self.server)
+			except Exception as e:
+				response = {"error": f"{type(e).__name__}: {e}"}
+			self.wfile.write((json.dumps(response) + "\n").encode())
+			self.wfile.flush()
+
+# Handles each connection in a thread of its own, so waiting for a job doesn't hold up other requests
+class MetalServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+	daemon_threads = True
+
+# remove a socket left behind by a service that's no longer running, so a new one can listen on it
+def remove_stale_socket(socket_path: Path) -> None:
+
+	if not socket_path.exists():
+		return
+	assert socket_path.is_socket(), f"{socket_path} exists and isn't a socket: please delete or move it"
+	with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+		try:
+			s.connect(str(socket_path))
+		except ConnectionRefusedError:
+			socket_path.unlink()
+			return
+	raise AssertionError(f"A service is already listening on {socket_path}")
+
+# run the service on a unix socket at socket_path until it's sent a shutdown request (or interrupted)
+def serve(socket_path: Path, ref_fasta: Path, jobs: int, dist_threshold: int, backend: str = "sweep",
+	sort_memory: int = SORT_MEMORY) -> None:
+
+	socket_path = Path(socket_path)
+	remove_stale_socket(socket_path)
+	service = MetalService(ref_fasta, jobs, dist_threshold, backend, sort_memory)
+	try:
+		with MetalServer(str(socket_path), RequestHandler) as server:
+			server.service = service
+			print(f"Serving on {socket_path} with {jobs} processes...", flush=True)
+			try:
+				server.serve_forever()
+			except KeyboardInterrupt:
+				pass
+	finally:
+		if socket_path.is_socket():
+			socket_path.unlink()
+		print("Finishing submitted samples...")
+		service.close()
+
+# send a request to the service at socket_path, returning its response
+# raises an error if the request failed
+def send_request(socket_path: Path, request: Dict[str, Any]) -> Dict[str, Any]:
+
+	with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+		s.connect(str(socket_path))
+		s.sendall((json.dumps(request) + "\n").encode())
+		with s.makefile("rb") as responses:
+			line = responses.readline()
+
+	assert line, f"The service at {socket_path} closed the connection without responding"
+	response = json.loads(line)
+	if "error" in response:
+		raise RuntimeError(response["error"])
+	return response
+
+# submit a sample (its column values, as in a manifest) to the service at socket_path, returning its job id
+# paths are made absolute, as the service doesn't run in the same directory
+def submit_sample(socket_path: Path, sample: Dict[str, str], dist_threshold: int = None, backend: str = None) -> int:
+
+	sample = dict(sample)
+	for column in list(VCF_COLUMNS.values()) + ["output_dir"]:
+		if sample.get(column):
+			sample[column] = os.path.abspath(sample[column])
+	request = {"command": "submit", "sample": sample, "dist_threshold": dist_threshold, "backend": backend}
+	return send_request(socket_path, request)["job"]
+
+# wait for a job to finish, returning its summary
+def wait_for_job(socket_path: Path, job_id: int) -> Dict[str, Any]:
+	return send_request(socket_path, {"command": "wait", "job": job_id})["jobs"][0]
+
+# summaries of every job submitted to the service, or of one
+def get_jobs(socket_path: Path, job_id: int = None) -> List[Dict[str, Any]]:
+	return send_request(socket_path, {"command": "status", "job": job_id})["jobs"]
+
+# stop the service once the samples already submitted are finished
+def shutdown_service(socket_path: Path) -> None:
+	send_request(socket_path, {"command": "shutdown"})
+
+# submit every sample in a manifest, returning their job ids
+def submit_manifest(socket_path: Path, manifest: Path, dist_threshold: int = None, backend: str = None) -> List[int]:
+	return [submit_sample(socket_path, sample, dist_threshold, backend) for sample in read_manifest(manifest)]
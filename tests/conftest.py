@@ -0,0 +1,23 @@
+# Shared fixtures of Metal's tests
+# the modules are scripts at the top of the repository, so it's put on the path to import them
+
+from pathlib import Path
+import pytest
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmark import generate_inputs, CALLERS
+
+# synthetic inputs, as benchmark.py makes them: a reference FASTA (ref.fa, indexed) and a VCF for each caller,
+# with about 3000 breakpoints on 3 contigs
+@pytest.fixture(scope="session")
+def input_dir(tmp_path_factory: pytest.TempPathFactory) -> Path:
+	input_dir = tmp_path_factory.mktemp("inputs")
+	generate_inputs(input_dir, breakpoints=3000, contigs=3)
+	return input_dir
+
+# the callers' VCFs in input_dir, by key in metal.CALLER_VCF_KEYS
+@pytest.fixture(scope="session")
+def vcfs(input_dir: Path) -> dict:
+	return {caller: str(input_dir / f"{caller}.vcf") for caller in CALLERS}
@@ -0,0 +1,35 @@
+# Runs are resumed only with the inputs they were started with
+
+from checkpoint import hash_file, Checkpoint
+from pathlib import Path
+import pytest
+
+def test_inputs_keyed(tmp_path: Path) -> None:
+
+	vcf = tmp_path / "caller.vcf"
+	vcf.write_text("1\t100\n")
+	output_dir = tmp_path / "output"
+	output_dir.mkdir()
+
+	checkpoint = Checkpoint(output_dir, {"gatkhc": str(vcf)}, {"1": 0}, {})
+	assert str(vcf.resolve()) in checkpoint.inputs["gatkhc"]
+	Checkpoint(output_dir, {"gatkhc": str(vcf)}, {"1": 0}, {}, resume=True)
+
+	vcf.write_text("1\t100\n1\t200\n")
+	with pytest.raises(AssertionError, match="--gatkhc changed"):
+		Checkpoint(output_dir, {"gatkhc": str(vcf)}, {"1": 0}, {}, resume=True)
+
+def test_inputs_keyed_by_content(tmp_path: Path) -> None:
+
+	vcf = tmp_path / "caller.vcf"
+	vcf.write_text("1\t100\n")
+	output_dir = tmp_path / "output"
+	output_dir.mkdir()
+
+	checkpoint = Checkpoint(output_dir, {"gatkhc": str(vcf)}, {"1": 0}, {}, by_content=True)
+	assert checkpoint.inputs["gatkhc"] == hash_file(str(vcf))
+
+	# a copy of the VCF is the same input, and is recognized as the run was started, by content
+	copy = tmp_path / "copy.vcf"
+	copy.write_text(vcf.read_text())
+	Checkpoint(output_dir, {"gatkhc": str(copy)}, {"1": 0}, {}, resume=True)
@@ -0,0 +1,85 @@
+# The evaluator matches as many breakpoints as possible, holding only those within the tolerance
+
+from evaluate import match_breakpoints, Counts, QUERY, TRUTH
+from getBreakpoints import Breakpoint, DEL_L_CODE, INS_CODE, NO_LENGTH
+from metal import get_contig_ranks, get_readers, sort_breakpoints
+from pathlib import Path
+import pytest
+from typing import Dict, Iterator, List, Tuple
+
+# (key, breakpoint) of breakpoints of indel_type at positions on contig 1, as the evaluator reads them
+def get_keyed(positions: Iterator[int], indel_type: int = DEL_L_CODE) -> Iterator[Tuple[Tuple[Tuple[int, str], int], Breakpoint]]:
+	return ((((1, "1"), pos), Breakpoint("1", pos, indel_type, NO_LENGTH)) for pos in positions)
+
+# size of the largest matching of truth and query positions at most tolerance apart, by augmenting paths
+def get_max_matching(truth: List[int], query: List[int], tolerance: int) -> int:
+
+	matched_truth: Dict[int, int] = {}
+	def augment(query_idx: int, seen: set) -> bool:
+		for truth_idx, truth_pos in enumerate(truth):
+			if abs(truth_pos - query[query_idx]) <= tolerance and truth_idx not in seen:
+				seen.add(truth_idx)
+				if truth_idx not in matched_truth or augment(matched_truth[truth_idx], seen):
+					matched_truth[truth_idx] = query_idx
+					return True
+		return False
+
+	return sum(augment(query_idx, set()) for query_idx in range(len(query)))
+
+@pytest.mark.parametrize("tolerance", [0, 3, 10])
+def test_matches_max_matching(input_dir: Path, vcfs: dict, tolerance: int) -> None:
+
+	# positions of each indel type on each contig, called by two callers, one taken as the truth
+	contig_ranks = get_contig_ranks(input_dir / "ref.fa")
+	positions: Dict[Tuple[str, int], List[List[int]]] = {}
+	streams = []
+	for source, key in [(TRUTH, "gatkhc"), (QUERY, "varscan")]:
+		[reader] = get_readers({key: vcfs[key]}, contig_ranks)
+		stream = [(reader.key, reader.current)] + list(reader.reader)
+		for (_, breakpoint) in stream:
+			source_positions = positions.setdefault((breakpoint.chrom, breakpoint.indel_type), [[], []])[source]
+			if breakpoint.pos not in source_positions:
+				source_positions.append(breakpoint.pos)
+		streams.append(stream)
+
+	counts = match_breakpoints(*streams, tolerance)
+	for contig_type, (truth, query) in positions.items():
+		tp = get_max_matching(truth, query, tolerance)
+		assert counts[contig_type] == Counts(tp=tp, fp=len(query) - tp, fn=len(truth) - tp)
+
+# without a reference index, where contigs other than chromosomes share a rank
+@pytest.mark.parametrize("contigs", [["chr1", "chr2"], ["chrUn_a", "chrUn_b"]])
+def test_unindexed_contigs_matched_apart(contigs: List[str]) -> None:
+
+	# insertions a base apart on each contig, the first contig's within tolerance of the second's
+	truth = [Breakpoint(contigs[0], 100, INS_CODE, NO_LENGTH), Breakpoint(contigs[1], 101, INS_CODE, NO_LENGTH)]
+	query = [Breakpoint(contigs[0], 101, INS_CODE, NO_LENGTH), Breakpoint(contigs[1], 102, INS_CODE, NO_LENGTH)]
+
+	counts = match_breakpoints(sort_breakpoints(truth, {}), sort_breakpoints(query, {}), 3)
+	for chrom in contigs:
+		assert counts[(chrom, INS_CODE)] == Counts(tp=1, fp=0, fn=0)
+
+# A breakpoint counting how many are held
+class HeldBreakpoint(Breakpoint):
+	held = 0
+
+	def __new__(cls, *fields) -> "HeldBreakpoint":
+		HeldBreakpoint.held += 1
+		return super().__new__(cls, *fields)
+
+	def __del__(self) -> None:
+		HeldBreakpoint.held -= 1
+
+def test_unmatched_run_not_held() -> None:
+
+	# one truth breakpoint, then a long run of query breakpoints, keeping how many breakpoints were held at most
+	max_held = 0
+	def get_query() -> Iterator[Tuple[Tuple[Tuple[int, str], int], Breakpoint]]:
+		nonlocal max_held
+		for pos in range(100, 100000, 10):
+			max_held = max(max_held, HeldBreakpoint.held)
+			yield (((1, "1"), pos), HeldBreakpoint("1", pos, DEL_L_CODE, NO_LENGTH))
+
+	counts = match_breakpoints(get_keyed([10]), get_query(), 3)
+	assert counts[("1", DEL_L_CODE)] == Counts(tp=0, fp=9990, fn=1)
+	assert max_held <= 4
@@ -0,0 +1,101 @@
+# Streaming comparison holds only breakpoints near the ones being compared
+
+import metal
+from metal import correlate_calls, get_readers, start_compare, stream_metal, CallList, CorrelatedCall, Caller, SortedOutput
+from pathlib import Path
+import io
+import pytest
+import shutil
+from typing import Dict, Iterator, List
+
+VCF_HEADER = "##fileformat=VCFv4.1\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tSAMPLE\n"
+# deletions called after the insertion, this far apart, up to CONTIG_END
+DEL_GAP = 10
+CONTIG_END = 100000
+
+# Holds rows as SortedOutput does, keeping the most it held at once
+class MaxSortedOutput(SortedOutput):
+
+	def __init__(self, writer: CallList) -> None:
+		super().__init__(writer)
+		self.max_held = 0
+
+	def writerow(self, row: List[str]) -> None:
+		super().writerow(row)
+		self.max_held = max(self.max_held, len(self.heap))
+
+# VCFs of two callers calling the same insertion near the start of contig chrom, then only deletions to CONTIG_END
+def write_long_deletion_vcfs(tmp_path: Path, chrom: str = "1") -> Dict[str, str]:
+	records = [f"{chrom}\t100\t.\tA\tAT\t50\tPASS\t.\tGT\t0/1\n"]
+	records += [f"{chrom}\t{pos}\t.\tAC\tA\t50\tPASS\t.\tGT\t0/1\n" for pos in range(200, CONTIG_END, DEL_GAP)]
+	vcfs = {}
+	for key in ["deepvariant", "gatkhc"]:
+		vcfs[key] = str(tmp_path / f"{key}.vcf")
+		Path(vcfs[key]).write_text(VCF_HEADER + "".join(records))
+	return vcfs
+
+def test_sorted_output_bounded(tmp_path: Path) -> None:
+
+	vcfs = write_long_deletion_vcfs(tmp_path)
+	rows = CallList()
+	sorted_output = MaxSortedOutput(rows)
+	start_compare(get_readers(vcfs, {}), sorted_output, 3, sorted_output.advance)
+	sorted_output.flush()
+
+	# the insertion and both breakpoints of each deletion, the two callers' rows for each being duplicates
+	assert len(rows) == 1 + 2 * len(range(200, CONTIG_END, DEL_GAP))
+	assert sorted_output.max_held <= 8
+
+# contigs are ranked without a reference index, chr-prefixed ones as the chromosomes they name
+@pytest.mark.parametrize("chrom", ["1", "chr1"])
+def test_correlate_calls_lazy(tmp_path: Path, monkeypatch: pytest.MonkeyPatch, chrom: str) -> None:
+
+	# count the breakpoints extracted from the VCFs
+	extracted = 0
+	get_caller_breakpoints = metal.get_caller_breakpoints
+	def get_counted_breakpoints(*args) -> Iterator:
+		nonlocal extracted
+		for breakpoint in get_caller_breakpoints(*args):
+			extracted += 1
+			yield breakpoint
+	monkeypatch.setattr(metal, "get_caller_breakpoints", get_counted_breakpoints)
+
+	calls = correlate_calls(write_long_deletion_vcfs(tmp_path, chrom))
+	assert next(calls) == CorrelatedCall(chrom, 100, "<INS>", 1, (Caller.DEEPVARIANT, Caller.GATKHC))
+	# just the breakpoints up to the first deletion's, rather than the whole contig's
+	assert extracted <= 10
+
+def test_stream_metal_unindexed_contigs(tmp_path: Path, input_dir: Path) -> None:
+
+	# a reference without an index, so contigs other than chromosomes share a rank
+	ref_fasta = tmp_path / "ref.fa"
+	shutil.copyfile(input_dir / "ref.fa", ref_fasta)
+	with open(ref_fasta, "a") as fasta:
+		for chrom in ["chrUn_a", "chrUn_b"]:
+			fasta.write(f">{chrom}\n{'ACGT' * 1000}\n")
+
+	# insertions called by both callers at chrUn_b:50, and by one caller only elsewhere:
+	# chrUn_a:1000 and chrUn_b:1001 would correlate if the contigs were swept as one
+	vcfs = {"deepvariant": str(tmp_path / "deepvariant.vcf"), "gatkhc": str(tmp_path / "gatkhc.vcf")}
+	Path(vcfs["deepvariant"]).write_text(VCF_HEADER + "".join(f"{chrom}\t{pos}\t.\tA\tAT\t50\tPASS\t.\tGT\t0/1\n"
+		for chrom, pos in [("chrUn_a", 1000), ("chrUn_a", 2000), ("chrUn_b", 50)]))
+	Path(vcfs["gatkhc"]).write_text(VCF_HEADER + "".join(f"{chrom}\t{pos}\t.\tA\tAT\t50\tPASS\t.\tGT\t0/1\n"
+		for chrom, pos in [("chrUn_b", 51), ("chrUn_b", 1001)]))
+
+	output = io.StringIO()
+	stream_metal(vcfs, ref_fasta, output, 3)
+	rows = [line.split("\t") for line in output.getvalue().splitlines() if not line.startswith("#")]
+	assert [(row[0], row[1]) for row in rows] == [("chrUn_b", "50"), ("chrUn_b", "51")]
+
+def test_correlate_calls_unindexed_contigs(tmp_path: Path) -> None:
+
+	# insertions called by both callers at chrUn_b:50, and by one caller only on chrUn_a, which shares its rank
+	vcfs = {"deepvariant": str(tmp_path / "deepvariant.vcf"), "gatkhc": str(tmp_path / "gatkhc.vcf")}
+	Path(vcfs["deepvariant"]).write_text(VCF_HEADER + "".join(f"{chrom}\t{pos}\t.\tA\tAT\t50\tPASS\t.\tGT\t0/1\n"
+		for chrom, pos in [("chrUn_a", 1000), ("chrUn_a", 2000), ("chrUn_b", 50)]))
+	Path(vcfs["gatkhc"]).write_text(VCF_HEADER + "".join(f"{chrom}\t{pos}\t.\tA\tAT\t50\tPASS\t.\tGT\t0/1\n"
+		for chrom, pos in [("chrUn_b", 51), ("chrUn_b", 1001)]))
+
+	assert list(correlate_calls(vcfs, dist_threshold=3)) == [
+		CorrelatedCall("chrUn_b", 50, "<INS>", 1, (Caller.DEEPVARIANT, Caller.GATKHC)),
+		CorrelatedCall("chrUn_b", 51, "<INS>", 1, (Caller.GATKHC, Caller.DEEPVARIANT))]
@@ -0,0 +1,45 @@
+# The numpy backend writes the same rows, in the same order, as the sweep
+
+from metal import get_contig_ranks, get_readers, start_compare, CallList
+from pathlib import Path
+import pytest
+
+pytest.importorskip("numpy")
+from vectorized import start_compare_arrays
+
+# unindexed contigs the input contigs are renamed to, in the order they're ranked without an index:
+# chromosome 1, then the others, which share a rank, by name
+CHR_CONTIGS = {"1": "chr1", "2": "chrUn_a", "3": "chrUn_b"}
+
+# the callers' VCFs, with contigs renamed to CHR_CONTIGS
+@pytest.fixture(scope="module")
+def chr_vcfs(tmp_path_factory: pytest.TempPathFactory, vcfs: dict) -> dict:
+	chr_dir = tmp_path_factory.mktemp("chr_inputs")
+	chr_vcfs = {}
+	for caller, vcf in vcfs.items():
+		chr_vcfs[caller] = str(chr_dir / Path(vcf).name)
+		with open(vcf) as f, open(chr_vcfs[caller], "w") as chr_vcf:
+			for line in f:
+				if not line.startswith("#"):
+					chrom, rest = line.split("\t", 1)
+					line = f"{CHR_CONTIGS[chrom]}\t{rest}"
+				chr_vcf.write(line)
+	return chr_vcfs
+
+# with and without a reference index, as contigs are ranked differently without one,
+# and with chr-prefixed contigs, some sharing a rank, without one
+@pytest.mark.parametrize("contigs", ["indexed", "unindexed", "chr"])
+@pytest.mark.parametrize("dist_threshold", [1, 3, 25])
+def test_arrays_match_sweep(request: pytest.FixtureRequest, input_dir: Path, dist_threshold: int, contigs: str) -> None:
+
+	contig_ranks = get_contig_ranks(input_dir / "ref.fa") if contigs == "indexed" else {}
+	vcfs = request.getfixturevalue("chr_vcfs" if contigs == "chr" else "vcfs")
+	sweep_rows = CallList()
+	start_compare(get_readers(vcfs, contig_ranks), sweep_rows, dist_threshold)
+	array_rows = CallList()
+	start_compare_arrays(vcfs, contig_ranks, array_rows, dist_threshold)
+
+	assert sweep_rows
+	assert array_rows == sweep_rows
+	if contigs == "chr":
+		assert {row[0] for row in sweep_rows} == set(CHR_CONTIGS.values())
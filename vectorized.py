@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# Compares indel breakpoints with NumPy arrays instead of sweeping over VariantReaders
+# each caller's breakpoints are loaded into typed arrays once,
+# then correlating calls are found for every breakpoint at once with np.searchsorted
+# Used by metal.py with --backend numpy, and writes the same rows in the same order as start_compare
+
+from breakpointStore import get_caller_columns
+from getBreakpoints import BREAKPOINT_TAGS, INS_CODE, NO_LENGTH
+from metal import Caller, CALLER_VCF_KEYS, DIST_THRESHOLD, get_contig_key
+import numpy as np
+from types import SimpleNamespace
+from typing import Any, Dict
+
+# constants
+CALLERS: [Caller] = list(CALLER_VCF_KEYS)
+# indel types by code, as stored in breakpoint columns
+INDEL_TYPES: [str] = BREAKPOINT_TAGS
+# search keys hold (contig, indel type) above these bits and position below them
+POS_BITS = 40
+# bit of each caller in a CALLED_BY bitmask
+CALLER_BITS: Dict[Caller, int] = {caller_name: 1 << idx for idx, caller_name in enumerate(CALLERS)}
+# Scotch and Pindel insertions must have correlates in DeepVariant, GATK HC, or VarScan
+SCOTCH_PINDEL_MASK: int = CALLER_BITS[Caller.SCOTCH] | CALLER_BITS[Caller.PINDELL]
+# stands in for "no correlate from this caller" in arrays of merge indices
+NO_MATCH = np.iinfo(np.int64).max
+
+# Breakpoints from every caller, one array element per breakpoint
+class BreakpointArrays(SimpleNamespace):
+	# index of calling caller in CALLERS
+	caller: np.ndarray
+
+	# index of the breakpoint's contig in contigs
+	contig: np.ndarray
+
+	# rank of the breakpoint's contig among the breakpoints' contigs, in the order the sweep visits them
+	rank: np.ndarray
+
+	position: np.ndarray
+
+	# index of indel type in INDEL_TYPES
+	indel_type: np.ndarray
+
+	# indel length, NO_LENGTH where the caller didn't report it
+	length: np.ndarray
+
+	# index of breakpoint among its caller's breakpoints, in the order they were extracted
+	seq: np.ndarray
+
+	# names of contigs
+	contigs: [str]
+
+# load the breakpoints in the callers' VCFs or stores (or in one contig of them, or in regions,
+# or not on skip_contigs) into arrays
+# a store's columns are used as they are, without building a record per breakpoint
+def load_breakpoints(vcfs: Dict[str, str], contig_ranks: Dict[str, int], contig: str = None,
+	regions: Any = None, skip_contigs: set = None) -> BreakpointArrays:
+
+	columns = {name: [] for name in ["caller", "contig", "position", "indel_type", "length", "seq"]}
+	contig_ids: Dict[str, int] = {}
+
+	for caller_idx, caller_name in enumerate(CALLERS):
+		(caller_contigs, caller_columns) = get_caller_columns(vcfs[CALLER_VCF_KEYS[caller_name]], contig, regions,
+			skip_contigs)
+		count = len(caller_columns["position"])
+		if not count:
+			continue
+
+		# ids of the caller's contigs, by the caller's contig ids
+		caller_contig_ids = np.array([contig_ids.setdefault(c, len(contig_ids)) for c in caller_contigs], dtype=np.int64)
+		caller_contig = np.asarray(caller_columns["contig"]).astype(np.int64)
+
+		columns["caller"].append(np.full(count, caller_idx, dtype=np.int64))
+		columns["contig"].append(caller_contig_ids[caller_contig])
+		columns["position"].append(np.asarray(caller_columns["position"]).astype(np.int64))
+		columns["indel_type"].append(np.asarray(caller_columns["indel_type"]).astype(np.int64))
+		columns["length"].append(np.asarray(caller_columns["length"]).astype(np.int64))
+		columns["seq"].append(np.arange(count, dtype=np.int64))
+
+	arrays = {name: np.concatenate(column) if column else np.empty(0, dtype=np.int64) for name, column in columns.items()}
+
+	# contigs are ranked by key (see metal.get_contig_key), as contigs missing from the reference index can share a rank
+	contig_order = sorted(contig_ids, key=lambda c: get_contig_key(c, contig_ranks))
+	contig_rank = np.empty(len(contig_ids), dtype=np.int64)
+	contig_rank[[contig_ids[c] for c in contig_order]] = np.arange(len(contig_order), dtype=np.int64)
+	return BreakpointArrays(contigs=list(contig_ids), rank=contig_rank[arrays["contig"]], **arrays)
+
+# for each breakpoint, the merge index of the first correlating call from each caller (NO_MATCH if none)
+# the merge index is a breakpoint's place in the (contig rank, position, caller) order the sweep visits
+def get_first_correlates(breakpoints: BreakpointArrays, merge_idx: np.ndarray, dist_threshold: int) -> np.ndarray:
+
+	# calls correlate if they are on the same contig, have the same indel type and are less than dist_threshold apart
+	# positions are far below 1 << POS_BITS, so a window never reaches into another (contig, indel type)
+	search_key = ((breakpoints.contig * len(INDEL_TYPES) + breakpoints.indel_type) << POS_BITS) | breakpoints.position
+	is_scotch_pindel_ins = ((breakpoints.indel_type == INS_CODE) &
+		((np.left_shift(1, breakpoints.caller) & SCOTCH_PINDEL_MASK) != 0))
+
+	first_correlates = np.full((len(search_key), len(CALLERS)), NO_MATCH, dtype=np.int64)
+	for caller_idx, caller_name in enumerate(CALLERS):
+
+		# this caller's breakpoints in search key order, ties in the order they were extracted
+		other = np.flatnonzero(breakpoints.caller == caller_idx)
+		if not len(other):
+			continue
+		other = other[np.lexsort((breakpoints.seq[other], search_key[other]))]
+		other_key = search_key[other]
+
+		# window of this caller's breakpoints around each breakpoint
+		lo = np.searchsorted(other_key, search_key - (dist_threshold - 1), side="left")
+		hi = np.searchsorted(other_key, search_key + (dist_threshold - 1), side="right")
+
+		is_correlate = (hi > lo) & (breakpoints.caller != caller_idx)
+		if CALLER_BITS[caller_name] & SCOTCH_PINDEL_MASK:
+			is_correlate &= ~is_scotch_pindel_ins
+
+		# the earliest breakpoint in the window is the first the sweep would pair with this one
+		first = merge_idx[other[np.minimum(lo, len(other) - 1)]]
+		first_correlates[:, caller_idx] = np.where(is_correlate, first, NO_MATCH)
+
+	return first_correlates
+
+# for each breakpoint, a key giving the order the sweep writes it in
+# the sweep writes a breakpoint when the first breakpoint on its contig at least dist_threshold past it is merged,
+# or when the contig ends, either way emptying the window of each indel type in turn
+def get_write_order(breakpoints: BreakpointArrays, merge_idx: np.ndarray, merge_order: np.ndarray,
+	dist_threshold: int) -> np.ndarray:
+
+	# keys are in merge order, so the first key at least dist_threshold past a breakpoint's is the breakpoint evicting it
+	merged_rank = breakpoints.rank[merge_order]
+	merged_key = (merged_rank << POS_BITS) | breakpoints.position[merge_order]
+	evicted_by = np.searchsorted(merged_key, ((breakpoints.rank << POS_BITS) | breakpoints.position) + dist_threshold,
+		side="left")
+	evicted_by_clipped = np.minimum(evicted_by, len(merged_key) - 1)
+	is_evicted = (evicted_by < len(merged_key)) & (merged_rank[evicted_by_clipped] == breakpoints.rank)
+
+	# a window emptied at the end of a contig is written after every breakpoint of the contig is merged
+	contig_end = np.searchsorted(merged_rank, breakpoints.rank, side="right") - 1
+
+	written_after = np.where(is_evicted, 2 * evicted_by, 2 * contig_end + 1)
+	return np.lexsort((merge_idx, breakpoints.indel_type, written_after))
+
+# compare the breakpoints in the callers' VCFs (or in one contig of them, or in regions, or not on skip_contigs),
+# writing correlated calls
+def start_compare_arrays(vcfs: Dict[str, str], contig_ranks: Dict[str, int], output_writer: Any,
+	dist_threshold: int = DIST_THRESHOLD, contig: str = None, regions: Any = None, skip_contigs: set = None) -> None:
+
+	breakpoints = load_breakpoints(vcfs, contig_ranks, contig, regions, skip_contigs)
+	if not len(breakpoints.position):
+		return
+
+	merge_order = np.lexsort((breakpoints.seq, breakpoints.caller, breakpoints.position, breakpoints.rank))
+	merge_idx = np.empty_like(merge_order)
+	merge_idx[merge_order] = np.arange(len(merge_order))
+
+	first_correlates = get_first_correlates(breakpoints, merge_idx, dist_threshold)
+
+	# CALLED_BY caller sets as bitmasks
+	caller_bit = np.left_shift(1, breakpoints.caller)
+	called_by = caller_bit.copy()
+	for caller_idx in range(len(CALLERS)):
+		called_by |= np.where(first_correlates[:, caller_idx] != NO_MATCH, 1 << caller_idx, 0)
+	has_correlates = called_by != caller_bit
+
+	# CALLED_BY lists correlates in the order they were found, so also encode that order,
+	# as base len(CALLERS) + 1 digits of caller index + 1, to key a cache of CALLED_BY strings
+	correlate_order = np.argsort(first_correlates, axis=1, kind="stable")
+	called_by_code = np.zeros(len(first_correlates), dtype=np.int64)
+	for column in range(len(CALLERS)):
+		caller_idx = correlate_order[:, column]
+		is_correlate = (called_by >> caller_idx) & 1 & (caller_idx != breakpoints.caller)
+		called_by_code = np.where(is_correlate == 1, called_by_code * (len(CALLERS) + 1) + caller_idx + 1, called_by_code)
+
+	called_in_cache: Dict[tuple, str] = {}
+	def get_called_in(caller_idx: int, code: int) -> str:
+		called_in = called_in_cache.get((caller_idx, code))
+		if called_in is None:
+			correlates: [Caller] = []
+			remaining = code
+			while remaining:
+				(remaining, correlate_idx) = divmod(remaining, len(CALLERS) + 1)
+				correlates.insert(0, CALLERS[correlate_idx - 1])
+			called_in = ",".join([CALLERS[caller_idx].value] + [c.value for c in correlates])
+			called_in_cache[(caller_idx, code)] = called_in
+		return called_in
+
+	write_order = get_write_order(breakpoints, merge_idx, merge_order, dist_threshold)
+	write_order = write_order[has_correlates[write_order]]
+
+	for (caller_idx, contig_idx, pos, indel_type, length, code) in zip(
+		breakpoints.caller[write_order].tolist(),
+		breakpoints.contig[write_order].tolist(),
+		breakpoints.position[write_order].tolist(),
+		breakpoints.indel_type[write_order].tolist(),
+		breakpoints.length[write_order].tolist(),
+		called_by_code[write_order].tolist()):
+
+		output_writer.writerow([breakpoints.contigs[contig_idx], str(pos), INDEL_TYPES[indel_type],
+			"NA" if length == NO_LENGTH else str(length), get_called_in(caller_idx, code)])